@@ -3,4 +3,4 @@
 __version__ = '0.0.0'
 VERSION = __version__
 
-from . import boards, cameras, utils
\ No newline at end of file
+from . import boards, cameras, utils, cache, live, selection, undistort, markers
\ No newline at end of file
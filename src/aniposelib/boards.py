@@ -2,7 +2,9 @@ import cv2
 import numpy as np
 from abc import ABC, abstractmethod
 from tqdm import trange
-from collections import defaultdict
+from collections import defaultdict, deque
+import queue
+import threading
 
 
 def get_video_params_cap(cap):
@@ -23,6 +25,98 @@ def get_video_params(fname):
     return params
 
 
+class VideoFrameReader:
+    """Decodes the frames [start, end) of an opened video on a background thread, keeping up to
+    maxsize frames queued ahead of the detection loop of detect_video.
+
+    Frames the skip logic of detect_video cannot need are only grabbed, not retrieved, and are
+    handed out as None. The reader does not know the detection results ahead of time, so a frame
+    that follows a detection still pending is retrieved anyway. The caller reports every frame
+    with done() so the reader can tell which frames are needed. The detection state is read and
+    written under a lock, so the reader never sees a detection without the frame it was reported for.
+    """
+
+    def __init__(self, cap, start=0, end=int(1e9), skip=20, go=None, maxsize=32):
+        self.cap = cap
+        self.start = start
+        self.end = end
+        self.skip = skip
+        self.window = int(skip / 2)
+        if go is None:
+            go = self.window
+        # the initial skip state works like a detection just before the first frame
+        self.last_detected = start + go - self.window
+        self.last_done = start - 1
+        self.lock = threading.Lock()
+        self.queue = queue.Queue(maxsize=maxsize)
+        self.stopped = threading.Event()
+        self.error = None
+        self.thread = threading.Thread(target=self._run, daemon=True)
+
+    def start_reading(self):
+        self.thread.start()
+        return self
+
+    def is_needed(self, framenum, retrieved):
+        with self.lock:
+            last_detected = self.last_detected
+            last_done = self.last_done
+        if framenum % self.skip == 0 or last_detected > framenum - self.window:
+            return True
+        # frames retrieved earlier in the window whose detection is not done yet may start a new window
+        return any(m > last_done and m > framenum - self.window for m in retrieved)
+
+    def _put(self, item):
+        while not self.stopped.is_set():
+            try:
+                self.queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _run(self):
+        retrieved = deque(maxlen=max(self.window, 1))
+        try:
+            for framenum in range(self.start, self.end):
+                if not self.cap.grab():
+                    break
+                frame = None
+                if self.is_needed(framenum, retrieved):
+                    ret, frame = self.cap.retrieve()
+                    if not ret:
+                        break
+                    retrieved.append(framenum)
+                if not self._put((framenum, frame)):
+                    return
+        except Exception as e:
+            # raised from read() once the frames before it are consumed
+            self.error = e
+        finally:
+            # the end is always marked, the detection loop would wait on the queue forever otherwise
+            self._put((None, None))
+
+    def read(self):
+        """
+        Returns the next (framenum, frame), frame is None for skipped frames and framenum is None at the end.
+        Raises the exception of the reader thread, if reading the video failed.
+        """
+        framenum, frame = self.queue.get()
+        if framenum is None and self.error is not None:
+            raise self.error
+        return framenum, frame
+
+    def done(self, framenum, detected):
+        with self.lock:
+            if detected:
+                self.last_detected = framenum
+            self.last_done = framenum
+
+    def stop(self):
+        self.stopped.set()
+        self.thread.join()
+
+
 def fix_rvec(rvec, tvec):
     # https://github.com/opencv/opencv/issues/8813
     T = tvec.ravel()[0]
@@ -256,6 +350,84 @@ def extract_rtvecs(merged, cam_names=None, min_cameras=1, board=None, cameras=No
     return rtvecs
 
 
+def split_video_chunks(nframes, chunk_size=2000):
+    """Splits the frames of a video into [start, end) ranges of at most chunk_size frames."""
+    return [(start, min(start + chunk_size, nframes)) for start in range(0, nframes, chunk_size)]
+
+
+def stitch_video_chunks(board, vidname, chunks, prefix=None, skip=20):
+    """Takes the results of CalibrationObject.detect_video_range for consecutive chunks of one video,
+    each detected starting from a guessed skip state, and returns exactly the rows detect_video would give.
+    Whenever the true skip state entering a chunk differs from the guessed one, the frames are replayed
+    with the true state until both agree again, only detecting frames that were not examined before.
+    """
+    rows = []
+    go = int(skip / 2)
+    cap = None
+    cap_pos = None
+
+    for chunk in sorted(chunks, key=lambda c: c['start']):
+        start, end = chunk['start'], chunk['end']
+        states = chunk['states']
+        detections = chunk['detections']
+        stop = False
+
+        framenum = start
+        while framenum < end:
+            if states[framenum - start] == -1:
+                stop = True
+                break
+            if states[framenum - start] == go:
+                break
+
+            if framenum % skip != 0 and go <= 0:
+                framenum += 1
+                continue
+
+            if framenum in detections:
+                found = detections[framenum]
+            else:
+                if cap is None:
+                    cap = cv2.VideoCapture(vidname)
+                if cap_pos != framenum:
+                    cap.set(cv2.CAP_PROP_POS_FRAMES, framenum)
+                ret, frame = cap.read()
+                if not ret:
+                    stop = True
+                    break
+                cap_pos = framenum + 1
+                corners, ids = board.detect_image(frame)
+                found = (corners, ids) if corners is not None and len(corners) > 0 else None
+
+            if found is not None:
+                key = framenum if prefix is None else (prefix, framenum)
+                rows.append({'framenum': key, 'corners': found[0], 'ids': found[1]})
+                go = int(skip / 2)
+
+            go = max(0, go - 1)
+            framenum += 1
+
+        if stop:
+            break
+
+        # from here on the guessed states are the true ones
+        for num in sorted(detections):
+            if num >= framenum and detections[num] is not None:
+                key = num if prefix is None else (prefix, num)
+                rows.append({'framenum': key, 'corners': detections[num][0], 'ids': detections[num][1]})
+
+        if states[-1] == -1:
+            break
+        go = states[-1] if framenum < end else go
+
+    if cap is not None:
+        cap.release()
+
+    rows = board.fill_points_rows(rows)
+
+    return rows
+
+
 class CalibrationObject(ABC):
     @abstractmethod
     def draw(self, size):
@@ -336,32 +508,89 @@ class CalibrationObject(ABC):
         else:
             it = range(length)
         
-        for framenum in it:
-            ret, frame = cap.read()
-            if not ret:
-                break
-            if framenum % skip != 0 and go <= 0:
-                continue
+        reader = VideoFrameReader(cap, 0, length, skip=skip).start_reading()
+        
+        try:
+            for framenum in it:
+                num, frame = reader.read()
+                if num is None:
+                    break
+                if framenum % skip != 0 and go <= 0:
+                    reader.done(framenum, False)
+                    continue
             
-            corners, ids = self.detect_image(frame)
+                corners, ids = self.detect_image(frame)
             
-            if corners is not None and len(corners) > 0:
-                if prefix is None:
-                    key = framenum
+                if corners is not None and len(corners) > 0:
+                    if prefix is None:
+                        key = framenum
+                    else:
+                        key = (prefix, framenum)
+                    go = int(skip / 2)
+                    row = {'framenum': key, 'corners': corners, 'ids': ids}
+                    rows.append(row)
+                    reader.done(framenum, True)
                 else:
-                    key = (prefix, framenum)
-                go = int(skip / 2)
-                row = {'framenum': key, 'corners': corners, 'ids': ids}
-                rows.append(row)
+                    reader.done(framenum, False)
             
-            go = max(0, go - 1)
-        
+                go = max(0, go - 1)
+        finally:
+            reader.stop()
         cap.release()
         
         rows = self.fill_points_rows(rows)
         
         return rows
     
+    def detect_video_range(self, vidname, start, end, skip=20, go=None):
+        """Runs the detect_video loop over the frames [start, end) of a video only.
+        go is the skip state on entry to the first frame, it defaults to the state detect_video starts with.
+        Returns a dict with the detections of every frame that was examined (None if nothing was found)
+        and the go state on entry to every frame of the range plus the exit state (-1 once reading failed).
+        The result is meant to be passed to stitch_video_chunks, which rebuilds the rows of detect_video.
+        """
+        cap = cv2.VideoCapture(vidname)
+        if not cap.isOpened():
+            raise FileNotFoundError(f'missing video file "{vidname}"')
+        if start > 0:
+            cap.set(cv2.CAP_PROP_POS_FRAMES, start)
+
+        if go is None:
+            go = int(skip / 2)
+
+        states = np.full(end - start + 1, -1, dtype='int32')
+        detections = dict()
+
+        reader = VideoFrameReader(cap, start, end, skip=skip, go=go).start_reading()
+
+        try:
+            for framenum in range(start, end):
+                num, frame = reader.read()
+                if num is None:
+                    break
+                states[framenum - start] = go
+                if framenum % skip != 0 and go <= 0:
+                    reader.done(framenum, False)
+                    continue
+
+                corners, ids = self.detect_image(frame)
+
+                if corners is not None and len(corners) > 0:
+                    detections[framenum] = (corners, ids)
+                    go = int(skip / 2)
+                else:
+                    detections[framenum] = None
+                reader.done(framenum, detections[framenum] is not None)
+
+                go = max(0, go - 1)
+            else:
+                states[-1] = go
+        finally:
+            reader.stop()
+        cap.release()
+
+        return {'start': start, 'end': end, 'states': states, 'detections': detections}
+    
     def estimate_pose_rows(self, camera, rows):
         for row in rows:
             rvec, tvec = self.estimate_pose_points(camera, row['corners'], row['ids'])
@@ -533,6 +762,8 @@ class CharucoBoard(CalibrationObject):
         self.squaresY = squaresY
         self.square_length = square_length
         self.marker_length = marker_length
+        self.marker_bits = marker_bits
+        self.dict_size = dict_size
         self.manually_verify = manually_verify
         
         # import aruco only here so that we only require opencv-contrib-python when using ChArUco module
@@ -546,8 +777,11 @@ class CharucoBoard(CalibrationObject):
             (4, 1000): aruco.DICT_4X4_1000, (5, 1000): aruco.DICT_5X5_1000, (6, 1000): aruco.DICT_6X6_1000,
             (7, 1000): aruco.DICT_7X7_1000}
         
-        dkey = (marker_bits, dict_size)
-        self.dictionary = aruco.getPredefinedDictionary(ARUCO_DICTS[dkey])
+        if aruco_dict is None:
+            dkey = (marker_bits, dict_size)
+            self.dictionary = aruco.getPredefinedDictionary(ARUCO_DICTS[dkey])
+        else:
+            self.dictionary = aruco_dict
         
         self.board = aruco.CharucoBoard((squaresX, squaresY), square_length, marker_length, self.dictionary)
         
@@ -561,6 +795,21 @@ class CharucoBoard(CalibrationObject):
         self.empty_detection = np.zeros((total_size, 1, 2)) * np.nan
         self.total_size = total_size
     
+    def __getstate__(self):
+        # the opencv aruco objects cannot be pickled, so the board is rebuilt from its parameters
+        # (needed to send the board to the detection worker processes)
+        # the dictionary is kept as its marker bytes, it may be a custom one
+        return {'squaresX': self.squaresX, 'squaresY': self.squaresY, 'square_length': self.square_length,
+                'marker_length': self.marker_length, 'marker_bits': self.marker_bits,
+                'dict_size': self.dict_size, 'manually_verify': self.manually_verify,
+                'dictionary': (self.dictionary.bytesList, self.dictionary.markerSize,
+                               self.dictionary.maxCorrectionBits)}
+    
+    def __setstate__(self, state):
+        from cv2 import aruco
+        bytes_list, marker_size, max_correction_bits = state.pop('dictionary')
+        self.__init__(aruco_dict=aruco.Dictionary(bytes_list, marker_size, max_correction_bits), **state)
+    
     def get_size(self):
         size = (self.squaresX, self.squaresY)
         return size
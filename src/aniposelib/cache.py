@@ -0,0 +1,200 @@
+import os
+import glob
+import hashlib
+import json
+
+import cv2
+import numpy as np
+
+CACHE_VERSION = 1
+# entries are named <path key>_<params key>.npz, 16 hex digits each. The .tmp.npz files being
+# written by another process do not match
+KEY_PATTERN = '[0-9a-f]' * 16
+
+
+def get_board_definition(board):
+    """Returns the parameters that define what a board detects, as a json serializable dict."""
+    definition = {'type': type(board).__name__}
+    for k, v in sorted(vars(board).items()):
+        if isinstance(v, (bool, int, float, str)):
+            definition[k] = v
+    return definition
+
+
+def get_video_fingerprint(vidname, content=False, block_size=1 << 20):
+    """Describes the current state of a video file.
+    By default uses the size and modification time, with content=True it hashes
+    the first, middle and last block of the file instead of the modification time."""
+    stat = os.stat(vidname)
+    if not content:
+        return {'size': stat.st_size, 'mtime': stat.st_mtime_ns}
+
+    h = hashlib.sha1()
+    with open(vidname, 'rb') as f:
+        for offset in [0, max(0, stat.st_size // 2 - block_size // 2), max(0, stat.st_size - block_size)]:
+            f.seek(offset)
+            h.update(f.read(block_size))
+    return {'size': stat.st_size, 'hash': h.hexdigest()}
+
+
+def pack_rows(rows):
+    """Packs the rows of a single video into flat arrays. The prefix of the frame keys is dropped."""
+    framenums = np.array([r['framenum'][-1] if isinstance(r['framenum'], tuple) else r['framenum']
+                          for r in rows], dtype='int64')
+    counts = np.array([len(r['corners']) for r in rows], dtype='int64')
+
+    if len(rows) > 0:
+        corners = np.concatenate([np.asarray(r['corners']).reshape(-1, 2) for r in rows])
+        ids = np.concatenate([np.asarray(r['ids']).ravel() for r in rows]).astype('int32')
+        ids_ndim = np.asarray(rows[0]['ids']).ndim
+    else:
+        corners = np.zeros((0, 2), dtype='float32')
+        ids = np.zeros(0, dtype='int32')
+        ids_ndim = 2
+
+    return {'framenums': framenums, 'counts': counts, 'corners': corners,
+            'ids': ids, 'ids_ndim': np.int64(ids_ndim)}
+
+
+def unpack_rows(packed, prefix=None):
+    """Reverses pack_rows, with prefix added back to the frame keys as detect_video does."""
+    rows = []
+    bounds = np.concatenate([[0], np.cumsum(packed['counts'])])
+    ids_ndim = int(packed['ids_ndim'])
+
+    for i, num in enumerate(packed['framenums']):
+        a, b = bounds[i], bounds[i + 1]
+        corners = packed['corners'][a:b].reshape(-1, 1, 2)
+        ids = packed['ids'][a:b]
+        if ids_ndim == 2:
+            ids = ids.reshape(-1, 1)
+        key = int(num) if prefix is None else (prefix, int(num))
+        rows.append({'framenum': key, 'corners': corners, 'ids': ids})
+
+    return rows
+
+
+class DetectionCache:
+    """Stores the board detections of calibration videos on disk, so that calibrating the same
+    videos again (for instance with other bundle adjustment settings) skips the detection.
+
+    Entries are keyed by the video path, its size and modification time (or content hash),
+    the board definition and the detection parameters. Each entry is a compressed .npz file
+    and the least recently used entries are evicted once the cache is bigger than max_size bytes.
+    An entry bigger than max_size on its own is not stored.
+    """
+
+    def __init__(self, cache_dir=None, max_size=2 * 1024 ** 3, hash_content=False):
+        if cache_dir is None:
+            cache_dir = os.path.join(os.path.expanduser('~'), '.cache', 'improved-camera-control', 'detections')
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+        self.hash_content = hash_content
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    def _path_key(self, vidname):
+        path = os.path.normcase(os.path.abspath(vidname))
+        return hashlib.sha1(path.encode()).hexdigest()[:16]
+
+    def get_fname(self, vidname, board, skip=20):
+        params = {'version': CACHE_VERSION,
+                  'opencv': cv2.__version__,
+                  'video': get_video_fingerprint(vidname, content=self.hash_content),
+                  'board': get_board_definition(board),
+                  'skip': skip}
+        params_key = hashlib.sha1(json.dumps(params, sort_keys=True).encode()).hexdigest()[:16]
+        return os.path.join(self.cache_dir, '{}_{}.npz'.format(self._path_key(vidname), params_key))
+
+    def get(self, vidname, board, prefix=None, skip=20):
+        """Returns the cached rows of a video, or None if there are none."""
+        fname = self.get_fname(vidname, board, skip)
+        if not os.path.exists(fname):
+            return None
+
+        try:
+            with np.load(fname) as packed:
+                rows = unpack_rows(packed, prefix=prefix)
+        except (OSError, ValueError, KeyError):
+            os.remove(fname)
+            return None
+
+        # mark as recently used for the eviction
+        os.utime(fname)
+        return board.fill_points_rows(rows)
+
+    def put(self, vidname, board, rows, skip=20):
+        """Stores the rows of a video. Entries of the same path made before the video changed are removed."""
+        fname = self.get_fname(vidname, board, skip)
+        fingerprint = json.dumps(get_video_fingerprint(vidname, content=self.hash_content), sort_keys=True)
+
+        for other in glob.glob(self.get_fname_pattern(vidname)):
+            try:
+                with np.load(other) as packed:
+                    stale = str(packed['fingerprint']) != fingerprint
+            except (OSError, ValueError, KeyError):
+                stale = True
+            if stale:
+                remove_entry(other)
+
+        tmp_fname = fname[:-len('.npz')] + '.tmp.npz'
+        np.savez_compressed(tmp_fname, fingerprint=np.array(fingerprint), **pack_rows(rows))
+        if self.max_size is not None and os.path.getsize(tmp_fname) > self.max_size:
+            # would be evicted right away, along with every other entry
+            os.remove(tmp_fname)
+            return None
+        os.replace(tmp_fname, fname)
+
+        self.evict()
+        return fname
+
+    def get_fname_pattern(self, vidname):
+        return os.path.join(self.cache_dir, '{}_{}.npz'.format(self._path_key(vidname), KEY_PATTERN))
+
+    def get_entries(self):
+        """Returns the files of the entries of the cache, without the entries still being written."""
+        return glob.glob(os.path.join(self.cache_dir, '{}_{}.npz'.format(KEY_PATTERN, KEY_PATTERN)))
+
+    def invalidate(self, vidname):
+        """Removes all the cached detections of a video."""
+        for fname in glob.glob(self.get_fname_pattern(vidname)):
+            remove_entry(fname)
+
+    def clear(self):
+        """Removes every entry of the cache."""
+        for fname in self.get_entries():
+            remove_entry(fname)
+
+    def get_size(self):
+        return sum(size for _, size, _ in get_stats(self.get_entries()))
+
+    def evict(self):
+        """Removes the least recently used entries until the cache fits in max_size."""
+        if self.max_size is None:
+            return
+        entries = get_stats(self.get_entries())
+        total = sum(size for _, size, _ in entries)
+        for _, size, fname in sorted(entries):
+            if total <= self.max_size:
+                break
+            remove_entry(fname)
+            total -= size
+
+
+def get_stats(fnames):
+    """Returns the (modification time, size, file) of the entries, the entries removed meanwhile by another process are left out."""
+    stats = []
+    for fname in fnames:
+        try:
+            stat = os.stat(fname)
+        except FileNotFoundError:
+            continue
+        stats.append((stat.st_mtime, stat.st_size, fname))
+    return stats
+
+
+def remove_entry(fname):
+    # another process may have removed it first
+    try:
+        os.remove(fname)
+    except FileNotFoundError:
+        pass
@@ -11,13 +11,15 @@ import itertools
 from tqdm import trange
 from pprint import pprint
 import time
+import os
+from concurrent.futures import ProcessPoolExecutor
 
 from .boards import merge_rows, extract_points, \
-    extract_rtvecs, get_video_params
+    extract_rtvecs, get_video_params, split_video_chunks, stitch_video_chunks
 from .utils import get_initial_extrinsics, make_M, get_rtvec, \
     get_connections
 
-@jit(nopython=True, parallel=True)
+@jit(nopython=True, parallel=True, cache=True)
 def triangulate_simple(points, camera_mats):
     num_cams = len(camera_mats)
     A = np.zeros((num_cams * 2, 4))
@@ -32,23 +34,47 @@ def triangulate_simple(points, camera_mats):
     return p3d
 
 
+def warm_up():
+    """Compiles the numba functions ahead of their first use, e.g. from a background thread.
+    triangulate_simple is cached on disk, so it only compiles once per installation.
+    The object mode methods cannot be cached and are compiled again in every session."""
+    start = time.perf_counter()
+    cgroup = CameraGroup([Camera(size=(640, 480)), Camera(size=(640, 480), tvec=np.array([1.0, 0, 0]))])
+    p2ds = np.random.random((2, 4, 2))
+    p3ds = cgroup.triangulate(p2ds, undistort=False)
+    cgroup.reprojection_error(p3ds, p2ds, mean=False)
+    cgroup.reprojection_error(p3ds, p2ds, mean=True)
+    return time.perf_counter() - start
+
+
+def get_pairs(n_cams):
+    """Returns the two columns of the camera pairs (i, j), i < j, in the order of itertools.combinations."""
+    first, second = np.triu_indices(n_cams, k=1)
+    return first, second
+
 def get_error_dict(errors_full, min_points=10):
+    """Returns the number of points and the 15th and 75th percentiles of the mean error of the two cameras,
+    for every pair of cameras that both see more than min_points points.
+    All the pairs are computed at once, the errors of the points a pair does not see are sorted last."""
     n_cams = errors_full.shape[0]
     errors_norm = np.linalg.norm(errors_full, axis=2)
-
     good = ~np.isnan(errors_full[:, :, 0])
 
-    error_dict = dict()
+    first, second = get_pairs(n_cams)
+    subset = good[first] & good[second]
+    counts = np.sum(subset, axis=1)
+    err_mean = np.where(subset, (errors_norm[first] + errors_norm[second]) / 2, np.inf)
+    err_mean.sort(axis=1)
 
-    for i in range(n_cams):
-        for j in range(i+1, n_cams):
-            subset = good[i] & good[j]
-            err_subset = errors_norm[:, subset][[i, j]]
-            err_subset_mean = np.mean(err_subset, axis=0)
-            if np.sum(subset) > min_points:
-                percents = np.percentile(err_subset_mean, [15, 75])
-                # percents = np.percentile(err_subset, [25, 75])
-                error_dict[(i, j)] = (err_subset.shape[1], percents)
+    # linear interpolation between the closest ranks, as np.percentile does
+    error_dict = dict()
+    for pair in np.flatnonzero(counts > min_points):
+        ranks = np.array([15, 75]) / 100 * (counts[pair] - 1)
+        low = np.floor(ranks).astype('int64')
+        high = np.minimum(low + 1, counts[pair] - 1)
+        values = err_mean[pair]
+        percents = values[low] + (values[high] - values[low]) * (ranks - low)
+        error_dict[(int(first[pair]), int(second[pair]))] = (int(counts[pair]), percents)
     return error_dict
 
 def check_errors(cgroup, imgp):
@@ -68,60 +94,83 @@ def subset_extra(extra, ixs):
     }
     return new_extra
 
-def resample_points_extra(imgp, extra, n_samp=25):
+def resample_points_extra(imgp, extra, n_samp=25, rng=None):
+    """Picks whole boards, the boards seen by most points of a camera first, until every camera has n_samp points.
+    rng is a np.random.Generator or a seed, random if None."""
+    rng = np.random.default_rng(rng)
     n_cams, n_points, _ = imgp.shape
     ids = remap_ids(extra['ids'])
-    n_ids = np.max(ids)+1
-    good = ~np.isnan(imgp[:, :, 0])
-    ixs = np.arange(n_points)
-
-    cam_counts = np.zeros((n_ids, n_cams), dtype='int64')
-    for idnum in range(n_ids):
-        cam_counts[idnum] = np.sum(good[:, ids == idnum], axis=1)
-    cam_counts_random = cam_counts + np.random.random(size=cam_counts.shape)
+    # points without a board id are never picked, the ids may be floats with NaN
+    valid_ixs = np.flatnonzero(~np.isnan(ids)) if ids.dtype.kind == 'f' else np.arange(len(ids))
+    ids = ids[valid_ixs].astype('int64')
+    n_ids = np.max(ids)+1 if len(ids) > 0 else 0
+    good = ~np.isnan(imgp[:, valid_ixs, 0])
+
+    cam_counts = np.stack([np.bincount(ids, weights=good[cam_num], minlength=n_ids)
+                           for cam_num in range(n_cams)], axis=1).astype('int64')
+    cam_counts_random = cam_counts + rng.random(size=cam_counts.shape)
     best_boards = np.argsort(-cam_counts_random, axis=0)
 
     cam_totals = np.zeros(n_cams, dtype='int64')
 
-    include = set()
+    include = np.zeros(n_ids, dtype='bool')
     for cam_num in range(n_cams):
-        for board_id in best_boards[:, cam_num]:
-            include.update(ixs[ids == board_id])
-            cam_totals += cam_counts[board_id]
-            if cam_totals[cam_num] >= n_samp or \
-               cam_counts_random[board_id, cam_num] < 1:
-                break
-
-    final_ixs = sorted(include)
+        order = best_boards[:, cam_num]
+        # totals after adding every board in order, the first board reaching n_samp or unseen is the last one
+        totals = cam_totals + np.cumsum(cam_counts[order], axis=0)
+        stop = (totals[:, cam_num] >= n_samp) | (cam_counts_random[order, cam_num] < 1)
+        last = np.argmax(stop) if np.any(stop) else len(order) - 1
+        include[order[:last + 1]] = True
+        cam_totals = totals[last]
+
+    final_ixs = valid_ixs[include[ids]]
     newp = imgp[:, final_ixs]
     extra = subset_extra(extra, final_ixs)
     return newp, extra
 
-def resample_points(imgp, extra=None, n_samp=25):
+def resample_points(imgp, extra=None, n_samp=25, rng=None):
+    """Picks n_samp points seen by every pair of cameras, the points seen by more cameras first and randomly
+    among the points seen by as many cameras. The cameras seeing each point are a bitmask and the points are
+    counted per bitmask, so only the points at the cut of each pair are drawn.
+    rng is a np.random.Generator or a seed, random if None."""
     # if extra is not None:
     #     return resample_points_extra(imgp, extra, n_samp)
 
+    rng = np.random.default_rng(rng)
     n_cams = imgp.shape[0]
     good = ~np.isnan(imgp[:, :, 0])
-    ixs = np.arange(imgp.shape[1])
-
-    num_cams = np.sum(~np.isnan(imgp[:, :, 0]), axis=0)
-
-    include = set()
-
-    for i in range(n_cams):
-        for j in range(i+1, n_cams):
-            subset = good[i] & good[j]
-            n_good = np.sum(subset)
-            if n_good > 0:
-                ## pick points, prioritizing points seen by more cameras
-                arr = np.copy(num_cams[subset]).astype('float64')
-                arr += np.random.random(size=arr.shape)
-                picked_ix = np.argsort(-arr)[:n_samp]
-                picked = ixs[subset][picked_ix]
-                include.update(picked)
+    cam_bits = np.left_shift(1, np.arange(n_cams, dtype='int64'))
+    masks = cam_bits @ good
+
+    # points grouped by bitmask
+    order = np.argsort(masks, kind='stable')
+    mask_counts = np.bincount(masks, minlength=1 << n_cams)
+    mask_starts = np.concatenate([[0], np.cumsum(mask_counts)])
+    all_masks = np.arange(1 << n_cams)
+    mask_num_cams = np.sum((all_masks[:, None] & cam_bits) > 0, axis=1)
+
+    include_masks = np.zeros(len(all_masks), dtype='bool')
+    drawn = []
+    first, second = get_pairs(n_cams)
+    for bits in cam_bits[first] | cam_bits[second]:
+        seen = (all_masks & bits) == bits
+        n_picked = 0
+        ## pick points, prioritizing points seen by more cameras
+        for level in range(n_cams, 1, -1):
+            level_masks = np.flatnonzero(seen & (mask_num_cams == level))
+            count = np.sum(mask_counts[level_masks])
+            if n_picked + count <= n_samp:
+                include_masks[level_masks] = True
+                n_picked += count
+            else:
+                candidates = np.concatenate([order[mask_starts[m]:mask_starts[m + 1]] for m in level_masks])
+                drawn.append(rng.choice(candidates, n_samp - n_picked, replace=False))
+                break
 
-    final_ixs = sorted(include)
+    include = include_masks[masks]
+    for picked in drawn:
+        include[picked] = True
+    final_ixs = np.flatnonzero(include)
     newp = imgp[:, final_ixs]
     extra = subset_extra(extra, final_ixs)
     return newp, extra
@@ -145,10 +194,12 @@ def interpolate_data(vals):
     return out
 
 def remap_ids(ids):
-    unique_ids = np.unique(ids)
+    """Returns the ids renumbered 0 to n-1 in increasing order, NaN ids are left NaN."""
+    ids = np.asarray(ids)
     ids_out = np.copy(ids)
-    for i, num in enumerate(unique_ids):
-        ids_out[ids == num] = i
+    valid = ~np.isnan(ids) if ids.dtype.kind == 'f' else np.ones(ids.shape, dtype='bool')
+    _, inverse = np.unique(ids[valid], return_inverse=True)
+    ids_out[valid] = inverse
     return ids_out
 
 def transform_points(points, rvecs, tvecs):
@@ -658,13 +709,14 @@ class CameraGroup:
                            max_nfev=200, ftol=1e-4,
                            n_samp_iter=100, n_samp_full=1000,
                            error_threshold=0.3,
-                           verbose=False):
+                           verbose=False, rng=None):
         """Given an CxNx2 array of 2D points,
         where N is the number of points and C is the number of cameras,
         this performs iterative bundle adjustsment to fine-tune the parameters of the cameras.
         That is, it performs bundle adjustment multiple times, adjusting the weights given to points
         to reduce the influence of outliers.
         This is inspired by the algorithm for Fast Global Registration by Zhou, Park, and Koltun
+        The points are resampled with rng, a np.random.Generator or a seed, so a seed gives the same calibration.
         """
 
         assert p2ds.shape[0] == len(self.cameras), \
@@ -673,11 +725,12 @@ class CameraGroup:
                 len(self.cameras), p2ds.shape
             )
 
+        rng = np.random.default_rng(rng)
         p2ds_full = p2ds
         extra_full = extra
 
         p2ds, extra = resample_points(p2ds_full, extra_full,
-                                      n_samp=n_samp_full)
+                                      n_samp=n_samp_full, rng=rng)
         error = self.average_error(p2ds, median=True)
 
         if verbose:
@@ -690,7 +743,7 @@ class CameraGroup:
 
         for i in range(n_iters):
             p2ds, extra = resample_points(p2ds_full, extra_full,
-                                          n_samp=n_samp_full)
+                                          n_samp=n_samp_full, rng=rng)
             p3ds = self.triangulate(p2ds)
             errors_full = self.reprojection_error(p3ds, p2ds, mean=False)
             errors_norm = self.reprojection_error(p3ds, p2ds, mean=True)
@@ -707,7 +760,7 @@ class CameraGroup:
             good = errors_norm < mu
             extra_good = subset_extra(extra, good)
             p2ds_samp, extra_samp = resample_points(
-                p2ds[:, good], extra_good, n_samp=n_samp_iter)
+                p2ds[:, good], extra_good, n_samp=n_samp_iter, rng=rng)
 
             error = np.median(errors_norm)
 
@@ -721,11 +774,11 @@ class CameraGroup:
             self.bundle_adjust(p2ds_samp, extra_samp,
                                loss='linear', ftol=ftol,
                                max_nfev=max_nfev,
-                               verbose=verbose)
+                               verbose=verbose, rng=rng)
 
 
         p2ds, extra = resample_points(p2ds_full, extra_full,
-                                      n_samp=n_samp_full)
+                                      n_samp=n_samp_full, rng=rng)
         p3ds = self.triangulate(p2ds)
         errors_full = self.reprojection_error(p3ds, p2ds, mean=False)
         errors_norm = self.reprojection_error(p3ds, p2ds, mean=True)
@@ -746,7 +799,7 @@ class CameraGroup:
         self.bundle_adjust(p2ds[:, good], extra_good,
                            loss='linear',
                            ftol=ftol, max_nfev=max(200, max_nfev),
-                           verbose=verbose)
+                           verbose=verbose, rng=rng)
 
         error = self.average_error(p2ds, median=True)
 
@@ -768,7 +821,7 @@ class CameraGroup:
                       max_nfev=1000,
                       weights=None,
                       start_params=None,
-                      verbose=True):
+                      verbose=True, rng=None):
         """Given an CxNx2 array of 2D points,
         where N is the number of points and C is the number of cameras,
         this performs bundle adjustsment to fine-tune the parameters of the cameras"""
@@ -782,7 +835,7 @@ class CameraGroup:
         if extra is not None:
             extra['ids_map'] = remap_ids(extra['ids'])
 
-        x0, n_cam_params = self._initialize_params_bundle(p2ds, extra)
+        x0, n_cam_params = self._initialize_params_bundle(p2ds, extra, rng=rng)
 
         if start_params is not None:
             x0 = start_params
@@ -926,7 +979,7 @@ class CameraGroup:
 
         return A_sparse
 
-    def _initialize_params_bundle(self, p2ds, extra):
+    def _initialize_params_bundle(self, p2ds, extra, rng=None):
         """Given an CxNx2 array of 2D points,
         where N is the number of points and C is the number of cameras,
         initializes the parameters for bundle adjustment"""
@@ -953,12 +1006,15 @@ class CameraGroup:
             tvecs = np.zeros((n_boards, 3), dtype='float64')
 
             if 'rvecs' in extra and 'tvecs' in extra:
+                rng = np.random.default_rng(rng)
                 rvecs_all = extra['rvecs']
                 tvecs_all = extra['tvecs']
+                # first point of every board, the ids are remapped to 0 to n_boards-1
+                _, first_points = np.unique(ids, return_index=True)
                 for board_num in range(n_boards):
-                    point_id = np.where(ids == board_num)[0][0]
+                    point_id = first_points[board_num]
                     cam_ids_possible = np.where(~np.isnan(p2ds[:, point_id, 0]))[0]
-                    cam_id = np.random.choice(cam_ids_possible)
+                    cam_id = rng.choice(cam_ids_possible)
                     M_cam = self.cameras[cam_id].get_extrinsics_mat()
                     M_board_cam = make_M(rvecs_all[cam_id, point_id],
                                          tvecs_all[cam_id, point_id])
@@ -1570,17 +1626,79 @@ class CameraGroup:
 
         return error
 
-    def get_rows_videos(self, videos, board, verbose=True):
-        all_rows = []
-
-        for cix, (cam, cam_videos) in enumerate(zip(self.cameras, videos)):
-            rows_cam = []
-            for vnum, vidname in enumerate(cam_videos):
-                if verbose: print(vidname)
-                rows = board.detect_video(vidname, prefix=vnum, progress=verbose)
-                if verbose: print("{} boards detected".format(len(rows)))
-                rows_cam.extend(rows)
-            all_rows.append(rows_cam)
+    def get_rows_videos(self, videos, board, verbose=True, n_jobs=1, chunk_size=2000, cache=None):
+        """Detects the board in every video of every camera.
+        With n_jobs != 1, the videos are split in chunks of chunk_size frames which are detected
+        in a process pool of n_jobs workers (all cores if None). The rows are the same as detect_video gives.
+        The videos are detected one after the other by default.
+        cache is an optional DetectionCache, videos found in it are not detected again."""
+        if n_jobs is None:
+            n_jobs = os.cpu_count() or 1
+
+        cached = dict()
+        if cache is not None:
+            for cix, cam_videos in enumerate(videos):
+                for vnum, vidname in enumerate(cam_videos):
+                    rows = cache.get(vidname, board, prefix=vnum)
+                    if rows is not None:
+                        if verbose: print("{}: {} boards loaded from cache".format(vidname, len(rows)))
+                        cached[(cix, vnum)] = rows
+
+        if n_jobs == 1:
+            all_rows = []
+
+            for cix, (cam, cam_videos) in enumerate(zip(self.cameras, videos)):
+                rows_cam = []
+                for vnum, vidname in enumerate(cam_videos):
+                    if (cix, vnum) in cached:
+                        rows_cam.extend(cached[(cix, vnum)])
+                        continue
+                    if verbose: print(vidname)
+                    rows = board.detect_video(vidname, prefix=vnum, progress=verbose)
+                    if verbose: print("{} boards detected".format(len(rows)))
+                    if cache is not None:
+                        cache.put(vidname, board, rows)
+                    rows_cam.extend(rows)
+                all_rows.append(rows_cam)
+
+            return all_rows
+
+        with ProcessPoolExecutor(max_workers=n_jobs) as executor:
+            futures = dict()
+            for cix, cam_videos in enumerate(videos):
+                for vnum, vidname in enumerate(cam_videos):
+                    if (cix, vnum) in cached:
+                        continue
+                    nframes = get_video_params(vidname)['nframes']
+                    if nframes < 10:
+                        # unknown length, cannot be split
+                        futures[(cix, vnum)] = executor.submit(board.detect_video, vidname, prefix=vnum)
+                        continue
+                    futures[(cix, vnum)] = [executor.submit(board.detect_video_range, vidname, start, end)
+                                            for start, end in split_video_chunks(nframes, chunk_size)]
+
+            if verbose and len(futures) > 0:
+                n_tasks = sum(len(f) if isinstance(f, list) else 1 for f in futures.values())
+                print('detecting boards in {} chunks with {} workers'.format(n_tasks, n_jobs))
+
+            all_rows = []
+            for cix, cam_videos in enumerate(videos):
+                rows_cam = []
+                for vnum, vidname in enumerate(cam_videos):
+                    if (cix, vnum) in cached:
+                        rows_cam.extend(cached[(cix, vnum)])
+                        continue
+                    future = futures[(cix, vnum)]
+                    if isinstance(future, list):
+                        chunks = [f.result() for f in future]
+                        rows = stitch_video_chunks(board, vidname, chunks, prefix=vnum)
+                    else:
+                        rows = future.result()
+                    if verbose: print("{}: {} boards detected".format(vidname, len(rows)))
+                    if cache is not None:
+                        cache.put(vidname, board, rows)
+                    rows_cam.extend(rows)
+                all_rows.append(rows_cam)
 
         return all_rows
 
@@ -1602,11 +1720,13 @@ class CameraGroup:
                 
     def calibrate_videos(self, videos, board,
                          init_intrinsics=True, init_extrinsics=True, verbose=True,
-                         **kwargs):
+                         n_jobs=1, cache=None, **kwargs):
         """Takes as input a list of list of video filenames, one list of each camera.
-        Also takes a board which specifies what should be detected in the videos"""
+        Also takes a board which specifies what should be detected in the videos.
+        n_jobs is the number of processes used for the detection and cache an optional
+        DetectionCache to reuse the detections of previous runs (see get_rows_videos)"""
 
-        all_rows = self.get_rows_videos(videos, board, verbose=verbose)
+        all_rows = self.get_rows_videos(videos, board, verbose=verbose, n_jobs=n_jobs, cache=cache)
         if init_extrinsics:
             self.set_camera_sizes_videos(videos)
 
@@ -0,0 +1,125 @@
+import threading
+from collections import deque
+
+import cv2
+import numpy as np
+
+from .cameras import FisheyeCamera
+
+
+class LiveReprojection:
+    """Checks a calibration against live board detections.
+
+    The intrinsics, distortions and projection matrices of every camera are cached when the
+    engine is created. Detections are added per camera as they come in, tagged with the index
+    of their synchronized frame set, and compute() triangulates and reprojects the corners of
+    one set for all cameras at once.
+    """
+
+    def __init__(self, cgroup, board, min_cameras=2, min_points=4, history=8):
+        self.cache_cameras(cgroup)
+        self.min_cameras = min_cameras
+        self.min_points = min_points
+        self.n_points = board.get_empty_detection().reshape(-1, 2).shape[0]
+
+        self.lock = threading.Lock()
+        self.detections = [deque(maxlen=history) for _ in range(self.n_cams)]
+        self.points = np.full((self.n_cams, self.n_points, 2), np.nan, dtype='float64')
+
+    def cache_cameras(self, cgroup):
+        self.n_cams = len(cgroup.cameras)
+        self.fisheye = [isinstance(cam, FisheyeCamera) for cam in cgroup.cameras]
+        self.matrices = [cam.get_camera_matrix().astype('float64') for cam in cgroup.cameras]
+        self.distortions = [cam.get_distortions().astype('float64') for cam in cgroup.cameras]
+        self.rvecs = [cam.get_rotation().astype('float64') for cam in cgroup.cameras]
+        self.tvecs = [cam.get_translation().astype('float64') for cam in cgroup.cameras]
+        self.cam_mats = np.array([cam.get_extrinsics_mat()[:3] for cam in cgroup.cameras])
+
+    def update(self, num, generation, corners, ids):
+        """Adds the detection of camera num for the frame set generation."""
+        if corners is None or ids is None or len(corners) < self.min_points:
+            return
+        with self.lock:
+            self.detections[num].append((generation, corners, ids))
+
+    def undistort_points(self, num, points):
+        points = points.reshape(-1, 1, 2)
+        if self.fisheye[num]:
+            out = cv2.fisheye.undistortPoints(points, self.matrices[num], self.distortions[num])
+        else:
+            out = cv2.undistortPoints(points, self.matrices[num], self.distortions[num])
+        return out.reshape(-1, 2)
+
+    def project_points(self, num, p3ds):
+        p3ds = p3ds.reshape(-1, 1, 3)
+        if self.fisheye[num]:
+            out, _ = cv2.fisheye.projectPoints(p3ds, self.rvecs[num], self.tvecs[num],
+                                               self.matrices[num], self.distortions[num])
+        else:
+            out, _ = cv2.projectPoints(p3ds, self.rvecs[num], self.tvecs[num],
+                                       self.matrices[num], self.distortions[num])
+        return out.reshape(-1, 2)
+
+    def triangulate(self, undistorted):
+        """Triangulates CxNx2 undistorted points, missing points are nan. Same result as
+        triangulate_simple for each point, with the rows of the missing cameras left at 0."""
+        good = ~np.isnan(undistorted[:, :, 0])
+        x = np.where(good, undistorted[:, :, 0], 0).T[:, :, None]
+        y = np.where(good, undistorted[:, :, 1], 0).T[:, :, None]
+        mask = good.T[:, :, None]
+
+        n_points = undistorted.shape[1]
+        A = np.empty((n_points, 2 * self.n_cams, 4))
+        A[:, 0::2] = (x * self.cam_mats[None, :, 2] - self.cam_mats[None, :, 0]) * mask
+        A[:, 1::2] = (y * self.cam_mats[None, :, 2] - self.cam_mats[None, :, 1]) * mask
+
+        _, _, vh = np.linalg.svd(A)
+        p3ds = vh[:, -1, :3] / vh[:, -1, 3:]
+        return p3ds
+
+    def compute(self, generation):
+        """Triangulates and reprojects the detections of the frame set generation.
+        Returns None if fewer than min_cameras cameras detected the board in that set, otherwise a dict with
+        ids: N board corner ids seen by at least min_cameras cameras
+        points: CxNx2 detected corners, nan where a camera did not see the corner
+        p3ds: Nx3 triangulated corners
+        p2ds: CxNx2 reprojected corners
+        errors: CxN reprojection errors in pixels, nan where a camera did not see the corner
+        camera_errors: C mean reprojection error of each camera, nan if it did not see the board
+        """
+        points = self.points
+        points[:] = np.nan
+        n_found = 0
+        with self.lock:
+            for num in range(self.n_cams):
+                for gen, corners, ids in self.detections[num]:
+                    if gen == generation:
+                        points[num, np.asarray(ids).ravel()] = np.asarray(corners).reshape(-1, 2)
+                        n_found += 1
+                        break
+        if n_found < self.min_cameras:
+            return None
+
+        seen = np.sum(~np.isnan(points[:, :, 0]), axis=0) >= self.min_cameras
+        ids = np.where(seen)[0]
+        if len(ids) == 0:
+            return None
+        points = points[:, ids]
+
+        undistorted = np.full(points.shape, np.nan)
+        for num in range(self.n_cams):
+            good = ~np.isnan(points[num, :, 0])
+            if np.any(good):
+                undistorted[num, good] = self.undistort_points(num, points[num, good])
+
+        p3ds = self.triangulate(undistorted)
+        p2ds = np.array([self.project_points(num, p3ds) for num in range(self.n_cams)])
+
+        errors = np.linalg.norm(points - p2ds, axis=2)
+        detected = ~np.isnan(errors)
+        camera_errors = np.full(self.n_cams, np.nan)
+        has_points = np.any(detected, axis=1)
+        camera_errors[has_points] = np.nanmean(errors[has_points], axis=1)
+
+        return {'ids': ids, 'points': points, 'p3ds': p3ds, 'p2ds': p2ds,
+                'errors': errors, 'camera_errors': camera_errors}
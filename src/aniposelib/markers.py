@@ -0,0 +1,179 @@
+import itertools
+
+import cv2
+import numpy as np
+
+from .live import LiveReprojection
+
+
+class BlobFinder:
+    """Finds the centroids of bright blobs (markers, LEDs) in the frames of every camera.
+
+    The frame is thresholded into a mask, and only the bounding boxes of the outer contours
+    of the mask are measured, which is much faster than labeling the connected components
+    of the whole frame. The gray and mask images are written into buffers per camera reused
+    between frames.
+    """
+
+    def __init__(self, threshold=200, min_area=2, max_area=5000, max_blobs=16):
+        self.threshold = threshold
+        self.min_area = min_area
+        self.max_area = max_area
+        self.max_blobs = max_blobs
+        self.buffers = dict()
+
+    def find(self, num, frame):
+        """Returns the centroids of the blobs of camera num as an Nx2 array, largest blobs first."""
+        shape = frame.shape[:2]
+        if num not in self.buffers or self.buffers[num][0].shape != shape:
+            self.buffers[num] = (np.empty(shape, dtype='uint8'), np.empty(shape, dtype='uint8'))
+        gray, mask = self.buffers[num]
+
+        if frame.ndim == 3 and frame.shape[2] == 3:
+            cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY, dst=gray)
+        else:
+            gray = frame.reshape(shape)
+        cv2.threshold(gray, self.threshold, 255, cv2.THRESH_BINARY, dst=mask)
+
+        contours, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+        areas = []
+        centroids = []
+        for contour in contours:
+            x, y, w, h = cv2.boundingRect(contour)
+            if w * h < self.min_area:
+                continue
+            # pixels of the mask in the bounding box, the blob unless another blob reaches into it
+            moments = cv2.moments(mask[y:y + h, x:x + w], binaryImage=True)
+            if not self.min_area <= moments['m00'] <= self.max_area:
+                continue
+            areas.append(moments['m00'])
+            centroids.append((x + moments['m10'] / moments['m00'], y + moments['m01'] / moments['m00']))
+        if not centroids:
+            return np.zeros((0, 2))
+        keep = np.argsort(-np.array(areas), kind='stable')[:self.max_blobs]
+        return np.array(centroids)[keep]
+
+
+class MarkerTriangulator(LiveReprojection):
+    """Matches unlabeled blobs across cameras and triangulates them into markers.
+
+    Every pair of blobs of every pair of cameras is triangulated in one batch, and each
+    candidate is reprojected into all cameras. The candidates seen by the most cameras within
+    max_error pixels are kept first, each blob belonging to one marker only, then the kept
+    markers are triangulated again from all the blobs that support them. The markers keep
+    their slot between frames by matching them to the last known positions.
+    """
+
+    def __init__(self, cgroup, max_markers=4, min_cameras=2, max_error=5.0):
+        self.cache_cameras(cgroup)
+        self.max_markers = max_markers
+        self.min_cameras = min_cameras
+        self.max_error = max_error
+        self.pairs = list(itertools.combinations(range(self.n_cams), 2))
+        self.previous = np.full((max_markers, 3), np.nan)
+
+    def compute(self, blobs):
+        """Triangulates the markers from the blobs of every camera (a list of Nx2 arrays).
+        Returns None if no marker is seen by min_cameras cameras, otherwise a dict with
+        p3ds: Kx3 markers
+        n_cameras: K number of cameras that see each marker
+        errors: K mean reprojection error of each marker in pixels
+        blobs: CxK index of the blob of each marker in each camera, -1 where the camera does not see it
+        """
+        blobs = [np.asarray(points, dtype='float64').reshape(-1, 2) for points in blobs]
+        undistorted = [self.undistort_points(num, points) if len(points) else points
+                       for num, points in enumerate(blobs)]
+
+        candidates = []
+        for a, b in self.pairs:
+            if len(blobs[a]) and len(blobs[b]):
+                i, j = np.meshgrid(np.arange(len(blobs[a])), np.arange(len(blobs[b])), indexing='ij')
+                candidates.append(np.stack([np.full(i.size, a), i.ravel(), np.full(i.size, b), j.ravel()], axis=1))
+        if not candidates:
+            return None
+        candidates = np.concatenate(candidates)
+        n_candidates = len(candidates)
+
+        points = np.full((self.n_cams, n_candidates, 2), np.nan)
+        for num in range(self.n_cams):
+            for cam_column, blob_column in [(0, 1), (2, 3)]:
+                rows = np.flatnonzero(candidates[:, cam_column] == num)
+                points[num, rows] = undistorted[num][candidates[rows, blob_column]]
+        p3ds = self.triangulate(points)
+
+        # nearest blob of every camera to the reprojection of every candidate
+        nearest = np.full((self.n_cams, n_candidates), -1)
+        distances = np.full((self.n_cams, n_candidates), np.inf)
+        for num in range(self.n_cams):
+            if len(blobs[num]):
+                p2ds = self.project_points(num, p3ds)
+                d = np.linalg.norm(p2ds[:, None] - blobs[num][None], axis=2)
+                nearest[num] = np.argmin(d, axis=1)
+                distances[num] = d[np.arange(n_candidates), nearest[num]]
+        support = distances < self.max_error
+        n_support = np.sum(support, axis=0)
+        mean_error = np.sum(np.where(support, distances, 0), axis=0) / np.maximum(n_support, 1)
+
+        used = [set() for _ in range(self.n_cams)]
+        accepted = []
+        for k in np.lexsort((mean_error, -n_support)):
+            if n_support[k] < self.min_cameras or len(accepted) == self.max_markers:
+                break
+            cams = np.flatnonzero(support[:, k])
+            if any(nearest[num, k] in used[num] for num in cams):
+                continue
+            for num in cams:
+                used[num].add(nearest[num, k])
+            accepted.append(k)
+        if not accepted:
+            return None
+
+        accepted = np.array(accepted)
+        marker_blobs = np.where(support[:, accepted], nearest[:, accepted], -1)
+        points = np.full((self.n_cams, len(accepted), 2), np.nan)
+        for num in range(self.n_cams):
+            seen = marker_blobs[num] >= 0
+            points[num, seen] = undistorted[num][marker_blobs[num, seen]]
+        p3ds = self.triangulate(points)
+
+        errors = np.zeros(len(accepted))
+        for num in range(self.n_cams):
+            seen = marker_blobs[num] >= 0
+            if np.any(seen):
+                p2ds = self.project_points(num, p3ds[seen])
+                errors[seen] += np.linalg.norm(p2ds - blobs[num][marker_blobs[num, seen]], axis=1)
+        n_cameras = np.sum(marker_blobs >= 0, axis=0)
+        return {'p3ds': p3ds, 'n_cameras': n_cameras, 'errors': errors / n_cameras, 'blobs': marker_blobs}
+
+    def assign_slots(self, p3ds):
+        """Returns the slot of each marker, the closest last known position first, the new markers in the free slots."""
+        slots = np.full(len(p3ds), -1)
+        known = ~np.isnan(self.previous[:, 0])
+        if np.any(known) and len(p3ds):
+            d = np.linalg.norm(p3ds[:, None] - self.previous[None], axis=2)
+            d[:, ~known] = np.inf
+            taken = set()
+            for flat in np.argsort(d, axis=None):
+                k, slot = np.unravel_index(flat, d.shape)
+                if np.isinf(d[k, slot]):
+                    break
+                if slots[k] < 0 and slot not in taken:
+                    slots[k] = slot
+                    taken.add(slot)
+        free = [slot for slot in np.argsort(known, kind='stable') if slot not in slots]
+        for k in np.flatnonzero(slots < 0):
+            slots[k] = free.pop(0)
+        return slots
+
+    def track(self, blobs):
+        """Triangulates the markers and returns them in their slots, as a max_markers x 3 array with nan for the
+        markers not seen in this frame, and the result of compute."""
+        markers = np.full((self.max_markers, 3), np.nan)
+        result = self.compute(blobs)
+        if result is None:
+            return markers, None
+        slots = self.assign_slots(result['p3ds'])
+        markers[slots] = result['p3ds']
+        self.previous[slots] = result['p3ds']
+        result['slots'] = slots
+        return markers, result
@@ -0,0 +1,203 @@
+import cv2
+import numpy as np
+from scipy import sparse
+
+# apparent size of the board, sqrt(board area / image area), is used as the distance of the board
+SCALE_EDGES = np.array([0.1, 0.15, 0.2, 0.3, 0.4, 0.6])
+# angle between the board normal and the optical axis, in degrees
+TILT_EDGES = np.array([10, 20, 35, 50])
+# tilted boards are also binned by the direction of the tilt in the image
+TILT_DIRECTIONS = 4
+
+
+class FrameSelector:
+    """Selects a bounded subset of the board detections for bundle adjustment.
+
+    Every detection of every camera is described once, when it is first seen, by the cells of
+    a grid over the image that its corners fall in and by a pose bin (apparent size, tilt and
+    tilt direction of the board). select() then greedily picks the synchronized frames that add
+    the most uncovered cells and pose bins over all cameras, each bin counting less the more
+    selected frames already cover it. The number of frames given to calibrate_rows stays at
+    max_frames however long the capture runs, while the frames covering the image and the
+    poses that are rarely seen are kept.
+    """
+
+    def __init__(self, cgroup, board, max_frames=200, grid_size=8, pose_weight=4.0):
+        self.board = board
+        self.max_frames = max_frames
+        self.grid_size = grid_size
+        self.pose_weight = pose_weight
+        self.sizes = [tuple(cam.get_size()) for cam in cgroup.cameras]
+        self.matrices = []
+        for cam, (width, height) in zip(cgroup.cameras, self.sizes):
+            matrix = cam.get_camera_matrix()
+            if matrix[0, 0] <= 1:
+                # not calibrated yet, the poses are only binned so a rough focal length is enough
+                matrix = np.array([[max(width, height), 0, width / 2], [0, max(width, height), height / 2], [0, 0, 1]])
+            self.matrices.append(np.array(matrix, dtype='float64'))
+
+        self.n_cells = grid_size * grid_size
+        self.n_poses = len(SCALE_EDGES) + 1 + (len(SCALE_EDGES) + 1) * len(TILT_EDGES) * TILT_DIRECTIONS
+        self.n_bins = self.n_cells + self.n_poses
+        self.objp = board.get_object_points().reshape(-1, 3).astype('float64')
+
+        self.seen = set()
+        self.frames = []
+        self.frame_index = dict()
+        self.frame_bins = []
+        self.matrix = None
+
+    def describe(self, num, row):
+        """Returns the bins of a detection of camera num: the grid cells of its corners and its pose bin."""
+        if 'filled' in row:
+            filled = row['filled'].reshape(-1, 2)
+        else:
+            filled = self.board.fill_points(row['corners'], row['ids']).reshape(-1, 2)
+        good = ~np.isnan(filled).any(axis=1)
+        if np.sum(good) < 4:
+            return np.array([], dtype='int64')
+        points = filled[good]
+
+        width, height = self.sizes[num]
+        cx = np.clip((points[:, 0] * self.grid_size / width).astype('int64'), 0, self.grid_size - 1)
+        cy = np.clip((points[:, 1] * self.grid_size / height).astype('int64'), 0, self.grid_size - 1)
+        cells = np.unique(cy * self.grid_size + cx)
+
+        scale = np.sqrt(cv2.contourArea(cv2.convexHull(points.astype('float32'))) / (width * height))
+        scale_bin = np.searchsorted(SCALE_EDGES, scale)
+        pose = scale_bin
+        ret, rvec, tvec = cv2.solvePnP(self.objp[good], points, self.matrices[num], None, flags=cv2.SOLVEPNP_IPPE)
+        if ret:
+            normal = cv2.Rodrigues(rvec)[0][:, 2]
+            normal = -normal if normal[2] < 0 else normal
+            tilt = np.degrees(np.arccos(min(1.0, normal[2])))
+            tilt_bin = np.searchsorted(TILT_EDGES, tilt)
+            if tilt_bin > 0:
+                direction = np.arctan2(normal[1], normal[0])
+                direction_bin = int((direction + np.pi) / (2 * np.pi) * TILT_DIRECTIONS) % TILT_DIRECTIONS
+                pose = len(SCALE_EDGES) + 1 + \
+                    ((tilt_bin - 1) * TILT_DIRECTIONS + direction_bin) * (len(SCALE_EDGES) + 1) + scale_bin
+
+        offset = num * self.n_bins
+        return np.concatenate([cells + offset, [offset + self.n_cells + pose]])
+
+    def update(self, all_rows):
+        """Describes the detections that were not seen yet. The others are not described again."""
+        for num, rows in enumerate(all_rows):
+            for row in rows:
+                key = (num, row['framenum'])
+                if key in self.seen:
+                    continue
+                self.seen.add(key)
+                bins = self.describe(num, row)
+                if row['framenum'] not in self.frame_index:
+                    self.frame_index[row['framenum']] = len(self.frames)
+                    self.frames.append(row['framenum'])
+                    self.frame_bins.append(bins)
+                else:
+                    index = self.frame_index[row['framenum']]
+                    self.frame_bins[index] = np.concatenate([self.frame_bins[index], bins])
+                self.matrix = None
+
+    def get_matrix(self):
+        # frames x bins, rebuilt only when detections were added
+        if self.matrix is None:
+            n_cams = len(self.sizes)
+            indptr = np.concatenate([[0], np.cumsum([len(bins) for bins in self.frame_bins])])
+            indices = np.concatenate(self.frame_bins + [np.array([], dtype='int64')])
+            self.matrix = sparse.csr_matrix((np.ones(len(indices)), indices, indptr),
+                                            shape=(len(self.frames), n_cams * self.n_bins))
+        return self.matrix
+
+    def select(self, framenums=None):
+        """Returns the framenums of at most max_frames frames, among framenums if given, in the order they were seen."""
+        candidates = np.ones(len(self.frames), dtype='bool')
+        if framenums is not None:
+            candidates[:] = False
+            candidates[[self.frame_index[num] for num in framenums if num in self.frame_index]] = True
+        if np.sum(candidates) <= self.max_frames:
+            return [num for num, candidate in zip(self.frames, candidates) if candidate]
+
+        matrix = self.get_matrix()
+        weights = np.tile(np.concatenate([np.ones(self.n_cells), np.full(self.n_poses, self.pose_weight)]),
+                          len(self.sizes))
+        counts = np.zeros(matrix.shape[1])
+        selected = []
+        for _ in range(self.max_frames):
+            gains = matrix @ (weights / (1 + counts))
+            gains[~candidates] = -1
+            best = int(np.argmax(gains))
+            if gains[best] < 0:
+                break
+            selected.append(best)
+            candidates[best] = False
+            counts[matrix.indices[matrix.indptr[best]:matrix.indptr[best + 1]]] += 1
+        return [self.frames[index] for index in sorted(selected)]
+
+    def select_rows(self, all_rows):
+        """Returns the rows of every camera for the selected frames, after describing the new detections."""
+        self.update(all_rows)
+        framenums = {row['framenum'] for rows in all_rows for row in rows}
+        selected = set(self.select(framenums))
+        return [[row for row in rows if row['framenum'] in selected] for rows in all_rows]
+
+
+class CoverageMap:
+    """Counts the detected board corners of every camera in a coarse grid over the image.
+
+    add() only bins the new corners, so the cost of an update does not grow with the length of
+    the capture. A cell is covered once min_hits corners fell in it, and the coverage of a camera
+    is sufficient once sufficient_fraction of its cells are covered, the cells at the very edge
+    of the image being hard to reach with the board.
+    """
+
+    def __init__(self, sizes, grid_size=(12, 10), min_hits=5, sufficient_fraction=0.7):
+        self.sizes = [tuple(size) for size in sizes]
+        self.grid_size = grid_size
+        self.min_hits = min_hits
+        self.sufficient_fraction = sufficient_fraction
+        self.counts = np.zeros((len(self.sizes), grid_size[1], grid_size[0]), dtype='int32')
+        self.mini_map = None
+
+    def add(self, num, corners):
+        """Bins the corners of a detection of camera num, in image coordinates."""
+        points = np.asarray(corners, dtype='float64').reshape(-1, 2)
+        points = points[~np.isnan(points).any(axis=1)]
+        width, height = self.sizes[num]
+        cx = np.clip((points[:, 0] * self.grid_size[0] / width).astype('int64'), 0, self.grid_size[0] - 1)
+        cy = np.clip((points[:, 1] * self.grid_size[1] / height).astype('int64'), 0, self.grid_size[1] - 1)
+        np.add.at(self.counts[num], (cy, cx), 1)
+
+    def get_coverage(self, num=None):
+        """Returns the fraction of covered cells of camera num, or of every camera."""
+        covered = np.mean(self.counts >= self.min_hits, axis=(1, 2))
+        return covered if num is None else covered[num]
+
+    def is_sufficient(self, num=None):
+        return bool(np.all(self.get_coverage(num) >= self.sufficient_fraction))
+
+    def reset(self):
+        self.counts.fill(0)
+
+    def render(self, tile_width=320):
+        """Draws the coverage of every camera side by side as a heatmap, into a buffer reused between calls."""
+        grid_width, grid_height = self.grid_size
+        tile_height = tile_width * grid_height // grid_width
+        shape = (tile_height, tile_width * len(self.sizes), 3)
+        if self.mini_map is None or self.mini_map.shape != shape:
+            self.mini_map = np.zeros(shape, dtype='uint8')
+
+        # 0 to min_hits corners from dark to bright, covered cells are outlined in green
+        levels = (np.minimum(self.counts, self.min_hits) * (255 // self.min_hits)).astype('uint8')
+        cell_width, cell_height = tile_width / grid_width, tile_height / grid_height
+        for num in range(len(self.sizes)):
+            tile = self.mini_map[:, num * tile_width:(num + 1) * tile_width]
+            heatmap = cv2.applyColorMap(levels[num], cv2.COLORMAP_INFERNO)
+            cv2.resize(heatmap, (tile_width, tile_height), dst=tile, interpolation=cv2.INTER_NEAREST)
+            for y, x in zip(*np.nonzero(self.counts[num] >= self.min_hits)):
+                cv2.rectangle(tile, (int(x * cell_width), int(y * cell_height)),
+                              (int((x + 1) * cell_width) - 1, int((y + 1) * cell_height) - 1), (0, 255, 0), 1)
+            color = (0, 255, 0) if self.is_sufficient(num) else (255, 255, 255)
+            cv2.putText(tile, f'Cam {num + 1}: {self.get_coverage(num) * 100:.0f}%', (5, 20),
+                        cv2.FONT_HERSHEY_SIMPLEX, 0.6, color, 1, cv2.LINE_AA)
+        return self.mini_map
@@ -0,0 +1,101 @@
+import argparse
+import os
+
+import cv2
+import numpy as np
+
+from .cameras import CameraGroup, FisheyeCamera
+
+
+def get_undistort_maps(camera, size):
+    """Returns the fixed-point (CV_16SC2 and CV_16UC1) remap maps undistorting the frames of camera of size (width, height).
+    The undistorted frames keep the camera matrix of the calibration."""
+    matrix = camera.get_camera_matrix().astype('float64')
+    dist = camera.get_distortions().astype('float64')
+    if isinstance(camera, FisheyeCamera):
+        return cv2.fisheye.initUndistortRectifyMap(matrix, dist, np.eye(3), matrix, tuple(size), cv2.CV_16SC2)
+    return cv2.initUndistortRectifyMap(matrix, dist, None, matrix, tuple(size), cv2.CV_16SC2)
+
+
+class UndistortMaps:
+    """Undistorts the frames of every camera of a calibration.
+
+    The maps of initUndistortRectifyMap are computed once per camera, frame size and
+    calibration, in fixed-point format which remap reads faster than float maps. The
+    undistorted frames are written into a buffer per camera reused between frames, so the
+    returned frame is only valid until the next call for the same camera.
+    """
+
+    def __init__(self, cgroup, interpolation=cv2.INTER_LINEAR):
+        self.cameras = cgroup.cameras
+        self.interpolation = interpolation
+        self.maps = dict()
+        self.buffers = dict()
+
+    def get_maps(self, num, size):
+        camera = self.cameras[num]
+        # a new calibration loaded into the camera gets new maps
+        key = (tuple(size), camera.get_camera_matrix().tobytes(), camera.get_distortions().tobytes())
+        # one entry per camera, so the camera threads never write the same entry
+        if num not in self.maps or self.maps[num][0] != key:
+            self.maps[num] = (key, get_undistort_maps(camera, size))
+        return self.maps[num][1]
+
+    def undistort(self, num, frame):
+        """Returns the undistorted frame of camera num, in the buffer of the camera."""
+        map1, map2 = self.get_maps(num, (frame.shape[1], frame.shape[0]))
+        buffer = self.buffers.get(num)
+        if buffer is None or buffer.shape != frame.shape or buffer.dtype != frame.dtype:
+            buffer = self.buffers[num] = np.empty_like(frame)
+        cv2.remap(frame, map1, map2, self.interpolation, dst=buffer)
+        return buffer
+
+
+def undistort_video(video_file, camera, output_file=None, fourcc='XVID'):
+    """Writes the undistorted frames of a video to output_file, by default <video name>_undistorted.avi.
+    Returns the output file and the number of frames."""
+    if output_file is None:
+        output_file = os.path.splitext(video_file)[0] + '_undistorted.avi'
+    cap = cv2.VideoCapture(video_file)
+    if not cap.isOpened():
+        raise IOError(f'Could not open {video_file}')
+    fps = cap.get(cv2.CAP_PROP_FPS)
+    size = (int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)), int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT)))
+    map1, map2 = get_undistort_maps(camera, size)
+
+    writer = cv2.VideoWriter(output_file, cv2.VideoWriter_fourcc(*fourcc), fps, size)
+    # the frames are read and undistorted into the same two buffers
+    frame = None
+    undistorted = None
+    n_frames = 0
+    try:
+        while True:
+            ret, frame = cap.read(frame)
+            if not ret:
+                break
+            undistorted = cv2.remap(frame, map1, map2, cv2.INTER_LINEAR, dst=undistorted)
+            writer.write(undistorted)
+            n_frames += 1
+    finally:
+        cap.release()
+        writer.release()
+    return output_file, n_frames
+
+
+def undistort_videos(calibration_file, video_files, fourcc='XVID'):
+    """Undistorts the videos of every camera of a calibration file, given in the order of the cameras."""
+    cgroup = CameraGroup.load(calibration_file)
+    if len(video_files) != len(cgroup.cameras):
+        raise ValueError(f'{len(video_files)} videos given for {len(cgroup.cameras)} cameras')
+    return [undistort_video(video_file, camera, fourcc=fourcc) for video_file, camera in zip(video_files, cgroup.cameras)]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Undistort recorded videos with a calibration file')
+    parser.add_argument('calibration', help='calibration.toml')
+    parser.add_argument('videos', nargs='+', help='.avi files, one per camera in the order of the calibration')
+    parser.add_argument('-f', '--fourcc', default='XVID')
+    args = parser.parse_args()
+
+    for output_file, n_frames in undistort_videos(args.calibration, args.videos, fourcc=args.fourcc):
+        print(f'Saved {output_file} ({n_frames} frames)')
@@ -0,0 +1,199 @@
+"""
+Asynchronous logging for the hot paths of the recording and calibration threads
+
+Printing from a frame callback or a capture loop blocks the thread on console I/O while
+holding the GIL. Instead, a record is put in a preallocated ring as a tuple of the time,
+subsystem, level, message and arguments, without formatting it. A background thread
+formats the records and writes them to the console.
+
+- The producers claim a slot with next() on a shared itertools.count, which is atomic
+  in CPython, so they never wait on a lock or on the console.
+- Each subsystem (e.g. 'camera.callback') has its own level, set with set_level. Levels
+  apply to a subsystem and its children, and filtered records never reach the ring.
+- Repeated messages (same subsystem and format string) are rate limited by the writer thread,
+  which reports how many of them were suppressed.
+- If the producers lap the writer thread, the overwritten records are counted and reported.
+"""
+import atexit
+import itertools
+import logging
+import sys
+import threading
+import time
+
+DEBUG = logging.DEBUG
+INFO = logging.INFO
+WARNING = logging.WARNING
+ERROR = logging.ERROR
+
+
+class AsyncLog:
+    def __init__(self, capacity=1 << 14, level=INFO, rate_limit=5, rate_interval=1.0, stream=None, flush_interval=0.05):
+        """
+        Params
+        ------
+        capacity = int; number of records in the ring
+        level = int; default level of the subsystems
+        rate_limit = int; messages written per rate_interval for each subsystem and format string, 0 for no limit
+        rate_interval = float; seconds
+        stream = file; where the records are written, sys.stdout by default
+        flush_interval = float; seconds between two passes of the writer thread
+        """
+        self.capacity = capacity
+        self.ring = [None] * capacity
+        self.sequence = itertools.count()
+        self.written = 0
+        self.default_level = level
+        self.levels = {}
+        self.level_cache = {}
+        self.rate_limit = rate_limit
+        self.rate_interval = rate_interval
+        self.rates = {}
+        self.stream = stream
+        self.flush_interval = flush_interval
+        self.dropped = 0
+        self.stop_event = threading.Event()
+        # only taken by the writer side, the producers never wait on it
+        self.flush_lock = threading.Lock()
+        self.start_lock = threading.Lock()
+        self.thread = None
+
+    def set_level(self, subsystem, level):
+        """Sets the level of a subsystem and of its children, e.g. 'camera' also applies to 'camera.callback'."""
+        self.levels[subsystem] = level
+        self.level_cache = {}
+
+    def get_level(self, subsystem):
+        level = self.level_cache.get(subsystem)
+        if level is None:
+            level = self.default_level
+            name = subsystem
+            while name:
+                if name in self.levels:
+                    level = self.levels[name]
+                    break
+                name = name.rpartition('.')[0]
+            self.level_cache[subsystem] = level
+        return level
+
+    def log(self, subsystem, level, msg, *args):
+        """Puts a record in the ring. msg is formatted with msg % args by the writer thread."""
+        if level < self.get_level(subsystem):
+            return
+        index = next(self.sequence)
+        self.ring[index % self.capacity] = (index, time.perf_counter(), subsystem, level, msg, args)
+        if self.thread is None:
+            self.start()
+
+    def start(self):
+        with self.start_lock:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._run, name='Async log', daemon=True)
+                self.thread.start()
+
+    def _run(self):
+        while not self.stop_event.is_set():
+            self.stop_event.wait(self.flush_interval)
+            self.flush()
+
+    def flush(self):
+        """Formats and writes the records put in the ring since the previous flush."""
+        with self.flush_lock:
+            self._flush()
+
+    def _flush(self):
+        stream = self.stream if self.stream is not None else sys.stdout
+        lines = []
+        while True:
+            record = self.ring[self.written % self.capacity]
+            if record is None or record[0] < self.written:
+                # the next record is not written yet
+                break
+            if record[0] > self.written:
+                # the producers went around the ring, the records in between are lost
+                self.dropped += record[0] - self.written
+                self.written = record[0]
+            self.written += 1
+            line = self._format(record)
+            if line is not None:
+                lines.append(line)
+
+        now = time.perf_counter()
+        for key, (start, count, suppressed) in list(self.rates.items()):
+            if now - start >= self.rate_interval:
+                if suppressed:
+                    lines.append(f'[{key[0]}] suppressed {suppressed} more messages like: {key[1]}')
+                del self.rates[key]
+        if self.dropped:
+            lines.append(f'[log] {self.dropped} messages were dropped, the log ring is full')
+            self.dropped = 0
+
+        if lines:
+            stream.write('\n'.join(lines) + '\n')
+            stream.flush()
+
+    def _format(self, record):
+        _, record_time, subsystem, level, msg, args = record
+        if self.rate_limit:
+            key = (subsystem, msg)
+            start, count, suppressed = self.rates.get(key, (record_time, 0, 0))
+            if count >= self.rate_limit:
+                self.rates[key] = (start, count, suppressed + 1)
+                return None
+            self.rates[key] = (start, count + 1, suppressed)
+        try:
+            text = msg % args if args else msg
+        except Exception as e:
+            text = f'{msg} {args} ({type(e).__name__}: {e})'
+        return f'[{subsystem}] {logging.getLevelName(level)}: {text}'
+
+    def close(self):
+        """Stops the writer thread after writing the remaining records."""
+        self.stop_event.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+        self.flush()
+
+
+class SubsystemLogger:
+    def __init__(self, log, subsystem):
+        self.log = log
+        self.subsystem = subsystem
+
+    def is_enabled(self, level):
+        return level >= self.log.get_level(self.subsystem)
+
+    def debug(self, msg, *args):
+        self.log.log(self.subsystem, DEBUG, msg, *args)
+
+    def info(self, msg, *args):
+        self.log.log(self.subsystem, INFO, msg, *args)
+
+    def warning(self, msg, *args):
+        self.log.log(self.subsystem, WARNING, msg, *args)
+
+    def error(self, msg, *args):
+        self.log.log(self.subsystem, ERROR, msg, *args)
+
+
+_log = AsyncLog()
+atexit.register(_log.close)
+
+
+def get_logger(subsystem):
+    """Returns a logger of the shared AsyncLog for a subsystem, e.g. get_logger('camera.callback')."""
+    return SubsystemLogger(_log, subsystem)
+
+
+def set_level(subsystem, level):
+    """level = int or a level name, e.g. 'DEBUG'"""
+    if isinstance(level, str):
+        level = logging.getLevelName(level.upper())
+        if not isinstance(level, int):
+            raise ValueError(f'Unknown log level {level}')
+    _log.set_level(subsystem, level)
+
+
+def flush():
+    _log.flush()
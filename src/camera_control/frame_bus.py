@@ -0,0 +1,237 @@
+"""
+Frame bus shared by the camera threads (or processes) and the preview/calibration consumers
+
+Every camera owns a fixed slot per buffer in one shared memory block. Producers publish
+their frame of a synchronized frame set (a generation) into the buffer assigned to that
+generation, and a set becomes available once every camera has published into it.
+Consumers only ever get the latest complete set, as views into shared memory, so nothing
+is copied or regrouped and sets that were not picked up in time are simply overwritten.
+"""
+import os
+import threading
+import time
+from multiprocessing import Lock, shared_memory
+
+import numpy as np
+
+
+class FrameSet:
+    """Latest complete frame set handed out by FrameBus.acquire_latest.
+    The frames are views into shared memory and stay valid until release() is called."""
+
+    def __init__(self, bus, buffer, generation):
+        self.bus = bus
+        self.buffer = buffer
+        self.generation = generation
+        self.frames = [bus.frames[buffer][cam] for cam in range(bus.n_cams)]
+        self.frame_counts = bus.frame_counts[buffer].copy()
+        self.frame_times = bus.frame_times[buffer].copy()
+
+    def release(self):
+        if self.bus is not None:
+            self.bus.release(self.buffer)
+            self.bus = None
+            self.frames = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.release()
+
+
+class FrameBus:
+    def __init__(self, frame_shapes, dtype='uint8', n_buffers=3, name=None, lock=None):
+        """
+        Params
+        ------
+        frame_shapes = list of tuples; shape of the frames of each camera
+        n_buffers = int; number of frame sets kept, at least 3 so one set can be read
+            while the latest complete one is kept and another one is being written
+        name = str; name of an existing bus to attach to, a new one is created if None
+        """
+        self.frame_shapes = [tuple(shape) for shape in frame_shapes]
+        self.dtype = np.dtype(dtype)
+        self.n_cams = len(self.frame_shapes)
+        self.n_buffers = max(3, n_buffers)
+        self.lock = lock if lock is not None else Lock()
+        self.new_set = threading.Event()
+        self.closed = False
+
+        frame_sizes = [int(np.prod(shape)) * self.dtype.itemsize for shape in self.frame_shapes]
+        self.buffer_size = sum(frame_sizes)
+        # per buffer: generation held, pin count; per camera: generation written, frame count, time
+        header_size = 8 * (2 + self.n_buffers * (2 + 3 * self.n_cams))
+        total_size = header_size + self.n_buffers * self.buffer_size
+
+        self.owner = name is None
+        # a forked worker gets a copy of the owner, which must not unlink the block
+        self.owner_pid = os.getpid()
+        if self.owner:
+            self.shm = shared_memory.SharedMemory(create=True, size=total_size)
+        else:
+            self.shm = shared_memory.SharedMemory(name=name)
+        self.name = self.shm.name
+
+        buf = self.shm.buf
+        offset = 0
+
+        def header(shape, dtype):
+            nonlocal offset
+            arr = np.ndarray(shape, dtype=dtype, buffer=buf, offset=offset)
+            offset += arr.nbytes
+            return arr
+
+        self.latest = header(2, 'int64')  # latest complete generation, its buffer
+        self.buffer_generation = header(self.n_buffers, 'int64')
+        self.pins = header(self.n_buffers, 'int64')
+        self.written = header((self.n_buffers, self.n_cams), 'int64')
+        self.frame_counts = header((self.n_buffers, self.n_cams), 'int64')
+        self.frame_times = header((self.n_buffers, self.n_cams), 'float64')
+
+        self.frames = []
+        for b in range(self.n_buffers):
+            frames = []
+            for shape, size in zip(self.frame_shapes, frame_sizes):
+                frames.append(np.ndarray(shape, dtype=self.dtype, buffer=buf, offset=offset))
+                offset += size
+            self.frames.append(frames)
+
+        if self.owner:
+            self.latest[:] = -1
+            self.buffer_generation[:] = -1
+            self.pins[:] = 0
+            self.written[:] = -1
+
+    def __getstate__(self):
+        # lets a worker process attach to the same bus
+        return {'frame_shapes': self.frame_shapes, 'dtype': self.dtype.str, 'n_buffers': self.n_buffers,
+                'name': self.name, 'lock': self.lock}
+
+    def __setstate__(self, state):
+        self.__init__(**state)
+
+    def _get_buffer(self, generation):
+        # buffer already assigned to this generation by another camera
+        match = np.where(self.buffer_generation == generation)[0]
+        if len(match) > 0:
+            return match[0]
+
+        if generation <= self.latest[0]:
+            # a newer set is already complete, this one is stale
+            return None
+
+        free = [b for b in range(self.n_buffers) if self.pins[b] == 0 and b != self.latest[1]]
+        if len(free) == 0:
+            return None
+        # reuse the buffer of the oldest generation, dropping it if it never completed
+        b = min(free, key=lambda ix: self.buffer_generation[ix])
+        if self.buffer_generation[b] > generation:
+            return None
+        self.buffer_generation[b] = generation
+        self.written[b] = -1
+        return b
+
+    def publish(self, cam, frame, generation, frame_count=0, frame_time=None):
+        """Copies the frame of a camera into the buffer of the given generation.
+        Returns True once the set of that generation is complete, False otherwise,
+        and None if the generation is already stale and the frame was dropped."""
+        if frame_time is None:
+            frame_time = time.perf_counter()
+
+        with self.lock:
+            if self.closed:
+                return None
+            b = self._get_buffer(generation)
+            if b is None:
+                return None
+            # pinned while copying so another generation cannot take the buffer
+            self.pins[b] += 1
+
+        try:
+            np.copyto(self.frames[b][cam], frame.reshape(self.frame_shapes[cam]), casting='unsafe')
+        except BaseException:
+            # e.g. a frame of the wrong shape, the buffer is unpinned and the error raised
+            with self.lock:
+                if self.pins is not None:
+                    self.pins[b] -= 1
+            raise
+
+        with self.lock:
+            if self.pins is None:
+                # closed after waiting too long for this copy
+                return None
+            self.pins[b] -= 1
+            if self.buffer_generation[b] != generation:
+                return None
+            self.written[b, cam] = generation
+            self.frame_counts[b, cam] = frame_count
+            self.frame_times[b, cam] = frame_time
+            complete = bool(np.all(self.written[b] == generation))
+            if complete and generation > self.latest[0]:
+                self.latest[:] = (generation, b)
+
+        if complete:
+            self.new_set.set()
+        return complete
+
+    def acquire_latest(self, after=-1):
+        """Returns the latest complete FrameSet newer than generation after, or None."""
+        with self.lock:
+            if self.closed:
+                return None
+            generation, b = self.latest
+            if generation <= after or b < 0:
+                return None
+            self.pins[b] += 1
+        return FrameSet(self, b, int(generation))
+
+    def wait_latest(self, after=-1, timeout=1.0, poll=0.005):
+        """Waits until a complete set newer than generation after is available and returns it,
+        or None after timeout seconds."""
+        deadline = time.perf_counter() + timeout
+        while True:
+            self.new_set.clear()
+            frame_set = self.acquire_latest(after)
+            if frame_set is not None:
+                return frame_set
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0 or self.closed:
+                return None
+            # the event is only set by producers of this process, poll for the other ones
+            self.new_set.wait(min(remaining, poll))
+
+    def release(self, buffer):
+        with self.lock:
+            # a set released after the bus was closed
+            if self.pins is None:
+                return
+            self.pins[buffer] -= 1
+
+    def close(self, timeout=1.0):
+        """Closes the bus once the frames being copied by the producers and the sets held by the consumers
+        are released, waiting at most timeout seconds for them. No frame is published or handed out meanwhile."""
+        with self.lock:
+            if self.closed:
+                return
+            self.closed = True
+        self.new_set.set()
+
+        deadline = time.perf_counter() + timeout
+        while time.perf_counter() < deadline:
+            with self.lock:
+                if not np.any(self.pins > 0):
+                    break
+            time.sleep(0.001)
+
+        with self.lock:
+            self.frames = None
+            self.latest = self.buffer_generation = self.pins = self.written = None
+            self.frame_counts = self.frame_times = None
+        try:
+            self.shm.close()
+            if self.owner and os.getpid() == self.owner_pid:
+                self.shm.unlink()
+        except BufferError:
+            # a frame set is still held somewhere, the block is freed once it is garbage collected
+            pass
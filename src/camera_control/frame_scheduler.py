@@ -0,0 +1,70 @@
+"""
+Frame pacing for the software-timed recording threads
+
+Instead of every camera thread spinning on time.perf_counter() until its next frame is due,
+the threads wait on one barrier. The last thread to arrive sleeps until shortly before the
+deadline, spins only for the final slice and then releases all the threads at the same tick.
+"""
+import sys
+import threading
+import time
+
+# time.sleep is only accurate to the ~15 ms system tick on Windows before python 3.11
+if sys.platform == 'win32' and sys.version_info < (3, 11):
+    DEFAULT_SPIN = 0.016
+else:
+    DEFAULT_SPIN = 0.002
+
+
+def sleep_until(deadline, spin=DEFAULT_SPIN):
+    """Sleeps until spin seconds before the deadline (a time.perf_counter() value),
+    then busy waits for the rest. Returns the time at which the deadline was reached."""
+    remaining = deadline - time.perf_counter()
+    if remaining > spin:
+        time.sleep(remaining - spin)
+    now = time.perf_counter()
+    while now < deadline:
+        now = time.perf_counter()
+    return now
+
+
+class FrameScheduler:
+    def __init__(self, fps, n_threads=1, spin=DEFAULT_SPIN):
+        """
+        Params
+        ------
+        fps = float; frame rate of the recording
+        n_threads = int; number of camera threads released together at each frame
+        spin = float; seconds before each frame during which the waiting thread busy waits
+        """
+        self.interval = 1.0 / fps
+        self.spin = spin
+        self.next_frame = None
+        self.tick = 0
+        self.tick_time = None
+        # ticks the threads reached more than half a frame after they were due
+        self.late = 0
+        self.barrier = threading.Barrier(n_threads, action=self._wait_tick)
+
+    def _wait_tick(self):
+        # run by the last thread to reach the barrier, while the others are blocked
+        now = time.perf_counter()
+        if self.next_frame is None:
+            self.next_frame = now
+        elif now > self.next_frame + 0.5 * self.interval:
+            self.late += 1
+        now = sleep_until(self.next_frame, self.spin)
+        self.tick += 1
+        self.tick_time = now
+        # same catch up rule as before: never schedule the next frame less than half a frame away
+        self.next_frame = max(self.next_frame + self.interval, now + 0.5 * self.interval)
+
+    def wait(self, timeout=None):
+        """Blocks until the next frame is due for all the threads. Returns the index of the frame.
+        Raises threading.BrokenBarrierError once the scheduler is aborted."""
+        self.barrier.wait(timeout)
+        return self.tick
+
+    def abort(self):
+        """Releases the waiting threads with threading.BrokenBarrierError, to stop the recording."""
+        self.barrier.abort()
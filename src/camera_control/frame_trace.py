@@ -0,0 +1,128 @@
+"""
+Per-frame latency tracing of the trigger recording pipeline
+
+Every frame is stamped with time.perf_counter() at each stage it goes through:
+the driver callback, the append to the frame buffer of VideoRecordingSession,
+the pop from the buffer by the writer thread, and the return of vid_out.write
+(encoding and handing the frame to the disk). The stamps go straight into a
+preallocated array, indexed by the frame number of the driver, so tracing keeps
+no Python object per frame. With tracing disabled the only cost is a check for None.
+
+The trace is exported as latency histograms between consecutive stages and as
+a Chrome trace (chrome://tracing or https://ui.perfetto.dev) with one track per stage.
+"""
+import json
+
+import numpy as np
+
+STAGE_CALLBACK = 0
+STAGE_ACQUIRED = 1
+STAGE_DEQUEUED = 2
+STAGE_WRITTEN = 3
+STAGES = ('callback', 'acquired', 'dequeued', 'written')
+
+
+class FrameTrace:
+    def __init__(self, cam_num, capacity=1 << 17):
+        """
+        Params
+        ------
+        cam_num = int; camera number, used as the process id in the Chrome trace
+        capacity = int; number of frames kept, older frames are overwritten
+        """
+        self.cam_num = cam_num
+        self.capacity = capacity
+        self.times = np.full((capacity, len(STAGES)), np.nan)
+        self.frame_nums = np.full(capacity, -1, dtype='int64')
+
+    def reset(self):
+        self.times.fill(np.nan)
+        self.frame_nums.fill(-1)
+
+    def stamp(self, frame_num, stage, time_data):
+        row = frame_num % self.capacity
+        if stage == STAGE_CALLBACK:
+            self.frame_nums[row] = frame_num
+            self.times[row].fill(np.nan)
+        self.times[row, stage] = time_data
+
+    def copy_frames(self, frame_nums):
+        """Returns a new FrameTrace with only the given frames, e.g. the frames of one video file."""
+        frame_nums = np.asarray(frame_nums, dtype='int64')
+        rows = frame_nums % self.capacity
+        # frames overwritten by later frames are left out
+        rows = rows[self.frame_nums[rows] == frame_nums]
+        trace = FrameTrace(self.cam_num, capacity=max(len(rows), 1))
+        trace.frame_nums[:len(rows)] = self.frame_nums[rows]
+        trace.times[:len(rows)] = self.times[rows]
+        return trace
+
+    def get_frames(self):
+        """Returns the frame numbers and the stage times of the traced frames, sorted by frame number."""
+        valid = self.frame_nums >= 0
+        order = np.argsort(self.frame_nums[valid])
+        return self.frame_nums[valid][order], self.times[valid][order]
+
+    def get_latencies(self, start_stage=STAGE_CALLBACK, end_stage=STAGE_WRITTEN):
+        """Returns the latencies in ms between two stages, for the frames that went through both."""
+        _, times = self.get_frames()
+        latencies = (times[:, end_stage] - times[:, start_stage]) * 1000
+        return latencies[~np.isnan(latencies)]
+
+    def get_histograms(self, bin_width=0.25, max_latency=100):
+        """
+        Returns the latency histogram between each pair of consecutive stages and from the first to the last stage,
+        as a dict of {'callback->acquired': {'bins': ..., 'counts': ..., 'percentiles': ...}}.
+        Latencies above max_latency (ms) are counted in the last bin.
+        """
+        edges = np.arange(0, max_latency + bin_width, bin_width)
+        stage_pairs = [(i, i + 1) for i in range(len(STAGES) - 1)] + [(0, len(STAGES) - 1)]
+
+        histograms = {}
+        for start_stage, end_stage in stage_pairs:
+            latencies = self.get_latencies(start_stage, end_stage)
+            counts, _ = np.histogram(np.clip(latencies, 0, max_latency), bins=edges)
+            percentiles = np.percentile(latencies, [50, 90, 99, 100]) if len(latencies) > 0 else np.full(4, np.nan)
+            histograms[f'{STAGES[start_stage]}->{STAGES[end_stage]}'] = {
+                'bins': edges.tolist(),
+                'counts': counts.tolist(),
+                'frames': len(latencies),
+                'percentiles': dict(zip(['p50', 'p90', 'p99', 'max'], percentiles.tolist()))
+            }
+        return histograms
+
+    def print_summary(self):
+        for name, histogram in self.get_histograms().items():
+            p = histogram['percentiles']
+            print(f"Cam {self.cam_num} {name}: {histogram['frames']} frames, p50 {p['p50']:.2f} ms, "
+                  f"p90 {p['p90']:.2f} ms, p99 {p['p99']:.2f} ms, max {p['max']:.2f} ms")
+
+    def get_chrome_trace_events(self, start_time=None):
+        """
+        Returns the frames as Chrome trace complete events, one track per stage of the camera.
+        Times are in microseconds from start_time, by default the first stamp of the trace.
+        """
+        frame_nums, times = self.get_frames()
+        if start_time is None:
+            start_time = np.nanmin(times) if np.any(~np.isnan(times)) else 0
+
+        events = [{'name': 'process_name', 'ph': 'M', 'pid': self.cam_num, 'args': {'name': f'Cam {self.cam_num}'}}]
+        for stage in range(len(STAGES) - 1):
+            events.append({'name': 'thread_name', 'ph': 'M', 'pid': self.cam_num, 'tid': stage,
+                           'args': {'name': f'{STAGES[stage]}->{STAGES[stage + 1]}'}})
+
+            starts = (times[:, stage] - start_time) * 1e6
+            durations = (times[:, stage + 1] - times[:, stage]) * 1e6
+            valid = ~np.isnan(durations)
+            for frame_num, ts, dur in zip(frame_nums[valid].tolist(), starts[valid].tolist(), durations[valid].tolist()):
+                events.append({'name': f'frame {frame_num}', 'ph': 'X', 'pid': self.cam_num, 'tid': stage,
+                               'ts': ts, 'dur': dur})
+        return events
+
+    def save(self, trace_file, latency_file=None, start_time=None):
+        """Saves the Chrome trace of the camera to trace_file and its latency histograms to latency_file."""
+        with open(trace_file, 'w') as f:
+            json.dump({'traceEvents': self.get_chrome_trace_events(start_time), 'displayTimeUnit': 'ms'}, f)
+        if latency_file is not None:
+            with open(latency_file, 'w') as f:
+                json.dump(self.get_histograms(), f)
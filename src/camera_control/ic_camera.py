@@ -16,19 +16,40 @@ from pathlib import Path
 import os
 import json
 import cv2
-import copy
 import threading
 from collections import deque
 
+from src.camera_control.async_log import get_logger
+from src.camera_control.frame_trace import FrameTrace, STAGE_CALLBACK, STAGE_ACQUIRED, STAGE_DEQUEUED, STAGE_WRITTEN
+from src.camera_control.roi_tracker import ROITracker
+from src.camera_control.timestamp_stream import TimestampStream, get_journal_file
+
 path = Path(os.path.realpath(__file__))
 # Navigate to the outer parent directory and join the filename
 dets_file = os.path.normpath(str(path.parents[2] / 'config-files' / 'camera_details.json'))
 cam_details = json.load(open(dets_file, 'r'))
 
+# the frame callbacks and frame waits run for every frame, they log through the asynchronous log
+callback_log = get_logger('camera.callback')
+frame_wait_log = get_logger('camera.frame_wait')
+
+# unique names of the connected devices, listed once and shared by all the cameras
+_devices = None
+_devices_lock = threading.Lock()
+
+
+def get_devices(cam, refresh=False):
+    global _devices
+    # cameras can be created from several threads at the same time
+    with _devices_lock:
+        if _devices is None or refresh:
+            _devices = cam.GetDevices()
+    return _devices
+
 
 class ICCam(ctypes.Structure):
     
-    def __init__(self, cam_num=0, rotate=None, crop=None, exposure=None, gain=None, formats=None):
+    def __init__(self, cam_num=0, rotate=None, crop=None, exposure=None, gain=None, formats=None, state_dir=None):
         '''
         Params
         ------
@@ -36,6 +57,10 @@ class ICCam(ctypes.Structure):
             default = 0
         crop = dict; contains ints named top, left, height, width for cropping
             default = None, uses default parameters specific to camera
+        state_dir = str; directory of the device state snapshots, see save_device_snapshot. If there is a snapshot
+            of this device, its video format, frame rate and properties are restored in one call instead of
+            being set one by one
+            default = None
         '''
         
         self.cam_num = cam_num
@@ -47,12 +72,16 @@ class ICCam(ctypes.Structure):
         self.formats = self.config_formats(width=self.crop['width'], height=self.crop['height'])
         
         self.cam = ic.TIS_CAM()
-        self.cam.open(self.cam.GetDevices()[cam_num].decode())
-        self.cam.SetVideoFormat(Format=self.formats)
+        self.device_name = get_devices(self.cam)[cam_num].decode()
         self.windowPos = {'x': None, 'y': None, 'width': None, 'height': None}
-        # self.add_filters()
-        # self.set_ROI()
-        self.set_formats()
+        self.rotate_filter = None
+        self.roi_filter = None
+        self.from_snapshot = state_dir is not None and self.open_device_snapshot(state_dir)
+        if not self.from_snapshot:
+            self.cam.open(self.device_name)
+            # self.add_filters()
+            # self.set_ROI()
+            self.reconfigure(formats=self.formats, frame_rate='highest')
         self.vid_file = VideoRecordingSession(cam_num=self.cam_num)
         self.frame_data = FrameData()
         self.x_offset = None
@@ -64,13 +93,16 @@ class ICCam(ctypes.Structure):
         height = height if height is not None else self.crop['height']
         width = width if width is not None else self.crop['width']
         
-        if self.rotate != 0:
-            h_r = self.cam.CreateFrameFilter(b'Rotate Flip')
-            self.cam.AddFrameFilter(h_r)
-            self.cam.FilterSetParameter(h_r, b'Rotation Angle', self.rotate)
+        # the filters are only added once, later calls update their parameters
+        if self.rotate != 0 and self.rotate_filter is None:
+            self.rotate_filter = self.cam.CreateFrameFilter(b'Rotate Flip')
+            self.cam.AddFrameFilter(self.rotate_filter)
+            self.cam.FilterSetParameter(self.rotate_filter, b'Rotation Angle', self.rotate)
         
-        h_c = self.cam.CreateFrameFilter(b'ROI')
-        self.cam.AddFrameFilter(h_c)
+        if self.roi_filter is None:
+            self.roi_filter = self.cam.CreateFrameFilter(b'ROI')
+            self.cam.AddFrameFilter(self.roi_filter)
+        h_c = self.roi_filter
         self.cam.FilterSetParameter(h_c, b'Top', top)
         self.cam.FilterSetParameter(h_c, b'Left', left)
         self.cam.FilterSetParameter(h_c, b'Height', height)
@@ -82,13 +114,8 @@ class ICCam(ctypes.Structure):
         self.crop['left'] = left if left is not None else self.crop['left']
         self.crop['height'] = height if height is not None else self.crop['height']
         self.crop['width'] = width if width is not None else self.crop['width']
-        self.cam.close()
-        self.cam = ic.TIS_CAM()
-        self.cam.open(self.cam.GetDevices()[self.cam_num].decode())
-        self.cam.SetVideoFormat(Format=self.formats)
-        self.add_filters()
         # self.set_ROI()
-        self.cam.StartLive()
+        self.reconfigure(formats=self.formats, roi=True)
     
     def config_formats(self, width, height):
         width = int(width)
@@ -114,20 +141,113 @@ class ICCam(ctypes.Structure):
         self.crop['width'] = width if width is not None else self.crop['width']
         self.crop['height'] = height if height is not None else self.crop['height']
         self.formats = self.config_formats(width=self.crop['width'], height=self.crop['height'])
-        current_frame_rate = self.get_frame_rate()
+        # set the highest frame rate to decrease drop frame rate
+        self.reconfigure(formats=self.formats, frame_rate='highest')
+    
+    def reconfigure(self, formats=None, roi=False, x_offset=None, y_offset=None, frame_rate=None):
+        """
+        Applies the video format, ROI filter, partial scan and frame rate changes in one batch
+        while live mode is suspended, without closing the device.
+        The device is only reopened if the driver still rejects the video format once the stream is stopped.
         
+        Params
+        ------
+        formats = str; video format, e.g. 'Y800 (640x480)'
+        roi = bool; update the ROI filter from self.crop
+        x_offset, y_offset = int; partial scan offsets
+        frame_rate = float, or 'highest' for the highest frame rate available with the new format
+        """
+        self.cam.SuspendLive()
+        try:
+            if formats is not None and self.cam.SetVideoFormat(Format=formats) != 1:
+                # some drivers only accept a new format once the stream is fully stopped
+                self.cam.StopLive()
+                if self.cam.SetVideoFormat(Format=formats) != 1:
+                    print(f'Cam {self.cam_num} rejected video format {formats}, reopening the device')
+                    roi = roi or self.roi_filter is not None
+                    self.reopen()
+                    self.cam.SetVideoFormat(Format=formats)
+            
+            if roi:
+                self.add_filters()
+            
+            if x_offset is not None or y_offset is not None:
+                self.set_partial_scan(x_offset=x_offset, y_offset=y_offset)
+            
+            if frame_rate == 'highest':
+                self.set_frame_rate_highest()
+            elif frame_rate is not None:
+                self.set_frame_rate(frame_rate)
+        finally:
+            self.cam.StartLive()
+    
+    def reopen(self):
+        """
+        Closes and opens the device again, with the device name listed when the camera was created
+        """
         self.cam.close()
         self.cam = ic.TIS_CAM()
-        self.cam.open(self.cam.GetDevices()[self.cam_num].decode())
-        self.cam.SetVideoFormat(Format=self.formats)
-        # self.cam.SetFrameRate(current_frame_rate)
-        self.set_frame_rate_highest() # set the highest frame rate to decrease drop frame rate
-        self.cam.StartLive()
-        
+        self.cam.open(self.device_name)
+        self.rotate_filter = None
+        self.roi_filter = None
     
     def get_formats(self):
         return (self.crop['width'], self.crop['height'])
     
+    def save_device_state(self, fname):
+        """
+        Saves the device, video format, frame rate and properties of the camera to an xml file
+        """
+        return self.cam.SaveDeviceStateToFile(fname)
+    
+    def release_device(self):
+        """
+        Closes the device so it can be opened by another process
+        """
+        self.cam.StopLive()
+        self.cam.close()
+    
+    def load_device_state(self, fname):
+        """
+        Opens the device again with the state saved by save_device_state
+        """
+        self.cam = ic.TIS_CAM()
+        self.cam.LoadDeviceStateFromFile(fname)
+        self.cam.StartLive()
+    
+    def get_snapshot_file(self, state_dir):
+        # one snapshot per device, named after its unique name so it cannot be loaded into another camera
+        return os.path.join(state_dir, self.device_name.replace(' ', '_') + '.xml')
+    
+    def save_device_snapshot(self, state_dir):
+        """
+        Saves the device state of the camera to state_dir, to be restored by the next ICCam of this device
+        """
+        os.makedirs(state_dir, exist_ok=True)
+        fname = self.get_snapshot_file(state_dir)
+        result = self.save_device_state(fname)
+        print(f'Cam {self.cam_num} state saved to {fname}')
+        return result
+    
+    def open_device_snapshot(self, state_dir):
+        """
+        Opens the device with the state saved by save_device_snapshot. Returns False if there is no valid snapshot
+        """
+        fname = self.get_snapshot_file(state_dir)
+        if not os.path.isfile(fname):
+            return False
+        self.cam.LoadDeviceStateFromFile(fname)
+        if not self.cam.IsDevValid():
+            print(f'Cam {self.cam_num} could not be opened from {fname}, setting it up from camera_details.json')
+            self.cam = ic.TIS_CAM()
+            return False
+        # the snapshot may hold another format than camera_details.json
+        (width, height) = self.get_video_format()
+        if width > 0 and height > 0:
+            self.formats = self.config_formats(width=width, height=height)
+        print(f'Cam {self.cam_num} restored from {fname}')
+        return True
+    
     def get_crop(self):
         return (self.crop['top'], self.crop['left'], self.crop['height'], self.crop['width'])
     
@@ -193,6 +313,22 @@ class ICCam(ctypes.Structure):
         height = self.cam.GetVideoFormatHeight()
         return (width, height)
     
+    def get_frame_shape(self):
+        """
+        Returns the shape of the frames of get_image. Without a frame yet, e.g. right after the camera started,
+        it is taken from the video format, with the 3 channels of the sink.
+        """
+        try:
+            frame = self.get_image()
+        except Exception:
+            frame = None
+        if frame is not None:
+            return frame.shape
+        width, height = self.get_video_format()
+        if self.rotate in (90, 270):
+            width, height = height, width
+        return (height, width, 3)
+    
     
     
     def enable_trigger(self, legacy=False):
@@ -263,12 +399,12 @@ class ICCam(ctypes.Structure):
         self.cam.GetPropertySwitch("Trigger", "Polarity", Value=polarity)
         return polarity[0]
     
-    def set_up_video_trigger(self, video_file, fourcc, fps, dim, trackingCoords=None):
+    def set_up_video_trigger(self, video_file, fourcc, fps, dim, trackingCoords=None, rois=None):
         if self.vid_file is not None:
             self.vid_file.release()
         buffer_size, width, height, bpp = self.cam.GetFrameData()
         self.vid_file.set_params(video_file=video_file, fourcc=fourcc, fps=fps, dim=dim, buffer_size=buffer_size,
-                                 width=width, height=height, bitsperpixel=bpp, trackingCoords=trackingCoords)
+                                 width=width, height=height, bitsperpixel=bpp, trackingCoords=trackingCoords, rois=rois)
         print(f'Trigger capturing mode vid file is ready for {self.cam_num}')
         return self.vid_file
     
@@ -280,10 +416,11 @@ class ICCam(ctypes.Structure):
     
     def release_video_file(self):
         if self.vid_file is not None:
-            frame_times = copy.deepcopy(self.vid_file.frame_times)
-            frame_num = copy.deepcopy(self.vid_file.frame_num)
-            tracking_value = copy.deepcopy(self.vid_file.tracking_value)
+            # released first, so the frames still in the buffer are written and timestamped
             self.vid_file.release()
+            frame_times = self.vid_file.frame_times
+            frame_num = self.vid_file.frame_num
+            tracking_value = self.vid_file.get_tracking_value()
             
             print(f'Flipping vertical back for cam {self.cam_num}')
             self.set_flip_vertical(state=False)
@@ -335,8 +472,10 @@ class ICCam(ctypes.Structure):
         print(f'Cam {self.cam_num} video callback set up {self.cam.callback_registered}')
     
     def create_frame_callback_legacy(self):
+        cam_num = self.cam_num
+        
         def frame_callback_video(handle_ptr, pBuffer, frame_number, pData):
-            print('Frame callback function legacy - received')
+            callback_log.debug('Cam %d legacy frame callback received frame %d', cam_num, frame_number)
             pData.set_frame_ready(frame_number)
         
         return ic.TIS_GrabberDLL.FRAMEREADYCALLBACK(frame_callback_video)
@@ -446,11 +585,174 @@ class VideoRecordingSession(ctypes.Structure):
         self.cam_num = cam_num
         self.recording_status = False
         self.vid_out = None
-        self.frame_times = []
-        self.frame_num = []
+        self.timestamps = TimestampStream()
         self.frame_ready = False
         self.tracking_value = None
+        self.tracking_point = False
+        self.roi_tracker = None
         self.recent_frame_time = None
+        self.trace = None
+        self.video_file = None
+        self.frame_buffer_length = 0
+        self.frame_count = 0
+        self.reset_counters()
+        self.standby = None
+        self.standby_thread = None
+        self.finish_threads = []
+        self.set_rollover()
+    
+    @property
+    def frame_times(self):
+        """Times of the frames written to the current file"""
+        return self.timestamps.get_times()
+    
+    @property
+    def frame_num(self):
+        """Driver frame numbers of the frames written to the current file"""
+        return self.timestamps.get_frame_nums()
+    
+    def reset_counters(self):
+        # counters of the pipeline, reported by get_metrics
+        self.frames_acquired = 0
+        self.overruns = 0
+        self.bytes_encoded = 0
+        self.encode_seconds = 0.0
+    
+    def get_metrics(self):
+        """
+        Returns the counters of the recording, see metrics_server.py
+        """
+        return {'cam': self.cam_num, 'video_file': self.video_file,
+                'frames_acquired': self.frames_acquired, 'frames_written': self.frame_count,
+                'overruns': self.overruns, 'buffer_length': self.frame_buffer_length,
+                'bytes_encoded': self.bytes_encoded, 'encode_seconds': self.encode_seconds}
+    
+    def enable_trace(self, capacity=1 << 17):
+        """
+        Stamps every frame at each stage of the pipeline into a FrameTrace, see frame_trace.py
+        """
+        if self.trace is None or self.trace.capacity != capacity:
+            self.trace = FrameTrace(self.cam_num, capacity=capacity)
+        else:
+            self.trace.reset()
+        return self.trace
+    
+    def disable_trace(self):
+        self.trace = None
+    
+    def set_rollover(self, next_file=None, max_duration=None, max_bytes=None, max_gap=None, on_rollover=None):
+        """
+        Splits the recording into consecutive files without stopping it. The next file is opened in the background
+        while the current one is written, and the writer thread switches to it between two frames, so no frame is
+        dropped: the callback keeps filling the frame buffer during the switch. Called without next_file, disables it.
+        
+        Params
+        ------
+        next_file = callable; returns the name of the next video file
+        max_duration = float; seconds of frames in a file
+        max_bytes = int; size of a file on disk, checked once per second
+        max_gap = float; a gap of more than max_gap seconds between two frames, e.g. between two trigger trains,
+            starts a new file
+        on_rollover = callable; called in a background thread with the video_file, frame_times, frame_num and
+            tracking_value of every finished file, after it is released. The timestamp journal of the file is
+            removed once it returns
+        """
+        # a next file opened for the previous settings is not used
+        self.discard_next_file()
+        self.next_file = next_file
+        self.max_duration = max_duration
+        self.max_bytes = max_bytes
+        self.max_gap = max_gap
+        self.on_rollover = on_rollover
+        self.size_check_time = 0
+        if next_file is not None and self.vid_out is not None:
+            self.prepare_next_file()
+    
+    def prepare_next_file(self, max_tries=1000):
+        """
+        Opens the next video file in a background thread. The names of files that already exist are skipped,
+        so an existing video is never truncated; without a free name after max_tries, there is no next file.
+        """
+        if self.next_file is None or self.standby_thread is not None:
+            return
+        next_file = self.next_file
+        
+        def open_next_file():
+            for _ in range(max_tries):
+                video_file = next_file()
+                if not os.path.exists(video_file):
+                    self.standby = (video_file, cv2.VideoWriter(video_file, self.fourcc, self.fps, self.dim))
+                    return
+                print(f'Cam {self.cam_num} next file {os.path.basename(video_file)} already exists, skipping it')
+            self.standby = None
+        
+        self.standby_thread = threading.Thread(target=open_next_file, name=f'Cam {self.cam_num} next file', daemon=True)
+        self.standby_thread.start()
+    
+    def discard_next_file(self):
+        """
+        Closes and removes the next video file if it was opened but not used
+        """
+        if self.standby_thread is None:
+            return
+        self.standby_thread.join()
+        if self.standby is not None:
+            video_file, vid_out = self.standby
+            vid_out.release()
+            if os.path.isfile(video_file):
+                os.remove(video_file)
+        self.standby = None
+        self.standby_thread = None
+    
+    def needs_rollover(self, time_data):
+        """
+        Returns whether the frame taken at time_data should be the first frame of the next file
+        """
+        timestamps = self.timestamps
+        if timestamps.count == 0:
+            return False
+        if self.max_gap is not None and time_data - timestamps.records['time'][timestamps.count - 1] > self.max_gap:
+            return True
+        if self.max_duration is not None and time_data - timestamps.records['time'][0] >= self.max_duration:
+            return True
+        if self.max_bytes is not None and time_data - self.size_check_time >= 1:
+            self.size_check_time = time_data
+            return os.path.getsize(self.video_file) >= self.max_bytes
+        return False
+    
+    def rollover(self):
+        """
+        Switches the writer to the next video file, from the writer thread between two frames. The finished file
+        is released and passed to on_rollover in the background.
+        """
+        self.standby_thread.join()
+        standby = self.standby
+        self.standby = None
+        self.standby_thread = None
+        if standby is None:
+            # no free name for the next file, keep writing the current one
+            return
+        video_file, vid_out = standby
+        
+        finished = (self.video_file, self.vid_out, self.timestamps, self.get_tracking_value(), self.on_rollover)
+        self.video_file = video_file
+        self.vid_out = vid_out
+        self.timestamps = TimestampStream(get_journal_file(video_file))
+        if self.roi_tracker is not None:
+            self.roi_tracker.reset()
+        
+        finish_thread = threading.Thread(target=self._finish_file, args=finished, name=f'Cam {self.cam_num} finish file')
+        finish_thread.start()
+        self.finish_threads = [t for t in self.finish_threads if t.is_alive()] + [finish_thread]
+        self.prepare_next_file()
+    
+    def _finish_file(self, video_file, vid_out, timestamps, tracking_value, on_rollover):
+        vid_out.release()
+        timestamps.close()
+        print(f'Cam {self.cam_num} rolled over from {os.path.basename(video_file)} after {len(timestamps)} frames')
+        if on_rollover is not None:
+            on_rollover(video_file, timestamps.get_times(), timestamps.get_frame_nums(), tracking_value)
+            timestamps.remove_journal()
     
     def set_recording_status(self, status: bool):
         if self.vid_out is None:
@@ -464,7 +766,7 @@ class VideoRecordingSession(ctypes.Structure):
         return 1
     
     def set_params(self, video_file: str = None, fourcc: str = None, fps: int = None, dim=None, buffer_size: int = None,
-                   width=None, height=None, bitsperpixel=None, trackingCoords=None):
+                   width=None, height=None, bitsperpixel=None, trackingCoords=None, rois=None):
         if fourcc is not None:
             self.fourcc = cv2.VideoWriter_fourcc(*fourcc)
         
@@ -486,41 +788,56 @@ class VideoRecordingSession(ctypes.Structure):
         if bitsperpixel is not None:
             self.bitsperpixel = bitsperpixel
         
-        if trackingCoords is not None:
-            self.tracking_x_value = trackingCoords[0]
-            self.tracking_y_value = trackingCoords[1]
-            self.tracking_value = []
+        if trackingCoords is not None or rois is not None:
+            # a tracking point is a ROI of a single pixel
+            if rois is None:
+                rois = {'point': [trackingCoords[0], trackingCoords[1], 1, 1]}
+            self.roi_tracker = ROITracker(rois)
             self.tracking_point = True
         else:
+            self.roi_tracker = None
             self.tracking_point = False
-            self.tracking_value = None
+        self.tracking_value = None
         
         if video_file is not None:
             self.video_file = video_file
             self.vid_out = cv2.VideoWriter(self.video_file, self.fourcc, self.fps, self.dim)
-            self.frame_times = []
-            self.frame_num = []
+            self.timestamps.close()
+            self.timestamps = TimestampStream(get_journal_file(video_file))
             self.frame_buffer = deque(maxlen=250)
             self.frame_buffer_length = 0
             self.frame_count = 0
+            self.reset_counters()
             self.buffer_lock = threading.Lock()
             self.recording_status = False
             self.timeout_status = -1  # -1 = not set, 0 = timeout, 1 = no timeout
             self.timeout_start = 0
+            # the rollover of a previous recording does not carry over to the new file, see set_rollover
+            self.set_rollover()
         
         return 1
     
     def reset(self):
         self.vid_out = None
-        self.frame_times = []
-        self.frame_num = []
+        self.timestamps.close()
+        self.timestamps = TimestampStream()
         self.recording_status = False
         self.tracking_value = None
         self.tracking_point = False
+        self.roi_tracker = None
         self.timeout_status = -1  # -1 = not set, 0 = timeout, 1 = no timeout
         self.timeout_start = 0
     
+    def get_tracking_value(self):
+        """
+        Returns the names, boxes and values of the tracked ROIs as a dict, one row of values per frame time
+        """
+        if self.roi_tracker is None:
+            return None
+        return self.roi_tracker.get_result()
+    
     def delete(self):
+        self.timestamps.remove_journal()
         os.remove(self.video_file)
         self.video_file = None
     
@@ -534,11 +851,15 @@ class VideoRecordingSession(ctypes.Structure):
             
         self.vid_out.release()
         self.vid_out = None
+        # the next file and the callbacks of this recording are not kept for the next one
+        self.set_rollover()
+        for finish_thread in self.finish_threads:
+            finish_thread.join()
+        self.finish_threads = []
+        # the timestamps and ROI values of the file stay available until reset
+        self.timestamps.close()
         self.recording_status = False
-        self.frame_times = []
-        self.frame_num = []
         self.tracking_value = None
-        self.tracking_point = False
         self.timeout_status = -1  # -1 = not set, 0 = timeout, 1 = no timeout
         self.timeout_start = 0
         return 1
@@ -553,15 +874,37 @@ class VideoRecordingSession(ctypes.Structure):
             frame, time_data, frame_num = self.frame_buffer.popleft()
             # if self.frame_buffer_length > 1:
                 # print(f'Cam {self.cam_num} writing frame {frame_num} with time {time_data}, buffer length {self.frame_buffer_length}')
+            if self.next_file is not None and self.needs_rollover(time_data):
+                self.rollover()
+            trace = self.trace
+            encode_start = time.perf_counter()
+            if trace is not None:
+                trace.stamp(frame_num, STAGE_DEQUEUED, encode_start)
             self.vid_out.write(frame)
-            self.frame_times.append(time_data)
-            self.frame_num.append(frame_num)
+            encode_end = time.perf_counter()
+            if trace is not None:
+                trace.stamp(frame_num, STAGE_WRITTEN, encode_end)
+            self.encode_seconds += encode_end - encode_start
+            self.bytes_encoded += frame.nbytes
+            self.timestamps.append(time_data, frame_num)
+            # one row of ROI values per written frame, in the order of frame_times
+            if self.roi_tracker is not None:
+                self.roi_tracker.sample(frame)
             self.frame_buffer_length = len(self.frame_buffer)
-            self.frame_count += 1  # if self.tracking_point:  #     x = self.tracking_x_value  #     y = self.tracking_y_value  #     self.tracking_value.append(cv2.getRectSubPix(frame, (1, 1), (x, y))[0, 0])
+            self.frame_count += 1
     
     def acquire_frame(self, frame, time_data, frame_num):
         if self.recording_status:
+            # a full buffer drops its oldest frame
+            if len(self.frame_buffer) == self.frame_buffer.maxlen:
+                self.overruns += 1
+            # stamped before the append, the writer thread may stamp the frame as soon as it is in the buffer
+            trace = self.trace
+            if trace is not None:
+                trace.stamp(frame_num, STAGE_CALLBACK, time_data)
+                trace.stamp(frame_num, STAGE_ACQUIRED, time.perf_counter())
             self.frame_buffer.append((frame, time_data, frame_num))
+            self.frames_acquired += 1
             self.timeout_start = time_data
         # print(f'Cam {self.cam_num} frame {frame_num} acquired with time {time_data}')
         
@@ -571,10 +914,10 @@ class VideoRecordingSession(ctypes.Structure):
         self.frame_buffer = deque(maxlen=250)
         self.frame_buffer_length = 0
         self.frame_count = 0
-        self.frame_times = []
-        self.frame_num = []
-        self.tracking_value = None
-        self.tracking_point = False
+        self.reset_counters()
+        self.timestamps.reset()
+        if self.roi_tracker is not None:
+            self.roi_tracker.reset()
         self.timeout_status = -1  # -1 = not set, 0 = timeout, 1 = no timeout
         self.timeout_start = 0
         return 1
@@ -628,12 +971,12 @@ class FrameData(ctypes.Structure):
             start = time.perf_counter()
             elapsed = (time.perf_counter() - start) * 1000
             while not self.frame_ready and elapsed < timeout:
-                print(f'Waiting for frame {self.frame_num} to be ready')
+                frame_wait_log.debug('Waiting for frame %d to be ready', self.frame_num)
                 # time.sleep(0.001)
                 elapsed = (time.perf_counter() - start) * 1000
         else:
             while not self.frame_ready:
                 time.sleep(0.001)
         
-        print(f'Frame {self.frame_num} is ready')
+        frame_wait_log.debug('Frame %d is ready', self.frame_num)
         return self.frame_num
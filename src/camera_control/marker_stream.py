@@ -0,0 +1,158 @@
+"""
+Live 3D positions of bright markers, triangulated from the frame sets of a FrameBus
+
+A thread takes the latest complete frame set of the bus, finds the blobs of every camera,
+triangulates them with the cached calibration (see aniposelib.markers) and publishes the
+markers with their capture time:
+
+- as a row of a CSV file (MARKERS_<session>.csv), flushed at least every flush_interval seconds
+- as a JSON datagram to a local UDP port, e.g. for a closed-loop experiment
+
+    {"generation": 1204, "time": 5321.0213, "markers": [[x, y, z], null, ...], "latency_ms": 3.2}
+
+Frame sets that are not picked up in time are overwritten on the bus, so the markers lag at
+most one set behind the capture. The latency of every stage from the capture of the earliest
+frame of the set to the publication is kept for the last history sets.
+"""
+import json
+import socket
+import threading
+import time
+
+import numpy as np
+
+from src.camera_control.async_log import get_logger
+from src.aniposelib.markers import BlobFinder, MarkerTriangulator
+
+marker_log = get_logger('markers')
+
+# latency stages, in the columns of the latency array
+STAGES = ['wait', 'detect', 'triangulate', 'publish', 'total']
+
+
+class MarkerStream:
+    def __init__(self, bus, cgroup, output_file=None, port=None, host='127.0.0.1', max_markers=4, threshold=200,
+                 min_area=2, max_area=5000, max_error=5.0, flush_interval=1.0, history=1 << 14):
+        """
+        Params
+        ------
+        bus = FrameBus; frame sets of all the cameras of the calibration
+        cgroup = CameraGroup; calibration of the cameras
+        output_file = str; CSV file the markers are written to, None to not write them
+        port = int; local UDP port the markers are sent to, None to not send them
+        max_markers = int; number of marker slots
+        threshold = int; minimum intensity of the pixels of a marker
+        min_area, max_area = int; area of a marker in pixels
+        max_error = float; maximum reprojection error in pixels of a blob belonging to a marker
+        history = int; number of frame sets the latencies are kept for
+        """
+        self.bus = bus
+        self.finder = BlobFinder(threshold=threshold, min_area=min_area, max_area=max_area)
+        self.triangulator = MarkerTriangulator(cgroup, max_markers=max_markers, max_error=max_error)
+        self.max_markers = max_markers
+        self.output_file = output_file
+        self.address = (host, port) if port is not None else None
+        self.flush_interval = flush_interval
+
+        self.latencies = np.full((history, len(STAGES)), np.nan)
+        self.count = 0
+        self.dropped = 0
+        self.generation = -1
+        self.file = None
+        self.sock = None
+        self.last_flush = 0
+        self.stop_event = threading.Event()
+        self.thread = None
+
+    def open(self):
+        """Opens the CSV file and the socket, process() can then be called without the thread."""
+        if self.output_file is not None:
+            self.file = open(self.output_file, 'w')
+            columns = [f'm{k}_{axis}' for k in range(self.max_markers) for axis in ['x', 'y', 'z']]
+            self.file.write(','.join(['generation', 'time', 'latency_ms'] + columns) + '\n')
+        if self.address is not None:
+            self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+    def start(self):
+        self.open()
+        self.stop_event.clear()
+        self.thread = threading.Thread(target=self._run, name='Marker stream', daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        """Stops the thread, closes the file and the socket and prints the latencies."""
+        self.stop_event.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+        if self.sock is not None:
+            self.sock.close()
+            self.sock = None
+        self.print_summary()
+
+    def _run(self):
+        while not self.stop_event.is_set():
+            frame_set = self.bus.wait_latest(self.generation, timeout=0.5)
+            if frame_set is None:
+                if self.bus.closed:
+                    return
+                continue
+            try:
+                with frame_set:
+                    self.process(frame_set.generation, frame_set.frames, frame_set.frame_times)
+            except Exception as e:
+                marker_log.warning('Marker tracking failed on frame set %d: %s', frame_set.generation, e)
+
+    def process(self, generation, frames, frame_times):
+        """Triangulates and publishes the markers of one frame set. Returns the max_markers x 3 markers."""
+        start = time.perf_counter()
+        if self.generation >= 0 and generation > self.generation + 1:
+            self.dropped += generation - self.generation - 1
+        self.generation = generation
+        capture_time = float(np.min(frame_times))
+
+        blobs = [self.finder.find(num, frame) for num, frame in enumerate(frames)]
+        detected = time.perf_counter()
+        markers, _ = self.triangulator.track(blobs)
+        triangulated = time.perf_counter()
+        self.publish(generation, capture_time, markers, triangulated - capture_time)
+        published = time.perf_counter()
+
+        self.latencies[self.count % len(self.latencies)] = [start - capture_time, detected - start,
+                                                            triangulated - detected, published - triangulated,
+                                                            published - capture_time]
+        self.count += 1
+        return markers
+
+    def publish(self, generation, capture_time, markers, latency):
+        if self.file is not None:
+            values = ','.join('' if np.isnan(v) else f'{v:.3f}' for v in markers.ravel())
+            self.file.write(f'{generation},{capture_time:.6f},{latency * 1000:.3f},{values}\n')
+            if time.perf_counter() - self.last_flush >= self.flush_interval:
+                self.file.flush()
+                self.last_flush = time.perf_counter()
+        if self.sock is not None:
+            message = {'generation': int(generation), 'time': capture_time,
+                       'markers': [None if np.isnan(m[0]) else [round(float(v), 3) for v in m] for m in markers],
+                       'latency_ms': round(latency * 1000, 3)}
+            try:
+                self.sock.sendto(json.dumps(message).encode(), self.address)
+            except OSError as e:
+                marker_log.debug('Could not send the markers: %s', e)
+
+    def get_latencies(self):
+        """Returns the latencies in ms of the last frame sets, as a dict of arrays per stage."""
+        latencies = self.latencies[:min(self.count, len(self.latencies))] * 1000
+        return {stage: latencies[:, i] for i, stage in enumerate(STAGES)}
+
+    def print_summary(self):
+        if self.count == 0:
+            print('No frame set was processed by the marker stream')
+            return
+        print(f'Markers of {self.count} frame sets published, {self.dropped} frame sets dropped')
+        for stage, latencies in self.get_latencies().items():
+            print(f'{stage}: median {np.median(latencies):.2f} ms, 99% {np.percentile(latencies, 99):.2f} ms, '
+                  f'max {np.max(latencies):.2f} ms')
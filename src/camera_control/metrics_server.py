@@ -0,0 +1,164 @@
+"""
+Local metrics endpoint for live acquisition telemetry
+
+Serves the counters of the recording pipeline over HTTP on localhost, so long
+unattended sessions can be watched without the GUI:
+
+    http://127.0.0.1:9464/metrics       Prometheus text format
+    http://127.0.0.1:9464/metrics.json  JSON
+
+The counters are read from a collect() callable, which returns one dict per camera
+with the raw counters (see VideoRecordingSession.get_metrics). The rates are derived
+here from the difference between two samples, so the recording threads only increment counters.
+"""
+import json
+import os
+import shutil
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# raw counters reported by collect(), with their Prometheus type and help text
+COUNTERS = {
+    'frames_acquired': ('counter', 'Frames received from the camera'),
+    'frames_written': ('counter', 'Frames written to the video file'),
+    'overruns': ('counter', 'Frames dropped because the frame buffer was full or the frame was late'),
+    'bytes_encoded': ('counter', 'Bytes of raw frames passed to the video encoder'),
+    'encode_seconds': ('counter', 'Time spent in the video encoder'),
+    'buffer_length': ('gauge', 'Frames waiting in the frame buffer'),
+}
+# metrics derived from two samples or from the file system
+DERIVED = {
+    'fps': ('gauge', 'Frames written per second'),
+    'encoder_bytes_per_second': ('gauge', 'Bytes of raw frames encoded per second'),
+    'encoder_utilization': ('gauge', 'Fraction of the time spent in the video encoder'),
+    'disk_write_bytes_per_second': ('gauge', 'Growth of the video file in bytes per second'),
+    'video_file_bytes': ('gauge', 'Size of the video file'),
+    'disk_free_bytes': ('gauge', 'Free space on the disk of the video file'),
+}
+RATES = {
+    'fps': 'frames_written',
+    'encoder_bytes_per_second': 'bytes_encoded',
+    'encoder_utilization': 'encode_seconds',
+    'disk_write_bytes_per_second': 'video_file_bytes',
+}
+
+
+class MetricsServer:
+    def __init__(self, collect, port=9464, host='127.0.0.1', prefix='camgui', min_interval=0.5):
+        """
+        Params
+        ------
+        collect = callable; returns a list with a dict of counters for each camera, with the keys of COUNTERS
+            plus 'cam' and optionally 'video_file'
+        port = int; port of the HTTP server, 0 picks a free port
+        host = str; address of the HTTP server, only local by default
+        prefix = str; prefix of the Prometheus metric names
+        min_interval = float; the rates are computed over at least min_interval seconds
+        """
+        self.collect = collect
+        self.host = host
+        self.port = port
+        self.prefix = prefix
+        self.min_interval = min_interval
+        self.previous = None
+        self.rates = {}
+        self.sample_lock = threading.Lock()
+        self.httpd = None
+        self.thread = None
+
+    def sample(self):
+        """Returns the current metrics of every camera, the rates and the frame count divergence between cameras."""
+        with self.sample_lock:
+            now = time.perf_counter()
+            cameras = []
+            for counters in self.collect():
+                metrics = {key: counters.get(key, 0) for key in COUNTERS}
+                metrics['cam'] = counters['cam']
+                video_file = counters.get('video_file')
+                metrics['video_file_bytes'] = 0
+                metrics['disk_free_bytes'] = 0
+                if video_file:
+                    if os.path.isfile(video_file):
+                        metrics['video_file_bytes'] = os.path.getsize(video_file)
+                    directory = os.path.dirname(os.path.abspath(video_file))
+                    if os.path.isdir(directory):
+                        metrics['disk_free_bytes'] = shutil.disk_usage(directory).free
+                cameras.append(metrics)
+
+            # rates over the time since the previous sample, kept until min_interval has passed
+            if self.previous is None:
+                self.previous = (now, {m['cam']: m for m in cameras})
+            elif now - self.previous[0] >= self.min_interval:
+                previous_time, previous_cameras = self.previous
+                for metrics in cameras:
+                    previous = previous_cameras.get(metrics['cam'])
+                    self.rates[metrics['cam']] = {
+                        rate: max(0, metrics[key] - previous[key]) / (now - previous_time) if previous else 0
+                        for rate, key in RATES.items()}
+                self.previous = (now, {m['cam']: m for m in cameras})
+
+            for metrics in cameras:
+                metrics.update(self.rates.get(metrics['cam'], dict.fromkeys(RATES, 0)))
+
+            frames_written = [m['frames_written'] for m in cameras]
+            divergence = max(frames_written) - min(frames_written) if len(frames_written) > 1 else 0
+            return {'time': time.time(), 'cameras': cameras, 'frame_count_divergence': divergence}
+
+    def to_prometheus(self, sample):
+        lines = []
+        for name, (metric_type, help_text) in {**COUNTERS, **DERIVED}.items():
+            full_name = f'{self.prefix}_{name}' + ('_total' if metric_type == 'counter' else '')
+            lines.append(f'# HELP {full_name} {help_text}')
+            lines.append(f'# TYPE {full_name} {metric_type}')
+            for metrics in sample['cameras']:
+                lines.append(f'{full_name}{{cam="{metrics["cam"]}"}} {metrics[name]}')
+        full_name = f'{self.prefix}_frame_count_divergence'
+        lines.append(f'# HELP {full_name} Difference between the highest and lowest frame count of the cameras')
+        lines.append(f'# TYPE {full_name} gauge')
+        lines.append(f'{full_name} {sample["frame_count_divergence"]}')
+        return '\n'.join(lines) + '\n'
+
+    def start(self):
+        """Starts serving in a daemon thread. Returns the address of the server."""
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                path = self.path.split('?')[0]
+                try:
+                    if path == '/metrics':
+                        body = server.to_prometheus(server.sample()).encode()
+                        content_type = 'text/plain; version=0.0.4'
+                    elif path in ('/', '/metrics.json'):
+                        body = json.dumps(server.sample()).encode()
+                        content_type = 'application/json'
+                    else:
+                        self.send_error(404)
+                        return
+                except Exception as e:
+                    self.send_error(500, f'{type(e).__name__}: {e}')
+                    return
+                self.send_response(200)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                # keep the console for the recording messages
+                pass
+
+        self.httpd = ThreadingHTTPServer((self.host, self.port), Handler)
+        self.httpd.daemon_threads = True
+        self.port = self.httpd.server_address[1]
+        self.thread = threading.Thread(target=self.httpd.serve_forever, name='Metrics server', daemon=True)
+        self.thread.start()
+        print(f'Metrics available at http://{self.host}:{self.port}/metrics')
+        return self.host, self.port
+
+    def stop(self):
+        if self.httpd is not None:
+            self.httpd.shutdown()
+            self.httpd.server_close()
+            self.httpd = None
@@ -0,0 +1,253 @@
+"""
+Acquisition with one worker process per camera
+
+Each camera is handed over to its own process, which captures and writes the video without
+sharing the GIL with the GUI or the other cameras. The settings of the cameras are carried
+over with the device state files of the IC Imaging Control library. The workers publish
+their status into a shared array and preview frames on a FrameBus, and send the timestamps
+back through a pipe once they are stopped.
+
+Start and stop are synchronized through shared perf_counter() deadlines, which is a system
+wide clock on both Windows and Linux: every worker captures on the same grid of frame slots
+start + k / fps and stops at the first slot after the stop time.
+"""
+import math
+import multiprocessing as mp
+import os
+import tempfile
+import threading
+import time
+import traceback
+
+import cv2
+import numpy as np
+
+from src.camera_control.frame_bus import FrameBus
+from src.camera_control.frame_scheduler import sleep_until
+
+# columns of the shared status array
+STATUS_FRAMES = 0
+STATUS_LAST_TIME = 1
+STATUS_DROPPED = 2
+STATUS_STATE = 3
+N_STATUS = 4
+
+# values of the STATUS_STATE column
+STATE_STARTING = 0
+STATE_READY = 1
+STATE_RECORDING = 2
+STATE_DONE = 3
+STATE_ERROR = -1
+
+
+def acquisition_worker(cam_num, state_file, continuous_mode, video_file, fourcc, fps, dim,
+                       bus, status, start_time, stop_time, conn, preview_every=5):
+    """Captures and writes the video of one camera. Runs in the worker process of the camera."""
+    import src.camera_control.tisgrabber as ic
+
+    status = np.frombuffer(status, dtype='float64').reshape(-1, N_STATUS)
+    frame_times = []
+    frame_nums = []
+    cam = None
+    vid_out = None
+    try:
+        cam = ic.TIS_CAM()
+        cam.LoadDeviceStateFromFile(state_file)
+        cam.SetContinuousMode(continuous_mode)
+        cam.StartLive(0)
+        vid_out = cv2.VideoWriter(video_file, cv2.VideoWriter_fourcc(*fourcc), fps, dim)
+
+        status[cam_num, STATUS_STATE] = STATE_READY
+        conn.send(('ready', cam_num))
+
+        # the controller sets the start time once every camera is ready
+        while start_time.value <= 0 and stop_time.value <= 0:
+            time.sleep(0.001)
+        start = start_time.value
+        if start <= 0:
+            # stopped before the recording started
+            conn.send(('done', frame_times, frame_nums))
+            return
+        interval = 1.0 / fps
+        status[cam_num, STATUS_STATE] = STATE_RECORDING
+
+        slot = 0
+        dropped = 0
+        while True:
+            deadline = start + slot * interval
+            stop = stop_time.value
+            if stop > 0 and deadline >= stop:
+                break
+
+            now = sleep_until(deadline)
+            cam.SnapImage()
+            frame = cv2.flip(cam.GetImageEx(), 0)
+            vid_out.write(frame)
+            frame_times.append(now)
+            frame_nums.append(slot)
+
+            if slot % preview_every == 0:
+                bus.publish(cam_num, frame, slot // preview_every, frame_count=len(frame_nums), frame_time=now)
+
+            # slots more than half a frame in the past are skipped and counted as dropped frames
+            next_slot = max(slot + 1, math.ceil((time.perf_counter() - start) / interval - 0.5))
+            dropped += next_slot - slot - 1
+            slot = next_slot
+
+            status[cam_num, STATUS_FRAMES] = len(frame_nums)
+            status[cam_num, STATUS_LAST_TIME] = now
+            status[cam_num, STATUS_DROPPED] = dropped
+
+        status[cam_num, STATUS_STATE] = STATE_DONE
+        conn.send(('done', frame_times, frame_nums))
+
+    except Exception as e:
+        status[cam_num, STATUS_STATE] = STATE_ERROR
+        conn.send(('error', f'{type(e).__name__}: {e}\n{traceback.format_exc()}'))
+
+    finally:
+        if vid_out is not None:
+            vid_out.release()
+        if cam is not None:
+            cam.StopLive()
+            cam.close()
+        bus.close()
+        conn.close()
+
+
+class ProcessAcquisition:
+    def __init__(self, cams, video_files, fourcc, fps, continuous_mode=1, preview_every=5, state_dir=None,
+                 context='spawn'):
+        """
+        Params
+        ------
+        cams = list of ICCam; cameras handed over to the worker processes while recording
+        video_files = list of str; video file of each camera
+        fourcc = str; codec of the videos
+        fps = int; frame rate of the recording
+        continuous_mode = int; value passed to SetContinuousMode in the workers
+        preview_every = int; every preview_every-th frame is published on the frame bus
+        context = str; start method of the worker processes, spawn so they do not inherit the threads of the GUI
+        """
+        self.cams = cams
+        self.video_files = video_files
+        self.fourcc = fourcc
+        self.fps = fps
+        self.continuous_mode = continuous_mode
+        self.preview_every = preview_every
+        self.state_dir = state_dir if state_dir is not None else tempfile.mkdtemp(prefix='camera_state_')
+
+        self.ctx = mp.get_context(context)
+        self.processes = []
+        self.conns = []
+        self.bus = None
+        self.status = None
+        self.start_time = self.ctx.Value('d', 0.0, lock=False)
+        self.stop_time = self.ctx.Value('d', 0.0, lock=False)
+        self.running = False
+        self.cancelled = threading.Event()
+
+    def get_state_file(self, num):
+        return os.path.join(self.state_dir, f'cam{num}_state.xml')
+
+    def start(self, delay=0.5, timeout=30):
+        """Hands the cameras over to the worker processes and starts recording in all of them at the same time,
+        delay seconds after the last worker is ready. Returns True if the recording started."""
+        n_cams = len(self.cams)
+        frame_shapes = []
+        dims = []
+        for num, cam in enumerate(self.cams):
+            frame = cam.get_image()
+            frame_shapes.append(frame.shape)
+            dims.append((frame.shape[1], frame.shape[0]))
+            cam.save_device_state(self.get_state_file(num))
+            cam.release_device()
+
+        self.bus = FrameBus(frame_shapes, n_buffers=3, lock=self.ctx.Lock())
+        self.status = self.ctx.Array('d', n_cams * N_STATUS, lock=False)
+        self.start_time.value = 0.0
+        self.stop_time.value = 0.0
+
+        for num in range(n_cams):
+            parent_conn, child_conn = self.ctx.Pipe()
+            process = self.ctx.Process(target=acquisition_worker,
+                                       args=(num, self.get_state_file(num), self.continuous_mode,
+                                             self.video_files[num], self.fourcc, self.fps, dims[num],
+                                             self.bus, self.status, self.start_time, self.stop_time,
+                                             child_conn, self.preview_every),
+                                       name=f'Cam {num + 1} acquisition', daemon=True)
+            process.start()
+            self.processes.append(process)
+            self.conns.append(parent_conn)
+
+        deadline = time.perf_counter() + timeout
+        for num, conn in enumerate(self.conns):
+            # polled in short steps so cancel() does not wait for a worker that is still opening its camera
+            while not conn.poll(0.05) and not self.cancelled.is_set() and time.perf_counter() < deadline:
+                pass
+            if self.cancelled.is_set():
+                # the workers are stopped by the stop() of the caller
+                print('Recording in one process per camera cancelled before it started')
+                return False
+            if conn.poll():
+                message = conn.recv()
+            else:
+                message = ('error', 'timed out waiting for the worker')
+            if message[0] != 'ready':
+                print(f'Cam {num} acquisition process failed to start: {message[1]}')
+                self.stop()
+                return False
+
+        self.start_time.value = time.perf_counter() + delay
+        self.running = True
+        print(f'Recording in {n_cams} processes starts at {self.start_time.value:.3f}')
+        return True
+
+    def get_status(self):
+        """Returns an array with the frame count, last frame time, dropped frames and state of each camera."""
+        return np.frombuffer(self.status, dtype='float64').reshape(-1, N_STATUS).copy()
+
+    def get_preview(self, after=-1):
+        """Returns the latest complete FrameSet of preview frames, see FrameBus.acquire_latest."""
+        bus = self.bus
+        return bus.acquire_latest(after) if bus is not None else None
+
+    def cancel(self):
+        """Makes a start() still waiting for the workers return False at once, stop() then stops the workers."""
+        self.cancelled.set()
+
+    def stop(self, timeout=30):
+        """Stops all the workers at the same frame slot and hands the cameras back.
+        Returns the frame times and the frame slot numbers of each camera, empty if it was already stopped."""
+        if self.bus is None:
+            return [[] for _ in self.cams], [[] for _ in self.cams]
+        # leave a couple of frames so every worker sees the stop time before its next slot
+        self.stop_time.value = time.perf_counter() + 2.0 / self.fps
+        frame_times = [[] for _ in self.cams]
+        frame_nums = [[] for _ in self.cams]
+
+        for num, (process, conn) in enumerate(zip(self.processes, self.conns)):
+            try:
+                while conn.poll(timeout):
+                    message = conn.recv()
+                    if message[0] == 'done':
+                        frame_times[num], frame_nums[num] = message[1], message[2]
+                        break
+                    elif message[0] == 'error':
+                        print(f'Cam {num} acquisition process failed: {message[1]}')
+                        break
+            except EOFError:
+                print(f'Cam {num} acquisition process exited without sending its timestamps')
+            process.join(timeout)
+            if process.is_alive():
+                process.terminate()
+
+        for num, cam in enumerate(self.cams):
+            cam.load_device_state(self.get_state_file(num))
+
+        self.bus.close()
+        self.bus = None
+        self.processes = []
+        self.conns = []
+        self.running = False
+        return frame_times, frame_nums
@@ -0,0 +1,96 @@
+"""
+Intensity of regions of interest, sampled from every frame while it is written
+
+Sync LEDs, reward ports and other indicators are usually a few small regions of the
+frame. The pixels of all the ROIs are gathered with one np.take on the flattened frame
+and summed per ROI with np.add.reduceat, so the cost per frame does not grow with the
+number of ROIs. The mean intensity of each ROI is stored in a preallocated array with one
+row per written frame, in the same order as the timestamps.
+"""
+import numpy as np
+
+
+def parse_rois(rois):
+    """
+    Returns the names and the (x, y, width, height) of the ROIs, from either a dict of
+    {name: [x, y, width, height]} or a list of [x, y, width, height].
+    """
+    if rois is None:
+        return [], []
+    if isinstance(rois, dict):
+        names = list(rois.keys())
+        boxes = [tuple(int(v) for v in rois[name]) for name in names]
+    else:
+        boxes = [tuple(int(v) for v in roi) for roi in rois]
+        names = [f'roi{i}' for i in range(len(boxes))]
+    for name, box in zip(names, boxes):
+        if len(box) != 4 or box[2] <= 0 or box[3] <= 0:
+            raise ValueError(f'ROI {name} should be [x, y, width, height], got {box}')
+    return names, boxes
+
+
+class ROITracker:
+    def __init__(self, rois, capacity=1 << 16):
+        """
+        Params
+        ------
+        rois = dict of {name: [x, y, width, height]} or list of [x, y, width, height]; ROIs in frame coordinates
+        capacity = int; initial number of frames of the value array, doubled when it is full
+        """
+        self.names, self.boxes = parse_rois(rois)
+        self.values = np.full((capacity, len(self.boxes)), np.nan, dtype='float32')
+        self.count = 0
+        self.frame_shape = None
+        self.indices = None
+        self.starts = None
+        self.sizes = None
+
+    def _prepare(self, shape):
+        # flat indices of the pixels of every ROI, clipped to the frame, computed once per frame shape
+        height, width = shape[:2]
+        channels = shape[2] if len(shape) > 2 else 1
+        indices = []
+        sizes = []
+        for name, (x, y, w, h) in zip(self.names, self.boxes):
+            x0, x1 = max(0, x), min(width, x + w)
+            y0, y1 = max(0, y), min(height, y + h)
+            if x0 >= x1 or y0 >= y1:
+                raise ValueError(f'ROI {name} {(x, y, w, h)} is outside of the frame of size {width}x{height}')
+            ys, xs = np.mgrid[y0:y1, x0:x1]
+            pixels = (ys * width + xs).ravel()
+            indices.append((pixels[:, None] * channels + np.arange(channels)).ravel())
+            sizes.append(len(indices[-1]))
+        self.indices = np.concatenate(indices)
+        self.sizes = np.array(sizes)
+        self.starts = np.concatenate([[0], np.cumsum(self.sizes)[:-1]])
+        self.frame_shape = shape
+
+    def measure(self, frame):
+        """Returns the mean intensity of each ROI in the frame, averaged over the color channels, without storing it."""
+        if frame.shape != self.frame_shape:
+            self._prepare(frame.shape)
+        pixels = np.take(frame.reshape(-1), self.indices)
+        return np.add.reduceat(pixels, self.starts, dtype='float64') / self.sizes
+
+    def sample(self, frame):
+        """Stores the mean intensity of each ROI in the frame, averaged over the color channels."""
+        if not self.boxes:
+            return
+        if self.count == len(self.values):
+            self.values = np.concatenate([self.values, np.full_like(self.values, np.nan)])
+
+        self.values[self.count] = self.measure(frame)
+        self.count += 1
+
+    def get_values(self):
+        """Returns a copy of the values of the sampled frames, as an (n_frames, n_rois) array."""
+        return self.values[:self.count].copy()
+
+    def get_result(self):
+        """Returns the ROIs and their values as a dict, to be saved with np.savez."""
+        return {'names': np.array(self.names), 'rois': np.array(self.boxes).reshape(-1, 4),
+                'values': self.get_values()}
+
+    def reset(self):
+        self.values.fill(np.nan)
+        self.count = 0
@@ -0,0 +1,273 @@
+"""
+Single-file bundle of the metadata of a recording session
+
+Instead of globbing the TIMESTAMPS_*.npy/.csv, ROI_*.npz, calibration.toml and
+detections.pickle files of every camera, a session is kept in one .zip file next to the
+videos (SESSION_<name>.zip), readable with SessionReader:
+
+    cam0/.attrs/000000.json          camera settings (name, exposure, gain, fps, video file...)
+    cam0/.records/000000.json        one record per video file of the camera, with its frame range
+    cam0/timestamps/<start>_<stop>.npy   chunked, compressed datasets, appended as the videos are saved
+    cam0/frame_nums/...
+    cam0/dropped/...                 True for the frames recorded after a drop
+    cam0/rois/values/...
+    .attrs/000000.json               session settings
+    .files/calibration.toml/000000   embedded files, the last version is read
+
+Every write goes to a new part file next to the bundle (SESSION_<name>.zip.part000001...),
+written under a temporary name and renamed once complete, so a crash while writing loses at
+most that write and never the entries saved before it. SessionReader reads the bundle and
+its parts together, and merge() folds the parts into the bundle file at the end of a
+session, again through a temporary file. Attributes are merged in the order they were written. The rows of a dataset are split in chunks of chunk_rows, and read()
+only decompresses the chunks of the requested rows.
+"""
+import glob
+import io
+import json
+import os
+import re
+import threading
+import zipfile
+
+import numpy as np
+
+CHUNK_PATTERN = re.compile(r'^(.*)/(\d{12})_(\d{12})\.npy$')
+PART_DIGITS = 6
+
+
+def get_bundle_file(video_file, cam_name_no_space):
+    """Returns the bundle of the session of a video, SESSION_<video name without the camera name>.zip next to it."""
+    directory, name = os.path.split(video_file)
+    name = os.path.splitext(name)[0]
+    if name.startswith(cam_name_no_space + '_'):
+        name = name[len(cam_name_no_space) + 1:]
+    return os.path.join(directory, 'SESSION_' + name + '.zip')
+
+
+def get_part_files(bundle_file):
+    """Returns the part files of a bundle that are not merged into it yet, in the order they were written."""
+    return sorted(glob.glob(glob.escape(bundle_file) + '.part' + '[0-9]' * PART_DIGITS))
+
+
+def remove_bundle(bundle_file):
+    """Removes a bundle with its part files and any temporary file left by a crash."""
+    for fname in [bundle_file] + get_part_files(bundle_file) + glob.glob(glob.escape(bundle_file) + '*.tmp'):
+        if os.path.isfile(fname):
+            os.remove(fname)
+
+
+def _write_zip(fname, entries):
+    # complete under a temporary name first, an interrupted write never replaces a readable file
+    tmp_file = fname + '.tmp'
+    with zipfile.ZipFile(tmp_file, 'w', compression=zipfile.ZIP_DEFLATED, compresslevel=1) as zf:
+        for name, data in entries:
+            zf.writestr(name, data)
+    os.replace(tmp_file, fname)
+
+
+def get_dropped_frames(frame_nums=None, times=None, fps=None):
+    """
+    Returns a mask of the recorded frames that come after dropped frames, from the gaps in the driver frame numbers,
+    or without them from the frame intervals longer than 1.5 frame.
+    """
+    if frame_nums is not None and len(frame_nums) > 0 and np.all(np.asarray(frame_nums) >= 0):
+        gaps = np.diff(np.asarray(frame_nums)) > 1
+    elif times is not None and fps:
+        gaps = np.diff(np.asarray(times)) > 1.5 / fps
+    else:
+        return np.zeros(0 if times is None else len(times), dtype='bool')
+    return np.concatenate([[False], gaps])
+
+
+class SessionBundle:
+    def __init__(self, bundle_file, chunk_rows=1 << 16):
+        """
+        Params
+        ------
+        bundle_file = str; .zip file, created or appended to with part files
+        chunk_rows = int; rows per chunk of the datasets
+        """
+        self.bundle_file = bundle_file
+        self.chunk_rows = chunk_rows
+        self.lock = threading.Lock()
+        self.sequences = {}
+        self.lengths = {}
+        self.next_part = 0
+        part_files = get_part_files(bundle_file)
+        if part_files:
+            self.next_part = int(part_files[-1][-PART_DIGITS:]) + 1
+        for fname in ([bundle_file] if os.path.isfile(bundle_file) else []) + part_files:
+            with zipfile.ZipFile(fname) as zf:
+                for name in zf.namelist():
+                    self._index(name)
+
+    def _index(self, name):
+        match = CHUNK_PATTERN.match(name)
+        if match:
+            dataset, _, stop = match.groups()
+            self.lengths[dataset] = max(self.lengths.get(dataset, 0), int(stop))
+        else:
+            prefix, sequence = os.path.splitext(name)[0].rsplit('/', 1)
+            if sequence.isdigit():
+                self.sequences[prefix] = max(self.sequences.get(prefix, 0), int(sequence) + 1)
+
+    def _write_entries(self, entries):
+        # a new part per write, appending to a zip in place loses its central directory if interrupted
+        _write_zip(f'{self.bundle_file}.part{self.next_part:0{PART_DIGITS}d}', entries)
+        self.next_part += 1
+        for name, _ in entries:
+            self._index(name)
+
+    def _write_next(self, prefix, data, extension=''):
+        # a new entry per version, zip entries cannot be replaced
+        with self.lock:
+            self._write_entries([(f'{prefix}/{self.sequences.get(prefix, 0):06d}{extension}', data)])
+
+    def _write_json(self, prefix, value):
+        self._write_next(prefix, json.dumps(value), '.json')
+
+    def set_attrs(self, group='', **attrs):
+        """Sets attributes of a group, e.g. set_attrs('cam0', exposure=0.01). Values must be JSON serializable."""
+        self._write_json(f'{group}/.attrs' if group else '.attrs', attrs)
+
+    def add_record(self, group, **record):
+        """Adds a record to the list of records of a group, e.g. one per video file of a camera."""
+        self._write_json(f'{group}/.records', record)
+
+    def append(self, dataset, array):
+        """Appends rows to a dataset, e.g. append('cam0/timestamps', frame_times). Returns the first appended row."""
+        array = np.asarray(array)
+        with self.lock:
+            start = self.lengths.get(dataset, 0)
+            entries = []
+            for offset in range(0, len(array), self.chunk_rows):
+                chunk = array[offset:offset + self.chunk_rows]
+                buffer = io.BytesIO()
+                np.lib.format.write_array(buffer, np.ascontiguousarray(chunk))
+                entries.append((f'{dataset}/{start + offset:012d}_{start + offset + len(chunk):012d}.npy',
+                                buffer.getvalue()))
+            self._write_entries(entries)
+        return start
+
+    def add_file(self, path, name=None):
+        """Embeds a file, e.g. calibration.toml, under its base name. Returns False if it does not exist."""
+        if not os.path.isfile(path):
+            return False
+        with open(path, 'rb') as f:
+            self._write_next(f'.files/{name or os.path.basename(path)}', f.read())
+        return True
+
+    def merge(self):
+        """
+        Folds the part files into the bundle file, e.g. once the session is saved. The parts are removed only after
+        the merged bundle replaced the old one, a crash in between leaves
+        entries in both, which the reader reads once.
+        Returns the bundle file.
+        """
+        with self.lock:
+            part_files = get_part_files(self.bundle_file)
+            if not part_files:
+                return self.bundle_file
+            with SessionReader(self.bundle_file) as reader:
+                entries = [(name, reader.read_entry(name)) for name in reader.names]
+            _write_zip(self.bundle_file, entries)
+            for fname in part_files:
+                os.remove(fname)
+        return self.bundle_file
+
+
+class SessionReader:
+    def __init__(self, bundle_file):
+        self.bundle_file = bundle_file
+        fnames = ([bundle_file] if os.path.isfile(bundle_file) else []) + get_part_files(bundle_file)
+        if not fnames:
+            raise FileNotFoundError(f'No bundle {bundle_file}')
+        self.zfs = [zipfile.ZipFile(fname) for fname in fnames]
+        # an entry left both in the bundle and in a part by an interrupted merge is the same data
+        self.entries = {}
+        for zf in self.zfs:
+            for name in zf.namelist():
+                self.entries[name] = zf
+        self.names = list(self.entries)
+        self.chunks = {}
+        for name in self.names:
+            match = CHUNK_PATTERN.match(name)
+            if match:
+                dataset, start, stop = match.groups()
+                self.chunks.setdefault(dataset, []).append((int(start), int(stop), name))
+        for chunks in self.chunks.values():
+            chunks.sort()
+
+    def close(self):
+        for zf in self.zfs:
+            zf.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def read_entry(self, name):
+        """Returns the raw content of an entry of the bundle or of its parts."""
+        return self.entries[name].read(name)
+
+    def _read_json(self, prefix):
+        names = sorted(name for name in self.names if name.startswith(prefix + '/') and name.endswith('.json'))
+        return [json.loads(self.read_entry(name)) for name in names]
+
+    def get_attrs(self, group=''):
+        """Returns the attributes of a group, merged in the order they were set."""
+        attrs = {}
+        for entry in self._read_json(f'{group}/.attrs' if group else '.attrs'):
+            attrs.update(entry)
+        return attrs
+
+    def get_records(self, group):
+        return self._read_json(f'{group}/.records')
+
+    def get_cameras(self):
+        """Returns the groups of the cameras, e.g. ['cam0', 'cam1']."""
+        groups = {name.split('/', 1)[0] for name in self.names if re.match(r'^cam\d+/', name)}
+        return sorted(groups, key=lambda group: int(group[3:]))
+
+    def get_datasets(self):
+        return sorted(self.chunks)
+
+    def get_length(self, dataset):
+        chunks = self.chunks.get(dataset, [])
+        return chunks[-1][1] if chunks else 0
+
+    def read(self, dataset, start=0, stop=None):
+        """Returns the rows [start, stop) of a dataset, only reading the chunks they are in."""
+        if dataset not in self.chunks:
+            raise KeyError(f'No dataset {dataset} in {self.bundle_file}')
+        stop = self.get_length(dataset) if stop is None else stop
+        parts = []
+        for chunk_start, chunk_stop, name in self.chunks[dataset]:
+            if chunk_stop <= start or chunk_start >= stop:
+                continue
+            with self.entries[name].open(name) as f:
+                chunk = np.lib.format.read_array(f)
+            parts.append(chunk[max(start, chunk_start) - chunk_start:min(stop, chunk_stop) - chunk_start])
+        if not parts:
+            return np.zeros(0)
+        return np.concatenate(parts)
+
+    def load_camera(self, group):
+        """Returns the attributes, the video records and every dataset of a camera, e.g. load_camera('cam0')."""
+        camera = {'attrs': self.get_attrs(group), 'records': self.get_records(group)}
+        for dataset in self.get_datasets():
+            if dataset.startswith(group + '/'):
+                camera[dataset[len(group) + 1:]] = self.read(dataset)
+        return camera
+
+    def get_file(self, name):
+        """Returns the content of the last version of an embedded file as bytes."""
+        versions = sorted(entry for entry in self.names if entry.startswith(f'.files/{name}/'))
+        if not versions:
+            raise KeyError(f'No file {name} in {self.bundle_file}')
+        return self.read_entry(versions[-1])
+
+    def get_files(self):
+        return sorted({name[len('.files/'):].rsplit('/', 1)[0] for name in self.names if name.startswith('.files/')})
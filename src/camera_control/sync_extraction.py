@@ -0,0 +1,280 @@
+"""
+Offline extraction of sync LED traces from recorded videos
+
+For sessions recorded without live ROI tracking, the intensity of a few regions of the frame
+(sync LEDs, reward ports) is read back from the .avi files written by set_up_vid and
+set_up_video_trigger, the on/off edges are detected and aligned to the TIMESTAMPS_*.npy
+file of each video.
+
+- The videos are streamed frame by frame and only the ROI means are kept, so the memory
+  does not grow with the frame size, only with the number of frames.
+- With step > 1, only every step-th frame is converted and sampled (the others are only
+  grabbed), then the frames between two samples on either side of an edge are read again,
+  so the edges are exact as long as the LED stays on or off for at least step frames.
+- The videos of all cameras are processed in parallel, one process per video.
+
+    python -m src.camera_control.sync_extraction <videos> --roi sync_led=x,y,width,height --step 4
+"""
+import argparse
+import multiprocessing as mp
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import cv2
+import numpy as np
+
+from src.camera_control.roi_tracker import ROITracker
+
+
+def get_timestamps_file(video_file):
+    """Returns the TIMESTAMPS_*.npy file saved with a video, or None if there is none."""
+    directory, name = os.path.split(video_file)
+    ts_file = os.path.join(directory, 'TIMESTAMPS_' + os.path.splitext(name)[0] + '.npy')
+    return ts_file if os.path.isfile(ts_file) else None
+
+
+def get_sync_file(video_file):
+    """Returns the file the sync of a video is saved to, SYNC_<video name>.npz next to the video."""
+    directory, name = os.path.split(video_file)
+    return os.path.join(directory, 'SYNC_' + os.path.splitext(name)[0] + '.npz')
+
+
+def read_roi_values(cap, tracker, values, step=1, n_frames=0):
+    """
+    Reads the mean intensity of the ROIs in every step-th frame of an opened video, and in its last frame.
+    The other frames are only grabbed, not converted. Returns the values, grown if the video has more
+    frames than values, with NaN for the frames that were not sampled, and the number of frames read.
+    """
+    frame_num = 0
+    while True:
+        if frame_num % step == 0 or frame_num == n_frames - 1:
+            ret, frame = cap.read()
+            if not ret:
+                break
+            if frame_num >= len(values):
+                values = np.concatenate([values, np.full_like(values, np.nan)])
+            values[frame_num] = tracker.measure(frame)
+        elif not cap.grab():
+            break
+        frame_num += 1
+    return values[:frame_num], frame_num
+
+
+def read_frame_ranges(cap, tracker, values, ranges):
+    """Reads the mean intensity of the ROIs in all the frames of the [start, end) ranges."""
+    position = None
+    for start, end in ranges:
+        if position != start:
+            cap.set(cv2.CAP_PROP_POS_FRAMES, start)
+        for frame_num in range(start, end):
+            ret, frame = cap.read()
+            if not ret:
+                return
+            values[frame_num] = tracker.measure(frame)
+        position = end
+
+
+def get_thresholds(values, min_contrast=10):
+    """
+    Returns the on/off threshold of each ROI, halfway between its low (1st percentile) and high
+    (99th percentile) intensity. ROIs with less than min_contrast between both have a NaN threshold.
+    """
+    thresholds = np.full(values.shape[1], np.nan)
+    for j in range(values.shape[1]):
+        column = values[:, j]
+        column = column[~np.isnan(column)]
+        if len(column) == 0:
+            continue
+        low, high = np.percentile(column, [1, 99])
+        if high - low >= min_contrast:
+            thresholds[j] = (low + high) / 2
+    return thresholds
+
+
+def get_state_changes(values, thresholds):
+    """Returns the sampled frames and the rows of the sampled frames at which at least one ROI turns on or off."""
+    sampled = np.flatnonzero(~np.isnan(values).any(axis=1))
+    states = values[sampled] > thresholds
+    changed = np.flatnonzero((states[1:] != states[:-1]).any(axis=1)) + 1
+    return sampled, changed
+
+
+def detect_edges(values, thresholds):
+    """
+    Returns the first frame of every on (rising) and off (falling) period of each ROI, as lists of arrays.
+    Frames that were not sampled (NaN) are left out, so an edge is only exact when the frame before it was sampled.
+    """
+    sampled = np.flatnonzero(~np.isnan(values).any(axis=1))
+    rising = []
+    falling = []
+    for j in range(values.shape[1]):
+        if np.isnan(thresholds[j]):
+            rising.append(np.array([], dtype='int64'))
+            falling.append(np.array([], dtype='int64'))
+            continue
+        state = values[sampled, j] > thresholds[j]
+        changes = np.flatnonzero(state[1:] != state[:-1]) + 1
+        rising.append(sampled[changes[state[changes]]])
+        falling.append(sampled[changes[~state[changes]]])
+    return rising, falling
+
+
+def align_frames(frames, timestamps):
+    """Returns the timestamps of the frames, NaN for the frames beyond the timestamps."""
+    times = np.full(len(frames), np.nan)
+    if timestamps is not None:
+        in_range = frames < len(timestamps)
+        times[in_range] = timestamps[frames[in_range]]
+    return times
+
+
+def extract_sync(video_file, rois, step=1, min_contrast=10, ts_file=None):
+    """
+    Extracts the ROI intensity trace of a video, detects the on/off edges of each ROI and aligns them to the timestamps.
+
+    Params
+    ------
+    video_file = str; .avi file
+    rois = dict of {name: [x, y, width, height]} or list of [x, y, width, height]; ROIs in frame coordinates
+    step = int; sample every step-th frame, then read all the frames around the edges
+    min_contrast = float; ROIs whose on and off intensities differ by less are considered to have no edge
+    ts_file = str; timestamps of the video, by default the TIMESTAMPS_*.npy file next to it
+
+    Returns
+    -------
+    dict with the names and boxes of the ROIs, the values (n_frames, n_rois, NaN for the frames that were not read),
+    the thresholds, and for each ROI the rising and falling frames and their times
+    """
+    start_time = time.perf_counter()
+    tracker = ROITracker(rois, capacity=0)
+    if not tracker.boxes:
+        raise ValueError('No ROI to extract')
+
+    cap = cv2.VideoCapture(video_file)
+    if not cap.isOpened():
+        raise IOError(f'Could not open {video_file}')
+    fps = cap.get(cv2.CAP_PROP_FPS)
+    expected_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+    values = np.full((max(expected_frames, 1), len(tracker.boxes)), np.nan, dtype='float32')
+
+    try:
+        values, n_frames = read_roi_values(cap, tracker, values, step=step, n_frames=expected_frames)
+        thresholds = get_thresholds(values, min_contrast=min_contrast)
+
+        if step > 1:
+            # read the frames between the two samples on either side of each edge
+            sampled, changed = get_state_changes(values, np.nan_to_num(thresholds, nan=np.inf))
+            ranges = []
+            for start, end in zip(sampled[changed - 1] + 1, sampled[changed]):
+                if end <= start:
+                    continue
+                if ranges and start <= ranges[-1][1]:
+                    ranges[-1] = (ranges[-1][0], end)
+                else:
+                    ranges.append((start, end))
+            read_frame_ranges(cap, tracker, values, ranges)
+    finally:
+        cap.release()
+
+    if ts_file is None:
+        ts_file = get_timestamps_file(video_file)
+    timestamps = np.load(ts_file) if ts_file is not None else None
+    if timestamps is None:
+        print(f'No timestamps found for {video_file}, the edges are not aligned')
+    elif len(timestamps) != n_frames:
+        print(f'{video_file} has {n_frames} frames but {len(timestamps)} timestamps')
+
+    rising, falling = detect_edges(values, thresholds)
+    edges = {}
+    for name, rising_frames, falling_frames in zip(tracker.names, rising, falling):
+        edges[name] = {'rising': rising_frames, 'falling': falling_frames,
+                       'rising_times': align_frames(rising_frames, timestamps),
+                       'falling_times': align_frames(falling_frames, timestamps)}
+
+    elapsed = time.perf_counter() - start_time
+    decoded = int(np.count_nonzero(~np.isnan(values[:, 0])))
+    speed = n_frames / fps / elapsed if fps > 0 and elapsed > 0 else np.nan
+    print(f'{os.path.basename(video_file)}: {n_frames} frames ({decoded} sampled) in {elapsed:.1f} s, '
+          f'{speed:.1f}x real time')
+
+    return {'video_file': video_file, 'ts_file': ts_file, 'fps': fps, 'n_frames': n_frames,
+            'names': list(tracker.names), 'rois': np.array(tracker.boxes).reshape(-1, 4),
+            'values': values, 'thresholds': thresholds, 'edges': edges}
+
+
+def save_sync(result, sync_file=None):
+    """Saves the result of extract_sync as an .npz file, with the edges of each ROI as <name>_rising, <name>_falling,
+    <name>_rising_times and <name>_falling_times. Returns the saved file."""
+    if sync_file is None:
+        sync_file = get_sync_file(result['video_file'])
+    arrays = {'names': np.array(result['names']), 'rois': result['rois'], 'values': result['values'],
+              'thresholds': result['thresholds'], 'fps': result['fps'], 'n_frames': result['n_frames']}
+    for name, edges in result['edges'].items():
+        for key, frames in edges.items():
+            arrays[f'{name}_{key}'] = frames
+    np.savez(sync_file, **arrays)
+    return sync_file
+
+
+def extract_sync_videos(video_files, rois, step=1, min_contrast=10, workers=None, save=True):
+    """
+    Runs extract_sync on the videos of all cameras in parallel, one process per video.
+
+    Params
+    ------
+    video_files = list of str
+    rois = ROIs of every video, or a dict of {video_file: rois} for ROIs that differ between cameras
+    workers = int; number of processes, by default one per video up to the number of CPUs, 0 to run in this process
+    save = bool; save the result of each video with save_sync
+
+    Returns
+    -------
+    list of the results of extract_sync, in the order of video_files
+    """
+    if isinstance(rois, dict) and set(rois) >= set(video_files):
+        video_rois = [rois[video_file] for video_file in video_files]
+    else:
+        video_rois = [rois] * len(video_files)
+    args = [(video_file, video_roi, step, min_contrast) for video_file, video_roi in zip(video_files, video_rois)]
+
+    if workers is None:
+        workers = min(len(video_files), os.cpu_count() or 1)
+    if workers == 0:
+        results = [extract_sync(*arg) for arg in args]
+    else:
+        # spawned, like the acquisition processes, so the workers do not inherit the threads of the GUI
+        with ProcessPoolExecutor(max_workers=workers, mp_context=mp.get_context('spawn')) as executor:
+            futures = [executor.submit(extract_sync, *arg) for arg in args]
+            results = [future.result() for future in futures]
+
+    if save:
+        for result in results:
+            result['sync_file'] = save_sync(result)
+    return results
+
+
+def parse_roi_arg(text):
+    """Parses name=x,y,width,height"""
+    name, _, box = text.rpartition('=')
+    box = [int(v) for v in box.split(',')]
+    if len(box) != 4:
+        raise argparse.ArgumentTypeError(f'ROI should be name=x,y,width,height, got {text}')
+    return name or 'sync_led', box
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Extract the sync LED edges of recorded videos')
+    parser.add_argument('videos', nargs='+', help='.avi files, one per camera')
+    parser.add_argument('-r', '--roi', type=parse_roi_arg, action='append', required=True,
+                        help='ROI as name=x,y,width,height, can be repeated')
+    parser.add_argument('-s', '--step', type=int, default=1, help='sample every step-th frame')
+    parser.add_argument('-c', '--min-contrast', type=float, default=10)
+    parser.add_argument('-w', '--workers', type=int, default=None)
+    args = parser.parse_args()
+
+    for result in extract_sync_videos(args.videos, dict(args.roi), step=args.step, min_contrast=args.min_contrast,
+                                      workers=args.workers):
+        for name, edges in result['edges'].items():
+            print(f"{result['video_file']} {name}: {len(edges['rising'])} on, {len(edges['falling'])} off")
+        print(f"Saved {result['sync_file']}")
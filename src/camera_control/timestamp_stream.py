@@ -0,0 +1,137 @@
+"""
+Array-backed frame timestamps, streamed to an append-only journal while recording
+
+The frame times and driver frame numbers are stored in a preallocated structured array
+(16 bytes per frame) instead of Python lists of floats. Every chunk_size frames, or at
+least every flush_interval seconds, the new records are appended to a journal file next
+to the video (<video name>_timestamps.bin), so a crash of the GUI loses at most one chunk.
+
+The journal is raw records of JOURNAL_DTYPE without a header, so another process can tail
+it while recording with read_journal(journal_file, start), and the TIMESTAMPS_*.npy/.csv
+files can be rebuilt from it with recover_journal.
+"""
+import os
+
+import numpy as np
+
+JOURNAL_DTYPE = np.dtype([('time', '<f8'), ('frame_num', '<i8')])
+
+
+def get_journal_file(video_file):
+    return os.path.splitext(video_file)[0] + '_timestamps.bin'
+
+
+def remove_journal(video_file):
+    """Removes the journal of a video once its timestamps are saved or the video is deleted."""
+    journal_file = get_journal_file(video_file)
+    if os.path.isfile(journal_file):
+        os.remove(journal_file)
+
+
+def save_timestamps(times, ts_file, csv_file=None):
+    """Saves the frame times as .npy and optionally as .csv, in the format of np.savetxt, without its per-row overhead."""
+    times = np.asarray(times, dtype='float64')
+    np.save(str(ts_file), times)
+    if csv_file is not None:
+        with open(str(csv_file), 'w') as f:
+            if len(times):
+                f.write('\n'.join(map('{:.18e}'.format, times.tolist())) + '\n')
+
+
+def read_journal(journal_file, start=0):
+    """
+    Returns the complete records of a journal from record start on, as an array of JOURNAL_DTYPE.
+    A record being written by the recording process is left out, so the journal can be read while it grows.
+    """
+    with open(journal_file, 'rb') as f:
+        f.seek(start * JOURNAL_DTYPE.itemsize)
+        data = f.read()
+    count = len(data) // JOURNAL_DTYPE.itemsize
+    return np.frombuffer(data, dtype=JOURNAL_DTYPE, count=count)
+
+
+def recover_journal(journal_file, ts_file, csv_file=None):
+    """Saves the frame times of a journal left by an interrupted recording. Returns the number of frames."""
+    records = read_journal(journal_file)
+    save_timestamps(records['time'], ts_file, csv_file)
+    return len(records)
+
+
+class TimestampStream:
+    def __init__(self, journal_file=None, capacity=1 << 16, chunk_size=1024, flush_interval=1.0):
+        """
+        Params
+        ------
+        journal_file = str; file the records are appended to, None to keep them in memory only
+        capacity = int; initial number of records, doubled when it is full
+        chunk_size = int; number of records appended to the journal at once
+        flush_interval = float; seconds of frame time after which the records are appended even if the chunk is not full
+        """
+        self.records = np.zeros(capacity, dtype=JOURNAL_DTYPE)
+        self.count = 0
+        self.flushed = 0
+        self.chunk_size = chunk_size
+        self.flush_interval = flush_interval
+        self.last_flush_time = None
+        self.journal_file = journal_file
+        self.file = open(journal_file, 'wb') if journal_file is not None else None
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, index):
+        return self.records['time'][:self.count][index]
+
+    def append(self, time_data, frame_num=-1):
+        if self.count == len(self.records):
+            self.records = np.concatenate([self.records, np.zeros_like(self.records)])
+        self.records[self.count] = (time_data, frame_num)
+        self.count += 1
+
+        if self.file is not None:
+            if self.last_flush_time is None:
+                self.last_flush_time = time_data
+            if self.count - self.flushed >= self.chunk_size or time_data - self.last_flush_time >= self.flush_interval:
+                self.flush()
+
+    def extend(self, times, frame_nums=None):
+        for i, time_data in enumerate(times):
+            self.append(time_data, -1 if frame_nums is None else frame_nums[i])
+
+    def flush(self):
+        """Appends the records added since the previous flush to the journal."""
+        if self.file is None or self.flushed == self.count:
+            return
+        count = self.count
+        self.file.write(self.records[self.flushed:count].tobytes())
+        self.file.flush()
+        self.flushed = count
+        self.last_flush_time = self.records['time'][count - 1]
+
+    def get_times(self):
+        return self.records['time'][:self.count].copy()
+
+    def get_frame_nums(self):
+        return self.records['frame_num'][:self.count].copy()
+
+    def reset(self):
+        """Drops the records, and empties the journal."""
+        self.count = 0
+        self.flushed = 0
+        self.last_flush_time = None
+        if self.file is not None:
+            self.file.seek(0)
+            self.file.truncate()
+
+    def close(self):
+        """Appends the remaining records to the journal and closes it. The records stay available."""
+        if self.file is not None:
+            self.flush()
+            self.file.close()
+            self.file = None
+
+    def remove_journal(self):
+        """Closes and removes the journal, once the timestamps are saved."""
+        self.close()
+        if self.journal_file is not None and os.path.isfile(self.journal_file):
+            os.remove(self.journal_file)
@@ -0,0 +1,244 @@
+"""
+Background transcoding of the recorded videos
+
+The .avi files are compressed to .mp4 (libx264 CRF 17 by default) by a fixed number of
+ffmpeg processes, one job at a time per worker, instead of one ffmpeg per camera at once.
+
+- The jobs are kept in a JSON file, so jobs interrupted by closing the GUI are started
+  again the next time the queue is started.
+- ffmpeg runs below normal priority, and at idle priority while acquisition is active
+  (set_acquisition_active), so a transcode never competes with the next recording.
+- The progress of each job is parsed from the -progress output of ffmpeg.
+- After a job, the frame count of the .mp4 is checked against the .avi, and the .avi is
+  deleted if delete_source is set and both match.
+"""
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+
+import cv2
+
+from src.camera_control.async_log import get_logger
+
+transcode_log = get_logger('transcode')
+
+PENDING = 'pending'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+
+if sys.platform == 'win32':
+    NORMAL_PRIORITY = subprocess.BELOW_NORMAL_PRIORITY_CLASS
+    LOW_PRIORITY = subprocess.IDLE_PRIORITY_CLASS
+else:
+    NORMAL_PRIORITY = 10
+    LOW_PRIORITY = 19
+
+
+def set_priority(process, low):
+    """Sets the OS priority of a running process, idle if low else below normal."""
+    priority = LOW_PRIORITY if low else NORMAL_PRIORITY
+    try:
+        if sys.platform == 'win32':
+            import ctypes
+            ctypes.windll.kernel32.SetPriorityClass(int(process._handle), priority)
+        else:
+            os.setpriority(os.PRIO_PROCESS, process.pid, priority)
+    except (OSError, AttributeError):
+        # raising the priority back is not allowed without privileges on POSIX
+        pass
+
+
+def get_frame_count(video_file):
+    """Returns the number of frames and the duration in seconds of a video, from its header."""
+    cap = cv2.VideoCapture(video_file)
+    n_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+    fps = cap.get(cv2.CAP_PROP_FPS)
+    cap.release()
+    return n_frames, n_frames / fps if fps > 0 else 0
+
+
+class TranscodeQueue:
+    def __init__(self, queue_file, workers=1, output_options='-c:v libx264 -crf 17', delete_source=False,
+                 ffmpeg='ffmpeg'):
+        """
+        Params
+        ------
+        queue_file = str; JSON file the jobs are kept in
+        workers = int; number of videos transcoded at the same time
+        output_options = str; ffmpeg options of the output file
+        delete_source = bool; delete the .avi once the .mp4 is verified
+        ffmpeg = str; ffmpeg executable
+        """
+        self.queue_file = queue_file
+        self.workers = workers
+        self.output_options = output_options
+        self.delete_source = delete_source
+        self.ffmpeg = ffmpeg
+        self.jobs = []
+        self.processes = {}
+        self.acquisition_active = False
+        self.condition = threading.Condition()
+        self.stop_event = threading.Event()
+        self.threads = []
+
+    def load(self):
+        """Loads the jobs of the queue file. Jobs that were running when the queue was stopped are pending again."""
+        if not os.path.isfile(self.queue_file):
+            return
+        try:
+            with open(self.queue_file) as f:
+                self.jobs = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f'Could not read the transcode queue {self.queue_file}: {e}')
+            self.jobs = []
+        for job in self.jobs:
+            if job['status'] == RUNNING:
+                job['status'] = PENDING
+                job['progress'] = 0
+
+    def save(self):
+        # written to a temporary file first, so the queue file is never left half written
+        directory = os.path.dirname(self.queue_file)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+        temp_file = self.queue_file + '.tmp'
+        with open(temp_file, 'w') as f:
+            json.dump(self.jobs, f, indent=1)
+        os.replace(temp_file, self.queue_file)
+
+    def start(self):
+        """Resumes the jobs of the queue file and starts the workers."""
+        with self.condition:
+            self.load()
+            self.save()
+            pending = sum(job['status'] == PENDING for job in self.jobs)
+        if pending:
+            print(f'Resuming {pending} transcode jobs')
+        self.stop_event.clear()
+        self.threads = [threading.Thread(target=self._run, name=f'Transcode worker {i}', daemon=True)
+                        for i in range(self.workers)]
+        for thread in self.threads:
+            thread.start()
+
+    def stop(self):
+        """Stops the workers. Running jobs are interrupted and resumed the next time the queue is started."""
+        self.stop_event.set()
+        with self.condition:
+            for process in self.processes.values():
+                process.terminate()
+            self.condition.notify_all()
+        for thread in self.threads:
+            thread.join()
+        self.threads = []
+
+    def add(self, source, target=None):
+        """Adds a video to the queue, transcoded to target, by default the same file name with .mp4. Returns the job."""
+        if target is None:
+            target = os.path.splitext(source)[0] + '.mp4'
+        with self.condition:
+            for job in self.jobs:
+                if job['source'] == source and job['status'] in (PENDING, RUNNING):
+                    return job
+            job = {'source': source, 'target': target, 'status': PENDING, 'progress': 0, 'error': None,
+                   'verified': False, 'added': time.time(), 'finished': None}
+            self.jobs.append(job)
+            self.save()
+            self.condition.notify()
+        return job
+
+    def set_acquisition_active(self, active):
+        """Lowers the priority of the running and future ffmpeg processes to idle while acquisition is active."""
+        with self.condition:
+            self.acquisition_active = active
+            for process in self.processes.values():
+                set_priority(process, active)
+
+    def get_jobs(self):
+        with self.condition:
+            return [dict(job) for job in self.jobs]
+
+    def get_progress(self):
+        """Returns a line per unfinished or failed job with its progress."""
+        return [f"{os.path.basename(job['source'])}: {job['status']} {job['progress'] * 100:.0f}%"
+                + (f" ({job['error']})" if job['error'] else '')
+                for job in self.get_jobs() if job['status'] != DONE]
+
+    def _next_job(self):
+        with self.condition:
+            while not self.stop_event.is_set():
+                for job in self.jobs:
+                    if job['status'] == PENDING:
+                        job['status'] = RUNNING
+                        self.save()
+                        return job
+                self.condition.wait()
+        return None
+
+    def _run(self):
+        while True:
+            job = self._next_job()
+            if job is None:
+                return
+            status, error, verified = self._transcode(job)
+            with self.condition:
+                if self.stop_event.is_set() and status != DONE:
+                    # interrupted, resumed on the next start
+                    status, error = PENDING, None
+                job.update(status=status, error=error, verified=verified,
+                           finished=time.time() if status == DONE else None)
+                self.save()
+
+    def _transcode(self, job):
+        source, target = job['source'], job['target']
+        if not os.path.isfile(source):
+            return FAILED, 'source not found', False
+        n_frames, duration = get_frame_count(source)
+
+        command = [self.ffmpeg, '-y', '-nostdin', '-loglevel', 'error', '-i', source] + self.output_options.split() \
+            + ['-progress', 'pipe:1', '-nostats', target]
+        kwargs = {'creationflags': NORMAL_PRIORITY} if sys.platform == 'win32' else {}
+        try:
+            process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True, **kwargs)
+        except OSError as e:
+            return FAILED, f'could not run {self.ffmpeg}: {e}', False
+
+        with self.condition:
+            self.processes[id(job)] = process
+            if self.stop_event.is_set():
+                process.terminate()
+            elif sys.platform != 'win32' or self.acquisition_active:
+                set_priority(process, self.acquisition_active)
+        transcode_log.info('Transcoding %s', source)
+
+        errors = []
+        reported = 0
+        for line in process.stdout:
+            key, separator, value = line.strip().partition('=')
+            if key in ('out_time_us', 'out_time_ms'):
+                # both are in microseconds
+                if duration > 0 and value.isdigit():
+                    job['progress'] = min(1.0, int(value) / 1e6 / duration)
+                    if job['progress'] - reported >= 0.25:
+                        reported = job['progress']
+                        transcode_log.info('%s %.0f%%', os.path.basename(source), job['progress'] * 100)
+            elif key and not separator:
+                errors.append(line.strip())
+        return_code = process.wait()
+        with self.condition:
+            self.processes.pop(id(job), None)
+
+        if return_code != 0:
+            return FAILED, ' '.join(errors[-3:]) or f'ffmpeg exited with {return_code}', False
+
+        target_frames, _ = get_frame_count(target)
+        if target_frames != n_frames:
+            return FAILED, f'{target_frames} frames transcoded out of {n_frames}', False
+        job['progress'] = 1.0
+        transcode_log.info('Transcoded %s', target)
+        if self.delete_source:
+            os.remove(source)
+        return DONE, None, True
@@ -4,6 +4,24 @@ import threading
 import traceback
 import os
 
+from src.camera_control.async_log import get_logger
+from src.gui.preview_compositor import PreviewCompositor
+
+# draw_axis runs for every frame of the live preview
+axis_log = get_logger('calibration.axis')
+bus_log = get_logger('gui.frame_bus')
+
+
+def publish_frame(bus, num, frame, generation, **kwargs):
+    """
+    Publishes the frame of a camera thread to a frame bus. A frame the bus cannot take, e.g. after a change of
+    format, is logged and skipped, so the thread keeps its place at the barrier of the other cameras.
+    """
+    try:
+        bus.publish(num, frame, generation, **kwargs)
+    except Exception as e:
+        bus_log.warning('Frame %d of cam %d not published: %s: %s', generation, num, type(e).__name__, e)
+
 
 def detect_raw_board_on_thread(self, num, barrier):
     """
@@ -32,12 +50,14 @@ def detect_raw_board_on_thread(self, num, barrier):
     params.adaptiveThreshConstant = 0
     
     # while cv2.getWindowProperty(window_name, cv2.WND_PROP_VISIBLE) > 0:
+    generation = 0  # index of the synchronized frame set on the frame bus
     while self.detection_window_status:
         try:
             barrier.wait(timeout=15)
         except threading.BrokenBarrierError:
             print(f'Barrier broken for cam {num}. Proceeding...')
             break
+        generation += 1
         frame_current = self.cam[num].get_image()
         if frame_current is not None:
             self.frame_count_test[num] += 1
@@ -54,56 +74,43 @@ def detect_raw_board_on_thread(self, num, barrier):
                 
             if drawn_frame is not None:
                 frame_current = drawn_frame
-            self.frame_queue.put((frame_current, num, self.frame_count_test[num]))
+            if self.undistort_maps is not None:
+                # the axes are drawn on the raw frame, and undistorted with it
+                frame_current = self.undistort_maps.undistort(num, frame_current)
+            publish_frame(self.frame_bus, num, frame_current, generation, frame_count=self.frame_count_test[num])
 
 
 def draw_detection_on_thread(self, num):
-    frame_groups = {}  # Dictionary to store frame groups by thread_id
-    frame_counts = {}  # array to store frame counts for each thread_id
-    from src.aniposelib.boards import merge_rows, extract_points
-
     window_name = f'Detection'
     cv2.namedWindow(window_name, cv2.WINDOW_NORMAL)
     cv2.resizeWindow(window_name, 2160, 660)
     
     # Define the font settings
-    font = cv2.FONT_HERSHEY_SIMPLEX
     font_scale = 1.5
     thickness = 1
     
+    # the frames are downsampled into a mosaic the size of the window, refreshed at most 15 times per second
+    compositor = PreviewCompositor(self.frame_bus.frame_shapes, width=2160, height=660, max_fps=15)
+    
+    generation = -1  # last frame set drawn
     self.detection_window_status = cv2.getWindowProperty(window_name, cv2.WND_PROP_VISIBLE) > 0
     try:
         while self.detection_window_status:
-            # Retrieve frame information from the queue
-            frame, thread_id, frame_count,  = self.frame_queue.get()
-            if thread_id not in frame_groups:
-                frame_groups[thread_id] = []  # Create a new group for the thread_id if it doesn't exist
-                frame_counts[thread_id] = 0
-                
-            # Append frame information to the corresponding group
-            frame_groups[thread_id].append((frame, frame_count))
-            frame_counts[thread_id] += 1
-            
-            # Process the frame group (frames with the same thread_id)
-            # dumping the mix and match rows into detections.pickle to be pickup by calibrate_on_thread
-            try:
-                if all(count >= 2 for count in frame_counts.values()):
-                    frames = []
-                    for num in range(len(self.cam)):
-                        frame_group = frame_groups[num]
-                        frame = frame_group[-1][0]
-                        frames.append(frame)
-                    
-                    frame = cv2.hconcat(frames)
-                    cv2.putText(frame, 'Detection', (30, 50), font, font_scale, (0, 255, 0), thickness)
-                    cv2.imshow(window_name, frame)
-                    cv2.waitKey(1)
-                    
+            compositor.wait_refresh()
+            # Only the latest complete set of frames is drawn, older ones are dropped by the frame bus
+            frame_set = self.frame_bus.wait_latest(generation, timeout=1)
+            if frame_set is not None:
+                try:
+                    with frame_set:
+                        generation = frame_set.generation
+                        compositor.render(frame_set.frames)
+                    compositor.put_text('Detection', (30, 50), (0, 255, 0), font_scale, thickness)
+                    compositor.show(window_name)
                     
-            except Exception as e:
-                traceback.print_exc()
-                print("Exception occurred:", type(e).__name__, "| Exception value:", e,
-                      ''.join(traceback.format_tb(e.__traceback__)))
+                except Exception as e:
+                    traceback.print_exc()
+                    print("Exception occurred:", type(e).__name__, "| Exception value:", e,
+                          ''.join(traceback.format_tb(e.__traceback__)))
             
             self.detection_window_status = cv2.getWindowProperty(window_name, cv2.WND_PROP_VISIBLE) > 0
             
@@ -119,14 +126,14 @@ def draw_axis(frame, aruco_dict, params, camera_matrix=None, dist_coeff=None, ro
         corners, ids, rejected_points = cv2.aruco.detectMarkers(frame, aruco_dict, parameters=params)
         
         if corners is None or ids is None:
-            print('No corner detected')
+            axis_log.debug('No corner detected')
             return None
         if len(corners) != len(ids) or len(corners) == 0:
-            print('Incorrect corner or no corner detected!')
+            axis_log.debug('Incorrect corner or no corner detected!')
             return None
         
         if camera_matrix is None or dist_coeff is None:
-            print('Camera matrix or distortion coefficients not provided!')
+            axis_log.debug('Camera matrix or distortion coefficients not provided!')
             cv2.aruco.drawDetectedMarkers(frame, corners, ids)
             return frame
         
@@ -135,15 +142,15 @@ def draw_axis(frame, aruco_dict, params, camera_matrix=None, dist_coeff=None, ro
                                                                                        dist_coeff, parameters=params)
 
         if len(corners) == 0:
-            print('No corner detected after refinement!')
+            axis_log.debug('No corner detected after refinement!')
             return None
 
         ret, c_corners, c_ids = cv2.aruco.interpolateCornersCharuco(corners, ids,
                                                                     frame, board,
                                                                     cameraMatrix=camera_matrix, distCoeffs=dist_coeff)
-        print(f'Corners:', c_corners)
+        axis_log.debug('Corners: %s', c_corners)
         if c_corners is None or c_ids is None or len(c_corners) < 5:
-            print('No corner detected after interpolation!')
+            axis_log.debug('No corner detected after interpolation!')
             return None
 
         n_corners = c_corners.size // 2
@@ -159,10 +166,10 @@ def draw_axis(frame, aruco_dict, params, camera_matrix=None, dist_coeff=None, ro
                                                                     translation)
 
         if p_rvec is None or p_tvec is None:
-            print('Cant detect rotation!')
+            axis_log.debug('Cant detect rotation!')
             return None
         if np.isnan(p_rvec).any() or np.isnan(p_tvec).any():
-            print('Rotation is not usable')
+            axis_log.debug('Rotation is not usable')
             return None
 
         cv2.drawFrameAxes(image=frame,
@@ -193,6 +200,7 @@ def draw_axis(frame, aruco_dict, params, camera_matrix=None, dist_coeff=None, ro
     
 
 def detect_markers_on_thread(self, num, barrier):
+    generation = 0  # index of the synchronized frame set on the frame bus
     while self.reproject_window_status:
         try:
             barrier.wait(timeout=15)
@@ -200,6 +208,7 @@ def detect_markers_on_thread(self, num, barrier):
             print(f'Barrier broken for cam {num}. Proceeding...')
             break
         
+        generation += 1
         self.frame_count_test[num] += 1
         frame_current = self.cam[num].get_image()
 
@@ -215,103 +224,64 @@ def detect_markers_on_thread(self, num, barrier):
 
             row = self.board_calibration.fill_points_rows([row])
             self.all_rows_test[num].extend(row)
+            
+            # tagged with the frame set so the reprojection only matches detections of the same set
+            if self.live_reprojection is not None:
+                self.live_reprojection.update(num, generation, corners, ids)
 
-        # putting frame into the frame queue along with following information
-        self.frame_queue.put((frame_current, num, self.frame_count_test[num]))  # the id of the capturing camera
-
-        frame_current = self.cam[num].get_image()
+        # publishing the frame into the slot of this camera for the current frame set
+        publish_frame(self.frame_bus, num, frame_current, generation, frame_count=self.frame_count_test[num])
         
         
 def draw_reprojection_on_thread(self, num):
-    frame_groups = {}  # Dictionary to store frame groups by thread_id
-    frame_counts = {}  # array to store frame counts for each thread_id
-    from src.aniposelib.boards import merge_rows, extract_points
-
     window_name = f'Reprojection'
     cv2.namedWindow(window_name, cv2.WINDOW_NORMAL)
     cv2.resizeWindow(window_name, 2160, 660)
     
     # Define the font settings
-    font = cv2.FONT_HERSHEY_SIMPLEX
     font_scale = 1.5
     thickness = 1
     
+    # the frames are downsampled into a mosaic the size of the window, refreshed at most 15 times per second
+    compositor = PreviewCompositor(self.frame_bus.frame_shapes, width=2160, height=660, max_fps=15)
+    
+    generation = -1  # last frame set drawn
     self.reproject_window_status = cv2.getWindowProperty(window_name, cv2.WND_PROP_VISIBLE) > 0
     try:
         while self.reproject_window_status:
-            # Retrieve frame information from the queue
-            frame, thread_id, frame_count,  = self.frame_queue.get()
-            if thread_id not in frame_groups:
-                frame_groups[thread_id] = []  # Create a new group for the thread_id if it doesn't exist
-                frame_counts[thread_id] = 0
-
-            # Append frame information to the corresponding group
-            frame_groups[thread_id].append((frame, frame_count))
-            frame_counts[thread_id] += 1
+            compositor.wait_refresh()
+            # Only the latest complete set of frames is drawn, older ones are dropped by the frame bus
+            frame_set = self.frame_bus.wait_latest(generation, timeout=1)
+            if frame_set is None:
+                self.reproject_window_status = cv2.getWindowProperty(window_name, cv2.WND_PROP_VISIBLE) > 0
+                continue
             
-            # Process the frame group (frames with the same thread_id)
-            # dumping the mix and match rows into detections.pickle to be pickup by calibrate_on_thread
+            generation = frame_set.generation
+            with frame_set:
+                compositor.render(frame_set.frames)
             try:
-                if all(count >= 2 for count in frame_counts.values()):
-                    all_rows = [row[-2:] for row in self.all_rows_test]
-                    for i, (row, cam) in enumerate(zip(all_rows, self.cgroup_test.cameras)):
-                        all_rows[i] = self.board_calibration.estimate_pose_rows(cam, row)
-                        
-                    merged = merge_rows(all_rows)
-                    imgp, extra = extract_points(merged, self.board_calibration, min_cameras=2)
-                    p3ds = self.cgroup_test.triangulate(imgp)
-                   
-                    # Project the 3D points back to 2D
-                    try:
-                        p2ds = self.cgroup_test.project(p3ds)
-                    except Exception as e:
-                        print("Exception occurred:", type(e).__name__, "| Exception value:", e,
-                              ''.join(traceback.format_tb(e.__traceback__)))
-                        print('#########')
-                    
-                    # Draw the reprojection
-                    frames = []
+                # Triangulate and reproject the detections of this frame set with the cached calibration
+                result = self.live_reprojection.compute(generation)
+                if result is None:
+                    # fewer than 2 cameras detected the board, the usual case when it is out of view
+                    compositor.put_text('No board detected', (30, 50), (255, 0, 0))
+                    compositor.show(window_name)
+                else:
+                    # Draw the reprojection on the tiles, at the scale of the preview
                     for num in range(len(self.cam)):
-                        frame_group = frame_groups[num]
-                        frame = frame_group[-1][0]
-                        c_corners = all_rows[num][0]['corners']
-                        ids = all_rows[num][0]['ids']
-                        
-                        n_corners = c_corners.size // 2
-                        reshape_corners = np.reshape(c_corners, (n_corners, 1, 2))
-                        cv2.aruco.drawDetectedCornersCharuco(frame, reshape_corners, ids, cornerColor=(0, 255, 0))
-                   
-                        p_ids = extra['ids']
-                        p_corners = p2ds[num].astype('float32')
-                        np_corners = p_corners.size // 2
-                        reshape_np_corners = np.reshape(p_corners, (np_corners, 1, 2))
-                        frames.append(cv2.aruco.drawDetectedCornersCharuco(frame, reshape_np_corners, p_ids, cornerColor=(0, 0, 255)))
-
-                    frame = cv2.hconcat(frames)
+                        detected = ~np.isnan(result['points'][num, :, 0])
+                        compositor.draw_corners(num, result['points'][num, detected], result['ids'][detected], color=(0, 255, 0))
+                        compositor.draw_corners(num, result['p2ds'][num], result['ids'], color=(0, 0, 255))
+                        compositor.put_tile_text(num, f'Error: {result["camera_errors"][num]:.2f} px', (10, 130), (0, 0, 255))
                     
                     # Add the text to the frame
-                    cv2.putText(frame, 'Detection', (30, 50), font, font_scale, (0, 255, 0), thickness)
-                    cv2.putText(frame, 'Reprojection', (30, 100), font, font_scale, (0, 0, 255), thickness)
-
-                    cv2.imshow(window_name, frame)
-                    cv2.waitKey(1)
-                    
-                    # Clear the processed frames from the group
-                    frame_groups = {}
-                    frame_count = {}
+                    compositor.put_text('Detection', (30, 50), (0, 255, 0), font_scale, thickness)
+                    compositor.put_text('Reprojection', (30, 100), (0, 0, 255), font_scale, thickness)
+                    compositor.show(window_name)
+                
             except Exception as e:
                 print("Exception occurred:", type(e).__name__, "| Exception value:", e,
                       ''.join(traceback.format_tb(e.__traceback__)))
-                frames = []
-                for num in range(len(self.cam)):
-                    frame_group = frame_groups[num]
-                    frame = frame_group[-1][0]
-                    frames.append(frame)
-                
-                frame = cv2.hconcat(frames)
-                cv2.putText(frame, 'No board detected', (30, 50), cv2.FONT_HERSHEY_SIMPLEX, 1.5, (255, 0, 0), 1)
-                cv2.imshow(window_name, frame)
-                cv2.waitKey(1)
                 
             self.reproject_window_status = cv2.getWindowProperty(window_name, cv2.WND_PROP_VISIBLE) > 0
         
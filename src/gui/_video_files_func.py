@@ -1,10 +1,11 @@
 import os
 from tkinter import Entry, Label, Button, Tk
 import numpy as np
-import threading
 import cv2
-import ffmpy
-from matplotlib import pyplot as plt
+
+from src.camera_control.roi_tracker import ROITracker
+from src.camera_control.timestamp_stream import TimestampStream, get_journal_file, save_timestamps
+from src.camera_control.session_bundle import SessionBundle, get_bundle_file, remove_bundle
 
 
 def create_video_files(self, overwrite=False):
@@ -51,11 +52,13 @@ def create_video_files(self, overwrite=False):
         self.toggle_video_recording_button['text'] = 'Click to start recording'
 
 
-def create_output_files(self, subject_name='Sam'):
-    # create output file names
+def create_output_files(self, subject_name='Sam', journal=True, bundle=True):
+    # create output file names, the frame times are streamed to a journal next to each video unless journal is False
+    # and the session bundle is created unless bundle is False, e.g. for calibration videos that are never saved with it
     self.ts_file = []
     self.ts_file_csv = []
     self.frame_times = []
+    self.roi_trackers = []
     
     for i in range(len(self.cam)):
         self.ts_file.append(self.vid_file[i].replace('.avi', '.npy'))
@@ -64,13 +67,33 @@ def create_output_files(self, subject_name='Sam'):
         self.ts_file_csv[i] = self.ts_file_csv[i].replace(self.cam_name_no_space[i],
                                                           'TIMESTAMPS_' + self.cam_name_no_space[i])
         # self.current_file_label['text'] = subject_name
-        self.frame_times.append([])
+        self.frame_times.append(TimestampStream(get_journal_file(self.vid_file[i]) if journal else None))
+        rois = self.get_rois(i)
+        self.roi_trackers.append(ROITracker(rois) if rois else None)
         # Change label to show current file name
         self.video_file_status[i]['text'] = self.base_name[i] + self.attempt.get()
         self.video_file_indicator[i]['bg'] = 'red'
     
     # empty out the video's stat message
     self.save_msg = ""
+    
+    if bundle:
+        create_session_bundle(self)
+
+
+def create_session_bundle(self):
+    # one bundle per session with the settings of every camera, the timestamps are added as the videos are saved
+    bundle_file = get_bundle_file(self.vid_file[0], self.cam_name_no_space[0])
+    # the videos of the session are overwritten as well
+    remove_bundle(bundle_file)
+    self.session_bundle = SessionBundle(bundle_file)
+    self.session_fps = int(self.fps.get())
+    self.session_bundle.set_attrs(subject=self.subject.get(), setup=self.setup_name.get(), attempt=self.attempt.get(),
+                                  fps=self.session_fps, cams=len(self.cam))
+    for i in range(len(self.cam)):
+        self.session_bundle.set_attrs(f'cam{i}', name=self.cam_name[i], video_file=os.path.basename(self.vid_file[i]),
+                                      exposure=float(self.exposure[i].get()), gain=float(self.gain[i].get()),
+                                      dim=list(self.cam[i].get_video_format()), rois=self.get_rois(i))
 
 
 def save_vid(self, compress=False, delete=False, plotData=False):
@@ -78,6 +101,11 @@ def save_vid(self, compress=False, delete=False, plotData=False):
     self.toggle_video_recording_button['state'] = 'disabled'
     self.toggle_video_recording_button.config(text="Capture Disabled", background="red")
     
+    # the camera processes send their timestamps back in the background, save once they are stopped
+    if self.process_acquisition_stop_thread is not None and self.process_acquisition_stop_thread.is_alive():
+        self.window.after(100, lambda: save_vid(self, compress=compress, delete=delete, plotData=plotData))
+        return
+    
     saved_files = []
     for num in range(len(self.cam)):
         self.trigger_status_label[num]['text'] = 'Disabled'
@@ -100,17 +128,23 @@ def save_vid(self, compress=False, delete=False, plotData=False):
         if delete or (not frames_taken):
             os.remove(self.vid_file[i])
         else:
-            np.save(str(self.ts_file[i]), np.array(self.frame_times[i]))
-            np.savetxt(str(self.ts_file_csv[i]), np.array(self.frame_times[i]), delimiter=",")
+            save_timestamps(self.frame_times[i].get_times(), self.ts_file[i], self.ts_file_csv[i])
             saved_files.append(self.vid_file[i])
             saved_files.append(self.ts_file[i])
+            tracking_value = self.roi_trackers[i].get_result() if self.roi_trackers[i] is not None else None
+            saved_files.extend(self.save_roi_values(i, tracking_value))
+            self.add_recording_to_bundle(i, self.vid_file[i], self.frame_times[i].get_times(),
+                                         tracking_value=tracking_value)
             if compress:
-                threading.Thread(target=lambda: compress_vid(self, i)).start()
+                compress_vid(self, i)
+        self.frame_times[i].remove_journal()
     
     if len(saved_files) > 0:
+        self.add_calibration_to_bundle()
+        saved_files.append(self.session_bundle.merge())
         if len(self.frame_times) > 1:
-            cam0_times = np.array(self.frame_times[0])
-            cam1_times = np.array(self.frame_times[1])
+            cam0_times = self.frame_times[0].get_times()
+            cam1_times = self.frame_times[1].get_times()
             fps = int(self.fps.get())
             check_frame_text = check_frame(cam0_times, cam1_times, fps)
             for texty in check_frame_text:
@@ -127,6 +161,10 @@ def save_vid(self, compress=False, delete=False, plotData=False):
         self.save_msg = 'Video was initialized but no frames were recorded.\n' \
                         'Video has been deleted, please set up a new video to take another recording.'
     
+    if len(saved_files) == 0:
+        # only the settings were written to the bundle, the videos are deleted
+        remove_bundle(self.session_bundle.bundle_file)
+    
     if self.save_msg:
         display_recorded_stats(self)
     
@@ -138,13 +176,8 @@ def save_vid(self, compress=False, delete=False, plotData=False):
 
 
 def compress_vid(self, ind):
-    ff_input = dict()
-    ff_input[self.vid_file[ind]] = None
-    ff_output = dict()
-    out_file = self.vid_file[ind].replace('avi', 'mp4')
-    ff_output[out_file] = '-c:v libx264 -crf 17'
-    ff = ffmpy.FFmpeg(inputs=ff_input, outputs=ff_output)
-    ff.run()
+    # queued, the transcode queue compresses a bounded number of videos at a time
+    self.transcode_queue.add(self.vid_file[ind])
 
 
 def display_recorded_stats(self):
@@ -12,35 +12,40 @@ Modified by people at Dr. Tresch's lab
 
 import argparse
 import copy
+import cProfile
 import datetime
 import json
 import math
 import os
 import pickle
+import pstats
 import queue
 import threading
 import time
 import traceback
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
+
+# start of the imports, for the startup profile mode
+_imports_start = time.perf_counter()
 from tkinter import Entry, Label, Button, StringVar, IntVar, BooleanVar, \
     Tk, END, Radiobutton, filedialog, ttk, Frame, Scale, HORIZONTAL, Spinbox, Checkbutton, DoubleVar, messagebox
 from idlelib.tooltip import Hovertip
-
-from matplotlib import pyplot as plt
-import matplotlib.ticker as ticker
-
-import matplotlib.animation as animation
-from matplotlib import style
-from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
 from typing import List
 
 from src.camera_control.ic_camera import ICCam
+from src.camera_control.frame_bus import FrameBus
+from src.camera_control.frame_scheduler import FrameScheduler, sleep_until
+from src.camera_control import async_log
+from src.camera_control.transcode_queue import TranscodeQueue
+from src.camera_control.timestamp_stream import save_timestamps, remove_journal
+from src.camera_control.session_bundle import get_dropped_frames
 
 import cv2
-import ffmpy
 import numpy as np
 from _video_files_func import create_video_files, create_output_files, save_vid, display_recorded_stats, check_frame
-from _calibration_func import detect_raw_board_on_thread, draw_detection_on_thread, draw_reprojection_on_thread, detect_markers_on_thread
+from _calibration_func import detect_raw_board_on_thread, draw_detection_on_thread, draw_reprojection_on_thread, detect_markers_on_thread, \
+    publish_frame
 from _camera_settings_func import get_frame_rate_list, set_gain, set_exposure, get_frame_dimensions, get_formats, set_formats, \
     get_fov, set_fov, set_frame_rate, get_current_frame_rate, \
     set_partial_scan_limit, toggle_auto_center, toggle_polarity, toggle_flip_vertical, \
@@ -50,12 +55,26 @@ from _camera_settings_func import get_frame_rate_list, set_gain, set_exposure, g
 
 from os_handler import *
 
+_imports_end = time.perf_counter()
+
+capture_log = async_log.get_logger('calibration.capture')
+
 # noinspection PyNoneFunctionAssignment,PyAttributeOutsideInit
 
 
 class CamGUI(object):
 
     def __init__(self, debug_mode=False, init_cam_bool=True, **kwargs):
+        # startup profile mode, reports how long it takes until the window is usable
+        self.startup_start = time.perf_counter()
+        self.startup_wait = 0
+        self.startup_profiler = None
+        if kwargs.get('profile_startup', False):
+            self.startup_profiler = cProfile.Profile()
+            self.startup_profiler.enable()
+        self.warm_up = kwargs.get('warm_up', True)
+        self.warm_up_thread = None
+        
         # GUI placeholders
         self.format_list = ['Y16 (256x4)', 'Y16 (320x240)', 'Y16 (320x480)', 'Y16 (352x240)', 'Y16 (352x288)',
                             'Y16 (384x288)', 'Y16 (640x240)', 'Y16 (640x288)', 'Y16 (640x480)', 'Y16 (704x576)',
@@ -109,6 +128,7 @@ class CamGUI(object):
         self.flip_vertical = []
         self.frame_acquired_count_label = []
         self.board_detected_count_label = []
+        self.coverage_label = []
 
         self.polarity = []
 
@@ -127,6 +147,25 @@ class CamGUI(object):
         self.test_calibration_live_toggle_status = []
         self.calibration_toggle_status = False
         self.calibrating_thread = None
+        self.process_acquisition = None
+        self.process_acquisition_stop_thread = None
+        self.frame_schedulers = {}
+        self.vid_file = []
+        self.frame_times = []
+        self.roi_trackers = []
+        
+        # live markers triangulated while recording, sent to a local UDP port
+        self.marker_port = kwargs.get('marker_port', 9465)
+        self.marker_stream = None
+        self.marker_bus = None
+        
+        # local metrics endpoint for unattended recordings
+        self.metrics_server = None
+        if kwargs.get('metrics_port') is not None:
+            from src.camera_control.metrics_server import MetricsServer
+            self.metrics_server = MetricsServer(self.collect_metrics, port=kwargs.get('metrics_port'))
+            self.metrics_server.start()
+        
         # Initialize GUI
         self.running_config = {'debug_mode': debug_mode, 'init_cam_bool': init_cam_bool}
         if self.running_config['init_cam_bool']:
@@ -138,6 +177,13 @@ class CamGUI(object):
         path = Path(os.path.realpath(__file__))
         # Navigate to the outer parent directory and join the filename
         dets_file = os.path.normpath(str(path.parents[2] / 'config-files' / 'camera_details.json'))
+        self.camera_state_dir = os.path.normpath(str(path.parents[2] / 'config-files' / 'camera_states'))
+        
+        # compresses the saved videos in the background, jobs left from a previous session are resumed
+        self.transcode_queue = TranscodeQueue(os.path.normpath(str(path.parents[2] / 'config-files' / 'transcode_queue.json')),
+                                              workers=kwargs.get('transcode_workers', 1),
+                                              delete_source=kwargs.get('delete_after_transcode', False))
+        self.transcode_queue.start()
 
         with open(dets_file) as f:
             self.cam_details = json.load(f)
@@ -174,6 +220,50 @@ class CamGUI(object):
         Label(setup_window, text="Setting up camera, please wait...").pack()
         setup_window.update()
         
+        if self.show_recording_init_error(setup_window):
+            return
+
+        cam_num = self.get_cam_num(num)
+        self.open_cam(num, cam_num, self.exposure[cam_num].get(), self.gain[cam_num].get(),
+                      self.get_camera_state_dir())
+        self.update_cam_settings(num, cam_num)
+        
+        setup_window.destroy()
+
+    def init_all_cams(self):
+        """Opens all the selected cameras at the same time, each in its own thread"""
+        setup_window = Tk()
+        Label(setup_window, text="Setting up all cameras, please wait...").pack()
+        setup_window.update()
+        
+        if self.show_recording_init_error(setup_window):
+            return
+        
+        # the tkinter variables are only read and written from the main thread
+        state_dir = self.get_camera_state_dir()
+        cam_nums = [self.get_cam_num(num) for num in range(self.number_of_cams)]
+        settings = [(num, cam_num, self.exposure[cam_num].get(), self.gain[cam_num].get(), state_dir)
+                    for num, cam_num in enumerate(cam_nums)]
+        
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=self.number_of_cams) as executor:
+            futures = [executor.submit(self.open_cam, *setting) for setting in settings]
+            for num, future in enumerate(futures):
+                try:
+                    future.result()
+                except Exception as e:
+                    print(f'Cam {num} failed to initialize:', type(e).__name__, e)
+                    traceback.print_exc()
+                    self.cam[num] = None
+        print(f'{self.number_of_cams} cameras initialized in {time.perf_counter() - start:.2f} s')
+        
+        for num, cam_num in enumerate(cam_nums):
+            if self.cam[num] is not None:
+                self.update_cam_settings(num, cam_num)
+        
+        setup_window.destroy()
+
+    def show_recording_init_error(self, setup_window):
         if bool(self.toggle_video_recording_status.get()):
             setup_window.destroy()
             cam_on_window = Tk()
@@ -181,30 +271,41 @@ class CamGUI(object):
             Button(cam_on_window, text="Ok", command=lambda: cam_on_window.quit()).pack()
             cam_on_window.mainloop()
             cam_on_window.destroy()
-            return
+            return True
+        return False
+
+    def get_cam_num(self, num):
+        names = np.array(self.cam_names)
+        return np.where(names == self.camera[num].get())[0][0]
 
+    def get_camera_state_dir(self):
+        return self.camera_state_dir if bool(self.use_camera_state.get()) else None
+
+    def open_cam(self, num, cam_num, exposure, gain, state_dir=None):
+        """Opens and sets up the camera with driver calls only, so the cameras can be opened from worker threads"""
         if len(self.cam) >= num + 1:
             if isinstance(self.cam[num], ICCam):
                 self.cam[num].close()
                 self.cam[num] = None
 
         # create camera object
-        cam_num = self.camera[num].get()
-        names = np.array(self.cam_names)
-        cam_num = np.where(names == cam_num)[0][0]
-
-        # if len(self.cam) >= num + 1:
-        self.cam_name[num] = names[cam_num]
-        self.cam[num] = ICCam(cam_num, exposure=self.exposure[cam_num].get(), gain=self.gain[cam_num].get())
-        
-        set_frame_rate(self, num, framerate=388, initCamera=True)
+        self.cam_name[num] = self.cam_names[cam_num]
+        cam = ICCam(cam_num, exposure=exposure, gain=gain, state_dir=state_dir)
+        
+        if not cam.from_snapshot:
+            cam.set_frame_rate(388)
+            # set gain and exposure using the values from the json
+            cam.set_exposure(float(format(self.cam_details[str(num)]['exposure'], '.6f')))
+            cam.set_gain(int(self.cam_details[str(num)]['gain']))
+        cam.start()
+        self.cam[num] = cam
+
+    def update_cam_settings(self, num, cam_num):
+        """Reflects the settings of an opened camera onto the GUI"""
+        if not self.cam[num].from_snapshot:
+            self.framerate[num].set(388)
         get_formats(self, num)
         
-        # set gain and exposure using the values from the json
-        self.cam[num].set_exposure(float(format(self.cam_details[str(num)]['exposure'], '.6f')))
-        self.cam[num].set_gain(int(self.cam_details[str(num)]['gain']))
-        self.cam[num].start()
-        
         # get the gain and exposure values to reflect that onto the GUI
         self.exposure[num].set(self.cam[num].get_exposure())
         self.exposure_current_label[num]['text'] = f"Current: {self.exposure[num].get()} (-{str(round(math.log2(1/float((self.exposure[num].get())))))}) s"
@@ -216,7 +317,9 @@ class CamGUI(object):
         set_partial_scan_limit(self, num)
         get_frame_rate_list(self, num)
         
-        get_current_frame_rate(self, num)
+        current_frame_rate = get_current_frame_rate(self, num)
+        if self.cam[num].from_snapshot:
+            self.framerate[num].set(current_frame_rate)
         self.trigger_status_label[num]['text'] = 'Disabled'
         
         [x_offset_value, y_offset_value] = self.cam[num].get_partial_scan()
@@ -234,8 +337,15 @@ class CamGUI(object):
             self.dir_output.set(self.output_entry['values'][cam_num])
         else:
             self.dir_output.set(self.output_dir)
-        
-        setup_window.destroy()
+
+    def save_camera_states(self):
+        """Saves a device state snapshot of every initialized camera, used by the next initialization"""
+        if not any(isinstance(cam, ICCam) for cam in self.cam):
+            show_camera_error(self)
+            return
+        for cam in self.cam:
+            if isinstance(cam, ICCam):
+                cam.save_device_snapshot(self.camera_state_dir)
 
     def release_trigger(self):
         for num in range(len(self.cam)):
@@ -427,6 +537,19 @@ class CamGUI(object):
             self.recording_status.set('Stopping recording...')
             self.toggle_video_recording_status = IntVar(value=0)
             self.toggle_video_recording_button.config(text="Capture Off", background="red")
+            self.transcode_queue.set_acquisition_active(False)
+            if self.process_acquisition is not None:
+                # the cameras are handed back in the background, see stop_process_acquisition
+                if self.process_acquisition_stop_thread is None or not self.process_acquisition_stop_thread.is_alive():
+                    self.process_acquisition.cancel()
+                    self.process_acquisition_stop_thread = threading.Thread(target=self.stop_process_acquisition,
+                                                                            daemon=True)
+                    self.process_acquisition_stop_thread.start()
+                return
+            if self.marker_stream is not None:
+                self.marker_stream.stop()
+                self.marker_stream = None
+                
             if self.toggle_continuous_mode.get() == 1:
                 for i in range(len(self.cam)):
                     self.cam[i].turn_off_continuous_mode()
@@ -437,12 +560,22 @@ class CamGUI(object):
             self.recording_status.set('Starting recording...')
             self.toggle_video_recording_status = IntVar(value=1)
             self.toggle_video_recording_button.config(text="Capture On", background="green")
+            self.transcode_queue.set_acquisition_active(True)
             
             self.vid_start_time = time.perf_counter()
+            if int(self.process_per_camera.get()):
+                if int(self.track_markers.get()):
+                    print('Marker tracking is not supported with one process per camera')
+                self.start_process_acquisition()
+                return
+            if int(self.track_markers.get()):
+                self.start_marker_stream()
+            
+            # with frame sync, all cameras are released at the same tick of one scheduler
             if int(self.force_frame_sync.get()):
-                barrier = threading.Barrier(len(self.cam))
+                scheduler = FrameScheduler(int(self.fps.get()), n_threads=len(self.cam))
             else:
-                barrier = None
+                scheduler = None
                 
             if self.toggle_continuous_mode.get() == 1:
                 for i in range(len(self.cam)):
@@ -450,14 +583,85 @@ class CamGUI(object):
                     
             t = []
             for i in range(len(self.cam)):
-                t.append(threading.Thread(target=self.record_on_thread, args=(i, barrier)))
+                t.append(threading.Thread(target=self.record_on_thread, args=(i, scheduler)))
                 t[-1].daemon = True
                 t[-1].start()
             
             self.recording_status.set('Recording stopped.')
 
-    def record_on_thread(self, num, barrier=None):
+    def start_marker_stream(self):
+        """
+        Starts triangulating the bright markers of the frames being recorded, with the calibration of the output directory.
+        The markers are written to MARKERS_<session>.csv next to the videos and sent to the local marker port.
+        """
+        from src.aniposelib.cameras import CameraGroup
+        from src.camera_control.marker_stream import MarkerStream
+        calibration_file = os.path.join(self.dir_output.get(), 'calibration.toml')
+        try:
+            cgroup = CameraGroup.load(calibration_file)
+        except Exception as e:
+            print(f'Marker tracking disabled, failed to load {calibration_file}: {e}')
+            return
+        if len(cgroup.cameras) != len(self.cam):
+            print(f'Marker tracking disabled, the calibration has {len(cgroup.cameras)} cameras for {len(self.cam)} cameras')
+            return
+        if not int(self.force_frame_sync.get()):
+            print('Force Frame Sync is off, the markers are triangulated from frames not captured at the same time')
+        
+        # the camera threads publish their frames, the marker thread takes the latest complete set
+        if self.marker_bus is not None:
+            self.marker_bus.close()
+        self.marker_bus = FrameBus([self.cam[i].get_frame_shape() for i in range(len(self.cam))])
+        
+        directory, name = os.path.split(os.path.splitext(self.vid_file[0])[0])
+        if name.startswith(self.cam_name_no_space[0] + '_'):
+            name = name[len(self.cam_name_no_space[0]) + 1:]
+        output_file = os.path.join(directory, 'MARKERS_' + name + '.csv')
+        self.marker_stream = MarkerStream(self.marker_bus, cgroup, output_file=output_file, port=self.marker_port)
+        self.marker_stream.start()
+        print(f'Markers written to {output_file} and sent to udp://127.0.0.1:{self.marker_port}')
+
+    def start_process_acquisition(self):
+        """
+        Starts the recording with each camera owned by its own worker process.
+        The workers capture on the same frame schedule, so the recording is always frame synced.
+        """
+        from src.camera_control.process_acquisition import ProcessAcquisition
+        if self.trigger_on == 1:
+            print('Trigger is not supported with one process per camera, recording is software timed')
+        
+        # the video files are written by the workers
+        for i in range(len(self.vid_out)):
+            self.vid_out[i].release()
+        
+        self.process_acquisition = ProcessAcquisition(self.cam, self.vid_file, self.video_codec, int(self.fps.get()),
+                                                      continuous_mode=int(self.toggle_continuous_mode.get()))
+        # the workers take a few seconds to open the cameras, do not block the GUI meanwhile
+        self.process_acquisition_thread = threading.Thread(target=self.process_acquisition.start, daemon=True)
+        self.process_acquisition_thread.start()
+        self.recording_status.set('Recording in one process per camera.')
+
+    def stop_process_acquisition(self):
+        """
+        Stops all the camera processes at the same frame and hands the cameras back. Runs on a thread, as a start
+        still waiting for the workers to open their cameras is only cancelled once they are ready.
+        """
+        process_acquisition = self.process_acquisition
+        self.process_acquisition_thread.join()
+        frame_times, _ = process_acquisition.stop()
+        for i in range(len(self.cam)):
+            self.frame_times[i].extend(frame_times[i])
+        if self.toggle_continuous_mode.get() == 1:
+            for i in range(len(self.cam)):
+                self.cam[i].turn_off_continuous_mode()
+        self.process_acquisition = None
+        self.recording_status.set('Recording stopped.')
+
+    def record_on_thread(self, num, scheduler=None):
         fps = int(self.fps.get())
+        if scheduler is None:
+            scheduler = FrameScheduler(fps)
+        self.frame_schedulers[num] = scheduler
         if self.trigger_on == 1:
             try:
                 self.trigger_status_label[num]['text'] = 'Waiting for trigger...'
@@ -477,26 +681,62 @@ class CamGUI(object):
                 # self.cam[num].set_frame_rate(old_frame_rate)
                 self.cam[num].disable_trigger(legacy=True)
                 start_in_one = math.trunc(time.perf_counter()) + 1
-                while time.perf_counter() < start_in_one:
-                    pass
+                sleep_until(start_in_one)
             except Exception as e:
                 print(f"Traceback: \n {traceback.format_exc()}")
 
-        start_time = time.perf_counter()
-        next_frame = start_time
-
         try:
             while bool(self.toggle_video_recording_status.get()):
-                if time.perf_counter() >= next_frame:
-                    if barrier is not None:
-                        barrier.wait()
-                    self.frame_times[num].append(time.perf_counter())
-                    self.vid_out[num].write(self.cam[num].get_image())
-                    next_frame = max(next_frame + 1.0 / fps, self.frame_times[num][-1] + 0.5 / fps)
+                try:
+                    scheduler.wait()
+                except threading.BrokenBarrierError:
+                    break
+                self.frame_times[num].append(time.perf_counter())
+                frame = self.cam[num].get_image()
+                self.vid_out[num].write(frame)
+                if self.marker_stream is not None:
+                    publish_frame(self.marker_bus, num, frame, len(self.frame_times[num]), frame_time=self.frame_times[num][-1])
+                if self.roi_trackers[num] is not None:
+                    self.roi_trackers[num].sample(frame)
             
             print(f"Recording stopped for camera {num}")
         except Exception as e:
             print(f"Traceback: \n {traceback.format_exc()}")
+        finally:
+            # do not leave the other cameras waiting for this one
+            scheduler.abort()
+
+    def collect_metrics(self):
+        """
+        Returns the counters of every camera for the metrics server.
+        Runs on the thread of the server, so it does not touch the tkinter variables.
+        """
+        metrics = []
+        process_acquisition = self.process_acquisition
+        if process_acquisition is not None and process_acquisition.status is not None:
+            from src.camera_control.process_acquisition import STATUS_FRAMES, STATUS_DROPPED
+            status = process_acquisition.get_status()
+            for num in range(len(status)):
+                metrics.append({'cam': num, 'video_file': process_acquisition.video_files[num],
+                                'frames_acquired': int(status[num, STATUS_FRAMES]),
+                                'frames_written': int(status[num, STATUS_FRAMES]),
+                                'overruns': int(status[num, STATUS_DROPPED])})
+            return metrics
+        
+        for num, cam in enumerate(list(self.cam)):
+            if not isinstance(cam, ICCam):
+                continue
+            if cam.vid_file.vid_out is not None:
+                # trigger recording, the frames go through the buffer of the video recording session
+                metrics.append(cam.vid_file.get_metrics())
+            else:
+                # recording threads, one frame time per frame written
+                frames = len(self.frame_times[num]) if num < len(self.frame_times) else 0
+                scheduler = self.frame_schedulers.get(num)
+                metrics.append({'cam': num, 'video_file': self.vid_file[num] if num < len(self.vid_file) else None,
+                                'frames_acquired': frames, 'frames_written': frames,
+                                'overruns': scheduler.late if scheduler is not None else 0})
+        return metrics
 
     # endregion Normal recording
     
@@ -626,6 +866,7 @@ class CamGUI(object):
             self.calibration_process_stats.set('Initialized camera object.')
             self.frame_count = []
             self.all_rows = []
+            self.frame_selector = None
 
             self.calibration_process_stats.set('Cameras found. Recording the frame sizes')
             self.set_calibration_buttons_group(state='normal')
@@ -684,10 +925,14 @@ class CamGUI(object):
 
             # check if file exists, ask to overwrite or change attempt number if it does
             create_video_files(self, overwrite=override)
-            create_output_files(self, subject_name='Sam')
+            create_output_files(self, subject_name='Sam', journal=False, bundle=False)
 
             self.calibration_process_stats.set('Setting the frame sizes...')
             self.cgroup.set_camera_sizes_images(frame_sizes=frame_sizes)
+            from src.aniposelib.selection import CoverageMap
+            self.coverage_map = CoverageMap(frame_sizes)
+            self.coverage_sufficient = False
+            self.coverage_shown_time = 0
             self.calibration_process_stats.set('Prepping done. Ready to capture calibration frames...')
             self.calibration_status_label['bg'] = 'yellow'
 
@@ -764,12 +1009,12 @@ class CamGUI(object):
                 for i in range(len(self.cam)):
                     self.cam[i].turn_on_continuous_mode()
                     
-            # Sync camera capture time using threading.Barrier
-            barrier = threading.Barrier(len(self.cam))
+            # Sync camera capture time, all cameras are released at the same tick of the scheduler
+            scheduler = FrameScheduler(int(self.fps.get()), n_threads=len(self.cam))
             
             for i in range(len(self.cam)):
                 thread_name = f"Cam {i + 1} thread"
-                self.recording_threads.append(threading.Thread(target=self.record_calibrate_on_thread, args=(i, barrier), name=thread_name))
+                self.recording_threads.append(threading.Thread(target=self.record_calibrate_on_thread, args=(i, scheduler), name=thread_name))
                 self.recording_threads[-1].daemon = True
                 self.recording_threads[-1].start()
                 self.recording_threads_status.append(True)
@@ -832,64 +1077,91 @@ class CamGUI(object):
                 self.all_rows[num].extend(row)
                 self.current_all_rows[num].extend(row)
                 self.board_detected_count_label[num]['text'] = f'{len(self.all_rows[num])}; {len(row)}'
+                self.coverage_map.add(num, corners)
                 self.frame_acquired_count_label[num]['text'] = f'{self.frame_count[num]}'
                 self.vid_out[num].write(frame_current)
         
         self.added_board_value.set(f'{len(self.current_all_rows[0])}')
+        self.show_coverage(force=True)
+    
+    def show_coverage(self, force=False):
+        """
+        Shows the coverage of the image of every camera by the detected corners in the Coverage window, at most twice
+        per second unless forced, and signals once the coverage of all cameras is enough to stop capturing.
+        """
+        if not force and time.perf_counter() - self.coverage_shown_time < 0.5:
+            return
+        self.coverage_shown_time = time.perf_counter()
+        # rendered on the calling thread, shown by the Tk main loop since it is called from the calibration threads
+        image = self.coverage_map.render()
+        coverages = [(self.coverage_map.get_coverage(num), self.coverage_map.is_sufficient(num))
+                     for num in range(len(self.cam))]
+        newly_sufficient = self.coverage_map.is_sufficient() and not self.coverage_sufficient
+        if newly_sufficient:
+            self.coverage_sufficient = True
+        self.window.after(0, lambda: self.update_coverage_display(image, coverages, newly_sufficient))
+    
+    def update_coverage_display(self, image, coverages, newly_sufficient):
+        """Shows a coverage image and its values per camera, on the Tk main loop."""
+        cv2.imshow('Coverage', image)
+        cv2.waitKey(1)
+        
+        for num, (coverage, sufficient) in enumerate(coverages):
+            self.coverage_label[num]['text'] = f'{coverage * 100:.0f}%'
+            self.coverage_label[num]['bg'] = 'green' if sufficient else 'yellow'
+        if newly_sufficient:
+            print('Coverage sufficient on all cameras')
+            self.calibration_process_stats.set('Coverage sufficient on all cameras, the capture can be stopped')
     
-    def record_calibrate_on_thread(self, num, barrier):
+    def record_calibrate_on_thread(self, num, scheduler):
         """
         Records frames from a camera on a separate thread for calibration purposes.
 
         :param num: The ID of the capturing camera.
-        :param barrier: A threading.barrier object used to synchronize the start of frame capturing.
+        :param scheduler: A FrameScheduler shared by the camera threads, used to synchronize and pace frame capturing.
 
         :return: None
 
         """
-        fps = int(self.fps.get())
         start_time = time.perf_counter()
-        next_frame = start_time
         try:
             while self.calibration_capture_toggle_status and (time.perf_counter()-start_time < self.calibration_duration):
-                if time.perf_counter() >= next_frame:
-                    try:
-                        barrier.wait(timeout=1)
-                    except threading.BrokenBarrierError:
-                        print(f'Barrier broken for cam {num}. Proceeding...')
-                        break
-                        
-                    self.frame_times[num].append(time.perf_counter())
-                    self.frame_count[num] += 1
-                    frame_current = self.cam[num].get_image()
-                    # detect the marker as the frame is acquired
-                    corners, ids = self.board_calibration.detect_image(frame_current)
-                    if corners is not None:
-                        key = self.frame_count[num]
-                        row = {
-                            'framenum': key,
-                            'corners': corners,
-                            'ids': ids
-                        }
-
-                        row = self.board_calibration.fill_points_rows([row])
-                        self.all_rows[num].extend(row)
-                        self.current_all_rows[num].extend(row)
-                        self.board_detected_count_label[num]['text'] = f'{len(self.all_rows[num])}; {len(corners)}'
-                        if num == 0:
-                            self.calibration_current_duration_value.set(f'{time.perf_counter()-start_time:.2f}')
-                    else:
-                        print(f'No marker detected on cam {num} at frame {self.frame_count[num]}')
+                try:
+                    scheduler.wait(timeout=1)
+                except threading.BrokenBarrierError:
+                    print(f'Barrier broken for cam {num}. Proceeding...')
+                    break
                     
-                    # putting frame into the frame queue along with following information
-                    self.frame_queue.put((frame_current,  # the frame itself
-                                          num,  # the id of the capturing camera
-                                          self.frame_count[num],  # the current frame count
-                                          self.frame_times[num][-1]))  # captured time
-
-                    next_frame = max(next_frame + 1.0/fps, self.frame_times[num][-1] + 0.5/fps)
-                    
-            barrier.abort()
+                self.frame_times[num].append(time.perf_counter())
+                self.frame_count[num] += 1
+                frame_current = self.cam[num].get_image()
+                # detect the marker as the frame is acquired
+                corners, ids = self.board_calibration.detect_image(frame_current)
+                if corners is not None:
+                    key = self.frame_count[num]
+                    row = {
+                        'framenum': key,
+                        'corners': corners,
+                        'ids': ids
+                    }
+
+                    row = self.board_calibration.fill_points_rows([row])
+                    self.all_rows[num].extend(row)
+                    self.current_all_rows[num].extend(row)
+                    self.board_detected_count_label[num]['text'] = f'{len(self.all_rows[num])}; {len(corners)}'
+                    self.coverage_map.add(num, corners)
+                    if num == 0:
+                        self.calibration_current_duration_value.set(f'{time.perf_counter()-start_time:.2f}')
+                else:
+                    capture_log.info('No marker detected on cam %d at frame %d', num, self.frame_count[num])
+                
+                # putting frame into the frame queue along with following information
+                self.frame_queue.put((frame_current,  # the frame itself
+                                      num,  # the id of the capturing camera
+                                      self.frame_count[num],  # the current frame count
+                                      self.frame_times[num][-1]))  # captured time
+                
+            scheduler.abort()
             if (time.perf_counter() - start_time) > self.calibration_duration or self.calibration_capture_toggle_status:
                 print(f"Calibration capture on cam {num}: duration exceeded or toggle status is True")
                 self.recording_threads_status[num] = False
@@ -937,6 +1209,7 @@ class CamGUI(object):
                 frame_counts[thread_id] += 1
                 self.frame_acquired_count_label[thread_id]['text'] = f'{frame_count}'
                 self.vid_out[thread_id].write(frame)
+                self.show_coverage()
                 
                 # Process the frame group (frames with the same thread_id)
                 # dumping the mix and match rows into detections.pickle to be pickup by calibrate_on_thread
@@ -972,6 +1245,7 @@ class CamGUI(object):
             # Clear the frame queue
             self.frame_queue.queue.clear()
             print('Cleared frame queue')
+            self.show_coverage(force=True)
             
             if all(thread is False for thread in self.recording_threads_status):
                 print('Terminating thread')
@@ -1065,7 +1339,14 @@ class CamGUI(object):
                     init_matrix = bool(self.init_matrix_check.get())
                     print(f'init_matrix: {init_matrix}')
                     
-                # all_rows = [row[-100:] if len(row) >= 100 else row for row in all_rows]
+                # bundle adjustment only gets the frames that cover the image and the board poses best,
+                # so its duration stops growing with the length of the capture
+                if self.frame_selector is None:
+                    from src.aniposelib.selection import FrameSelector
+                    self.frame_selector = FrameSelector(self.cgroup, self.board_calibration)
+                n_rows = sum(len(rows) for rows in all_rows)
+                all_rows = self.frame_selector.select_rows(all_rows)
+                print(f'Selected {sum(len(rows) for rows in all_rows)} of {n_rows} detections for calibration')
                 self.calibration_error = self.cgroup.calibrate_rows(all_rows, self.board_calibration,
                                                                     init_intrinsics=init_matrix,
                                                                     init_extrinsics=init_matrix,
@@ -1115,6 +1396,8 @@ class CamGUI(object):
         root.configure(background='white')
         
         error_list = self.error_list
+        # matplotlib is only imported once a plot is requested, it takes a large part of the startup time
+        from matplotlib import pyplot as plt
         fig, ax = plt.subplots()
 
         # Plot the error values
@@ -1163,12 +1446,21 @@ class CamGUI(object):
         barrier = threading.Barrier(len(self.cam))
         t = []
         # recording_threads_status is a list of False with length of number of cameras
-        self.frame_queue = queue.Queue(maxsize=10)
+        # frame bus shared by the camera threads and the drawing thread, one slot per camera
+        if getattr(self, 'frame_bus', None) is not None:
+            self.frame_bus.close()
+        self.frame_bus = FrameBus([self.cam[i].get_frame_shape() for i in range(len(self.cam))])
         self.test_calibration_live_threads_status = [True] * len(self.cam)
         self.all_rows_test = [[] for _ in range(len(self.cam))]
         self.frame_count_test = [0] * len(self.cam)
         
         if self.reprojection_check.get():
+            from src.aniposelib.live import LiveReprojection
+            # projection matrices and distortions of the loaded calibration are cached once for the live check
+            if self.cgroup_test is not None:
+                self.live_reprojection = LiveReprojection(self.cgroup_test, self.board_calibration, min_cameras=2)
+            else:
+                self.live_reprojection = None
             self.reproject_window_status = True
             for i in range(len(self.cam)):
                 t.append(threading.Thread(target=detect_markers_on_thread, args=(self, i, barrier)))
@@ -1179,6 +1471,12 @@ class CamGUI(object):
             t[-1].daemon = True
             t[-1].start()
         else:
+            # the undistortion maps of the loaded calibration are computed once per camera
+            if self.undistort_check.get() and self.cgroup_test is not None:
+                from src.aniposelib.undistort import UndistortMaps
+                self.undistort_maps = UndistortMaps(self.cgroup_test)
+            else:
+                self.undistort_maps = None
             self.detection_window_status = True
             for i in range(len(self.cam)):
                 t.append(threading.Thread(target=detect_raw_board_on_thread, args=(self, i, barrier)))
@@ -1277,14 +1575,18 @@ class CamGUI(object):
                 print('')
             
             # if self.tracking_points[i][0] is None:
-            self.vid_out.append(self.cam[i].set_up_video_trigger(self.vid_file[i], self.video_codec, int(self.fps.get()), self.dim[i]))
+            self.vid_out.append(self.cam[i].set_up_video_trigger(self.vid_file[i], self.video_codec, int(self.fps.get()), self.dim[i],
+                                                                 rois=self.get_rois(i)))
             # else:
             #     self.vid_out.append(self.cam[i].set_up_video_trigger(self.vid_file[i], self.video_codec, int(self.fps.get()), self.dim[i], self.tracking_points[i]))
+            self.set_up_frame_trace(i)
+            self.set_up_rollover(i)
                 
             self.cam[i].set_frame_callback_video()
             
         subject_name = self.subject.get() + '_' + date + '_' + self.attempt.get()
-        create_output_files(self, subject_name=subject_name)
+        # the video recording sessions keep the timestamp journals of the trigger recordings
+        create_output_files(self, subject_name=subject_name, journal=False)
         
         self.recording_trigger_toggle_status = False
         self.setup = True
@@ -1376,14 +1678,18 @@ class CamGUI(object):
                 print('')
             
             # if self.tracking_points[i][0] is None:
-            self.vid_out.append(self.cam[i].set_up_video_trigger(self.vid_file[i], self.video_codec, int(self.fps.get()), self.dim[i]))
+            self.vid_out.append(self.cam[i].set_up_video_trigger(self.vid_file[i], self.video_codec, int(self.fps.get()), self.dim[i],
+                                                                 rois=self.get_rois(i)))
             # else:
             #     self.vid_out.append(self.cam[i].set_up_video_trigger(self.vid_file[i], self.video_codec, int(self.fps.get()), self.dim[i], self.tracking_points[i]))
+            self.set_up_frame_trace(i)
+            self.set_up_rollover(i)
             
             self.cam[i].set_frame_callback_video()
             
         subject_name = self.subject.get() + '_' + date + '_' + self.attempt.get()
-        create_output_files(self, subject_name=subject_name)
+        # the video recording sessions keep the timestamp journals of the trigger recordings
+        create_output_files(self, subject_name=subject_name, journal=False)
         
         self.recording_trigger_toggle_status = False
         self.setup = True
@@ -1421,6 +1727,7 @@ class CamGUI(object):
                     t.join()
                     
             self.recording_trigger_toggle_status = False
+            self.transcode_queue.set_acquisition_active(False)
             print('The cameras stopped gracefully!')
             self.recording_status.set('The cameras stopped gracefully!')
             
@@ -1448,6 +1755,7 @@ class CamGUI(object):
             self.recording_status.set('Starting the trigger recording...')
             self.toggle_trigger_recording_status = IntVar(value=1)
             self.toggle_trigger_recording_button.config(text="Capture On", background="green")
+            self.transcode_queue.set_acquisition_active(True)
             self.vid_start_time = time.perf_counter()
             
             # enable the trigger
@@ -1480,13 +1788,7 @@ class CamGUI(object):
                 self.cam[num].set_recording_status(state=False)
                 print(f'Kill thread for cam {num}')
                 break
-            # elif self.cam[num].get_timeout_status() == 0:
-            #     # If the timeout is reached, the camera will stop recording and save the video file, then restart the recording
-            #     # Currently, the timeout is set to 0.5 seconds, with additional 0.5 seconds for saving the video file
-            #     self.cam[num].set_recording_status(state=False)
-            #     self.save_trigger_recording_on_thread(num)
-            #     self.cam[num].set_recording_status(state=True)
-            #     print(f'Cam {num} timeout!')
+            # the video is split into cycle files by the writer thread, see set_up_rollover
             time.sleep(0.1)
             
     def monitor_trigger_recording(self):
@@ -1498,34 +1800,111 @@ class CamGUI(object):
                 print(f'Frame number difference: {current_frame_num_diff}')
                 previous_frame_num_diff = current_frame_num_diff
     
-    def save_trigger_recording_on_thread(self, num):
-        time.sleep(0.5)
-        frame_times, frame_num, tracking_value = self.cam[num].release_video_file()
-        np.save(str(self.ts_file[num]), np.array(frame_times))
-        np.savetxt(str(self.ts_file_csv[num]), np.array(frame_times), delimiter=",")
-        
-        self.cycle_count[num] += 1
-        self.vid_file[num] = os.path.normpath(
-                            self.dir_output.get() + '/' +
-                            self.base_name[num] +
-                            str(self.cycle_count[num]) + 'c' +
-                            self.attempt.get() + '.avi')
-        if self.tracking_points[num][0] is None:
-            self.vid_out.append(self.cam[num].set_up_video_trigger(self.vid_file[num], self.video_codec, int(self.fps.get()), self.dim[num]))
-        else:
-            self.vid_out.append(self.cam[num].set_up_video_trigger(self.vid_file[num], self.video_codec, int(self.fps.get()), self.dim[num], self.tracking_points[num]))
-        
-        # So much copy and paste
-        # TODO: Refactor this, make it look less dumb
-        self.ts_file[num] =self.vid_file[num].replace('.avi', '.npy')
-        self.ts_file[num] = self.ts_file[num].replace(self.cam_name_no_space[num],
-                                                      'TIMESTAMPS_' + self.cam_name_no_space[num])
-                                                      
-        self.ts_file_csv[num] = self.vid_file[num].replace('.avi', '.csv')
-        self.ts_file_csv[num] = self.ts_file_csv[num].replace(self.cam_name_no_space[num],
-                                                              'TIMESTAMPS_' + self.cam_name_no_space[num])
+    def set_up_rollover(self, num):
+        """
+        Splits the trigger recording of the camera into cycle files (<base name><cycle>c<attempt>.avi) every
+        "Split every (min)" minutes and/or at every gap of more than "Split gap (s)" seconds between two trigger trains.
+        The files are switched by the writer thread without stopping the recording, see VideoRecordingSession.set_rollover
+        """
+        max_duration = float(self.rollover_minutes.get()) * 60 if self.rollover_minutes.get().strip() else None
+        max_gap = float(self.rollover_gap.get()) if self.rollover_gap.get().strip() else None
+        if max_duration is None and max_gap is None:
+            self.cam[num].vid_file.set_rollover()
+            return
         
-                
+        directory = os.path.dirname(self.vid_file[num])
+        base_name = self.base_name[num]
+        attempt = self.attempt.get()
+        
+        def next_file():
+            self.cycle_count[num] += 1
+            return os.path.normpath(directory + '/' + base_name + str(self.cycle_count[num]) + 'c' + attempt + '.avi')
+        
+        self.cam[num].vid_file.set_rollover(next_file=next_file, max_duration=max_duration, max_gap=max_gap,
+                                            on_rollover=lambda *finished: self.save_trigger_recording_on_thread(num, *finished))
+    
+    def get_timestamp_files(self, num, video_file):
+        ts_file = os.path.join(os.path.dirname(video_file), os.path.basename(video_file).replace(
+            self.cam_name_no_space[num], 'TIMESTAMPS_' + self.cam_name_no_space[num]))
+        return ts_file.replace('.avi', '.npy'), ts_file.replace('.avi', '.csv')
+    
+    def save_trigger_recording_on_thread(self, num, video_file, frame_times, frame_num, tracking_value):
+        """
+        Saves the timestamps and ROI values of a cycle file once the camera has rolled over to the next one,
+        and points the file names of the camera to the file being recorded
+        """
+        ts_file, ts_file_csv = self.get_timestamp_files(num, video_file)
+        save_timestamps(frame_times, ts_file, ts_file_csv)
+        self.save_roi_values(num, tracking_value, ts_file=ts_file)
+        self.save_frame_trace(num, video_file=video_file, frame_num=frame_num)
+        self.add_recording_to_bundle(num, video_file, frame_times, frame_num, tracking_value)
+        
+        self.vid_file[num] = self.cam[num].vid_file.video_file
+        self.ts_file[num], self.ts_file_csv[num] = self.get_timestamp_files(num, self.vid_file[num])
+    
+    def get_rois(self, num):
+        """
+        Returns the ROIs tracked for the camera, from the "rois" of the camera in camera_details.json,
+        e.g. "rois": {"sync_led": [x, y, width, height], "reward_port": [x, y, width, height]}
+        """
+        return self.cam_details[str(num)].get('rois') or None
+    
+    def save_roi_values(self, num, tracking_value, ts_file=None):
+        """
+        Saves the ROI values of the camera beside its timestamps, as ROI_<video name>.npz. Returns the saved files.
+        """
+        if tracking_value is None:
+            return []
+        ts_file = self.ts_file[num] if ts_file is None else ts_file
+        roi_file = ts_file.replace('TIMESTAMPS_', 'ROI_').replace('.npy', '.npz')
+        np.savez(roi_file, **tracking_value)
+        return [roi_file]
+    
+    def add_recording_to_bundle(self, num, video_file, frame_times, frame_num=None, tracking_value=None):
+        """
+        Appends the timestamps, driver frame numbers, dropped frames and ROI values of a saved video to the camera
+        in the session bundle, with a record of the video file and its rows. Called from the writer thread on rollover.
+        """
+        bundle = self.session_bundle
+        group = f'cam{num}'
+        start = bundle.append(f'{group}/timestamps', np.asarray(frame_times, dtype='float64'))
+        if frame_num is not None:
+            bundle.append(f'{group}/frame_nums', np.asarray(frame_num, dtype='int64'))
+        bundle.append(f'{group}/dropped', get_dropped_frames(frame_num, frame_times, self.session_fps))
+        if tracking_value is not None:
+            bundle.append(f'{group}/rois/values', tracking_value['values'])
+            bundle.set_attrs(group, roi_names=tracking_value['names'].tolist(), rois=tracking_value['rois'].tolist())
+        bundle.add_record(group, video_file=os.path.basename(video_file), start=start, stop=start + len(frame_times))
+    
+    def add_calibration_to_bundle(self):
+        # the calibration of the setup at the time of the recording, if there is one
+        for file_name in ['calibration.toml', 'detections.pickle']:
+            self.session_bundle.add_file(os.path.join(self.dir_output.get(), file_name))
+    
+    def set_up_frame_trace(self, num):
+        if bool(self.trace_latency.get()):
+            self.cam[num].vid_file.enable_trace()
+        else:
+            self.cam[num].vid_file.disable_trace()
+    
+    def save_frame_trace(self, num, video_file=None, frame_num=None):
+        """
+        Saves the latency trace of the camera next to its video, as a Chrome trace and latency histograms.
+        With frame_num, only the frames of that video are saved, e.g. for a cycle file on rollover.
+        Returns the saved files.
+        """
+        trace = self.cam[num].vid_file.trace
+        if trace is None:
+            return []
+        video_file = self.vid_file[num] if video_file is None else video_file
+        if frame_num is not None:
+            trace = trace.copy_frames(frame_num)
+        trace.print_summary()
+        trace_file = video_file.replace('.avi', '_trace.json')
+        latency_file = video_file.replace('.avi', '_latency.json')
+        trace.save(trace_file, latency_file)
+        return [trace_file, latency_file]
+    
     def save_trigger_recording(self, compress=False, delete=False):
         """
         Save the trigger recording.
@@ -1559,16 +1938,21 @@ class CamGUI(object):
         frame_time_list = []
         for i in range(len(self.vid_out)):
             frame_times, frame_num, tracking_value = self.cam[i].release_video_file()
-            frame_times = [value - frame_times[0] for value in frame_times]
+            frame_times = frame_times - frame_times[0] if len(frame_times) > 0 else frame_times
             print(f'Cam {i} frame times size is {len(frame_times)}')
             frame_time_list.append(frame_times)
             if delete:
                 self.cam[i].delete_video_file()
             else:
-                np.save(str(self.ts_file[i]), np.array(frame_time_list[i]))
-                np.savetxt(str(self.ts_file_csv[i]), np.array(frame_time_list[i]), delimiter=",")
+                save_timestamps(frame_time_list[i], self.ts_file[i], self.ts_file_csv[i])
                 saved_files.append(self.vid_file[i])
                 saved_files.append(self.ts_file[i])
+                saved_files.extend(self.save_roi_values(i, tracking_value))
+                saved_files.extend(self.save_frame_trace(i, frame_num=frame_num))
+                self.add_recording_to_bundle(i, self.vid_file[i], frame_time_list[i], frame_num, tracking_value)
+                if compress:
+                    self.transcode_queue.add(self.vid_file[i])
+            remove_journal(self.vid_file[i])
             
             # Change label to show current file name
             self.video_file_status[i]['text'] = ""
@@ -1577,6 +1961,8 @@ class CamGUI(object):
         self.toggle_trigger_recording()
         
         if len(saved_files) > 0:
+            self.add_calibration_to_bundle()
+            saved_files.append(self.session_bundle.merge())
             if len(frame_times) > 1:
                 cam0_times = np.array(frame_time_list[0])
                 cam1_times = np.array(frame_time_list[1])
@@ -1622,6 +2008,8 @@ class CamGUI(object):
         root.geometry('500x500')
         root.configure(background='white')
         
+        # matplotlib is only imported once a plot is requested, it takes a large part of the startup time
+        from matplotlib import pyplot as plt
         fig, ax = plt.subplots()
 
         # Plot the error values
@@ -1659,10 +2047,20 @@ class CamGUI(object):
         root.mainloop()
 
     def display_recorded_stats(self):
+        for line in self.transcode_queue.get_progress():
+            print(f'Transcode {line}')
         self.plot_trigger_recording(self.frame_time_list)
  
     # endregion Trigger recording
     def close_window(self):
+        if self.metrics_server is not None:
+            self.metrics_server.stop()
+        # unfinished transcodes are resumed on the next start
+        self.transcode_queue.stop()
+        if self.marker_stream is not None:
+            self.marker_stream.stop()
+        if self.marker_bus is not None:
+            self.marker_bus.close()
 
         if not self.setup:
             self.done = True
@@ -1696,7 +2094,10 @@ class CamGUI(object):
                 grid(sticky="nsew", row=0, column=1)
             Button(select_cams_window, text="Set Cameras", command=select_cams_window.quit).\
                 grid(sticky="nsew", row=1, column=0, columnspan=2)
+            # the time spent in the dialog is not part of the startup time
+            dialog_start = time.perf_counter()
             select_cams_window.mainloop()
+            self.startup_wait += time.perf_counter() - dialog_start
             select_cams_window.destroy()
         else:
             self.number_of_cams_entry = "2"
@@ -1973,6 +2374,13 @@ class CamGUI(object):
             self.board_detected_count_label.append(Label(camera_status_frame, text="0", width=5))
             self.board_detected_count_label[i]. \
                 grid(row=0, column=3, sticky="nw", padx=5, pady=0)
+
+            # label for the fraction of the image covered by the detected corners
+            Label(camera_status_frame, text="Coverage: "). \
+                grid(row=0, column=4, sticky="w", padx=5, pady=0)
+            self.coverage_label.append(Label(camera_status_frame, text="0%", width=5))
+            self.coverage_label[i]. \
+                grid(row=0, column=5, sticky="nw", padx=5, pady=0)
             
             camera_status_frame. \
                 grid(row=cur_row, column=0, padx=2, pady=0, sticky="w")
@@ -2095,6 +2503,20 @@ class CamGUI(object):
             grid(sticky="nsew", row=2, column=1, columnspan=1, padx=5, pady=3)
         Hovertip(self.release_trigger_button, "Release trigger to if stuck in trigger mode")
         
+        # initialize all the cameras at once, optionally from the saved device states
+        self.init_all_cams_button = Button(setup_video_frame, text="Initialize All", command=self.init_all_cams, width=14)
+        self.init_all_cams_button.\
+            grid(sticky="nsew", row=3, column=0, padx=5, pady=3)
+        Hovertip(self.init_all_cams_button, "Initialize all the selected cameras at the same time")
+        self.save_camera_states_button = Button(setup_video_frame, text="Save Cam States", command=self.save_camera_states)
+        self.save_camera_states_button.\
+            grid(sticky="nsew", row=3, column=1, padx=5, pady=3)
+        Hovertip(self.save_camera_states_button, "Save the device state of the cameras to restore them at the next initialization")
+        self.use_camera_state = IntVar(value=0)
+        Checkbutton(setup_video_frame, text="Init From Saved States", variable=self.use_camera_state,
+                    onvalue=1, offvalue=0).\
+            grid(sticky="nsew", row=4, column=0, columnspan=2, padx=5, pady=3)
+        
         setup_video_frame.grid(row=cur_row, column=1, padx=2, pady=3, sticky="nsew")
 
         # record videos
@@ -2115,12 +2537,25 @@ class CamGUI(object):
                                                    onvalue=1, offvalue=0, width=13)
         self.force_frame_sync_button.grid(sticky="nsew", row=1, column=0, padx=5, pady=3)
         Hovertip(self.force_frame_sync_button, "Force frame sync for camera captured on threads")
+        
+        self.process_per_camera = IntVar(value=0)
+        self.process_per_camera_button = Checkbutton(record_video_frame, text="Process per Camera", variable=self.process_per_camera,
+                                                     onvalue=1, offvalue=0, width=13)
+        self.process_per_camera_button.grid(sticky="nsew", row=3, column=0, padx=5, pady=3)
+        Hovertip(self.process_per_camera_button, "Capture and write each camera in its own process, always frame synced")
 
         self.toggle_continuous_mode = IntVar(value=1)
         self.toggle_continuous_mode_button = Checkbutton(record_video_frame, text="Continuous Mode", variable=self.toggle_continuous_mode,
                                                          onvalue=1, offvalue=0, width=13)
         self.toggle_continuous_mode_button.grid(sticky="nsew", row=2, column=0, padx=5, pady=3)
         Hovertip(self.toggle_continuous_mode_button, "Toggle continuous mode during video recording")
+
+        self.track_markers = IntVar(value=0)
+        self.track_markers_button = Checkbutton(record_video_frame, text="Track Markers", variable=self.track_markers,
+                                                onvalue=1, offvalue=0, width=13)
+        self.track_markers_button.grid(sticky="nsew", row=4, column=0, padx=5, pady=3)
+        Hovertip(self.track_markers_button, "Triangulate the bright markers live with the calibration of the output directory, "
+                                            "saved next to the videos and sent to the marker port")
         
         # save videos
         self.release_vid0 = Button(record_video_frame, text="Save Video",
@@ -2175,6 +2610,25 @@ class CamGUI(object):
         self.display_trigger_recording_stats.grid(sticky="nsew", row=0, column=4, padx=5, pady=3)
         Hovertip(self.display_trigger_recording_stats, "Display stats of recorded videos")
 
+        self.trace_latency = IntVar(value=0)
+        self.trace_latency_button = Checkbutton(experimental_functions_frame, text="Trace Latency", variable=self.trace_latency,
+                                                onvalue=1, offvalue=0, width=13)
+        self.trace_latency_button.grid(sticky="nsew", row=1, column=1, padx=5, pady=3)
+        Hovertip(self.trace_latency_button, "Record the latency of every frame through the pipeline, saved next to the videos")
+        
+        rollover_frame = Frame(experimental_functions_frame)
+        Label(rollover_frame, text="Split every (min):").grid(row=0, column=0, sticky="w")
+        self.rollover_minutes = StringVar(value='')
+        self.rollover_minutes_entry = Entry(rollover_frame, textvariable=self.rollover_minutes, width=5)
+        self.rollover_minutes_entry.grid(row=0, column=1, padx=3)
+        Label(rollover_frame, text="Split gap (s):").grid(row=0, column=2, sticky="w")
+        self.rollover_gap = StringVar(value='')
+        self.rollover_gap_entry = Entry(rollover_frame, textvariable=self.rollover_gap, width=5)
+        self.rollover_gap_entry.grid(row=0, column=3, padx=3)
+        rollover_frame.grid(sticky="nsew", row=1, column=2, columnspan=3, padx=5, pady=3)
+        Hovertip(rollover_frame, "Split the trigger recording into cycle files without stopping it, after a duration and/or "
+                                 "at a gap between trigger trains. Leave empty to record into a single file")
+
         experimental_functions_frame.grid(row=cur_row, column=0, columnspan=3, padx=2, pady=3, sticky="nw")
         
         # Recording stats
@@ -2271,6 +2725,12 @@ class CamGUI(object):
                                                 onvalue=1, offvalue=0, width=8)
         self.reprojection_checkbutton.grid(sticky="nw", row=0, column=1, padx=0, pady=0)
         
+        # preview undistorted with the loaded calibration, the reprojection is always drawn on the raw frames
+        self.undistort_check = IntVar(value=0)
+        self.undistort_checkbutton = Checkbutton(test_calibration_frame, text="Undistort", variable=self.undistort_check,
+                                                 onvalue=1, offvalue=0, width=8)
+        self.undistort_checkbutton.grid(sticky="nw", row=0, column=2, padx=0, pady=0)
+        
         test_calibration_frame.grid(row=1, column=4, padx=5, pady=3, sticky="nsew")
         
         calibration_frame.grid(row=cur_row, column=0, columnspan=2, padx=2, pady=3, sticky="nsew")
@@ -2313,6 +2773,43 @@ class CamGUI(object):
         
         self.close_button = Button(self.window, text="Close", command=self.close_window)
         self.close_button.grid(sticky="nsew", row=cur_row + 1, column=1)
+        
+        if self.startup_profiler is not None:
+            self.window.after_idle(self.report_startup)
+        if self.warm_up:
+            self.window.after(1000, self.warm_up_calibration)
+
+    def report_startup(self, n_stats=25):
+        """Prints the time until the window is usable and the slowest calls of the startup"""
+        self.startup_profiler.disable()
+        startup_time = time.perf_counter() - self.startup_start - self.startup_wait
+        print(f'Modules imported in {_imports_end - _imports_start:.2f} s, window usable {startup_time:.2f} s later '
+              f'({self.startup_wait:.2f} s in the camera selection dialog not included)')
+        print('Run with python -X importtime for the import time of each module')
+        
+        stats = pstats.Stats(self.startup_profiler)
+        stats.sort_stats('cumulative').print_stats(n_stats)
+        profile_file = os.path.abspath('camgui_startup.prof')
+        stats.dump_stats(profile_file)
+        print(f'Startup profile saved to {profile_file}')
+        self.startup_profiler = None
+
+    def warm_up_calibration(self):
+        """Imports the calibration library and compiles its numba functions in a background thread,
+        so the first calibration does not wait for them"""
+        if self.warm_up_thread is not None:
+            return
+        
+        def warm_up():
+            try:
+                from src.aniposelib.cameras import warm_up
+                print(f'Calibration functions compiled in {warm_up():.2f} s')
+            except Exception as e:
+                print('Calibration warm up failed:', type(e).__name__, e)
+        
+        self.warm_up_thread = threading.Thread(target=warm_up, name='Calibration warm up', daemon=True)
+        self.warm_up_thread.start()
+
     def runGUI(self):
         self.window.mainloop()
 
@@ -2327,9 +2824,26 @@ if __name__ == "__main__":
                         help="Disable camera initialization")
     parser.add_argument("-t", "--test", action="store_true", dest="test_mode", help="Enable test mode")
     parser.add_argument("-odir", "--output-dir", action="store", dest="output_dir", type=str, default=None, help="Output directory for video recording")
+    parser.add_argument("-p", "--profile-startup", action="store_true", dest="profile_startup",
+                        help="Report the startup time and save a profile of the startup")
+    parser.add_argument("-m", "--metrics-port", action="store", dest="metrics_port", type=int, default=None,
+                        help="Serve the recording metrics on http://127.0.0.1:<port>/metrics")
+    parser.add_argument("-l", "--log-level", action="append", dest="log_levels", default=[], metavar="SUBSYSTEM=LEVEL",
+                        help="Level of the asynchronous log of a subsystem, e.g. camera=DEBUG or calibration.capture=WARNING")
+    parser.add_argument("-nw", "--no-warm-up", action="store_false", dest="warm_up",
+                        help="Do not compile the calibration functions in the background after startup")
+    parser.add_argument("-tw", "--transcode-workers", type=int, default=1,
+                        help="Number of videos compressed at the same time")
+    parser.add_argument("-ds", "--delete-after-transcode", action="store_true",
+                        help="Delete the .avi files once they are compressed and verified")
+    parser.add_argument("-mp", "--marker-port", action="store", dest="marker_port", type=int, default=9465,
+                        help="Send the live markers as JSON datagrams to udp://127.0.0.1:<port>")
 
     # Parse the command-line arguments
     args = parser.parse_args()
+    for log_level in args.log_levels:
+        subsystem, _, level = log_level.partition('=')
+        async_log.set_level(subsystem, level)
 
     try:
         if args.test_mode:
@@ -2344,9 +2858,17 @@ if __name__ == "__main__":
             try:
                 
                 if args.output_dir is not None:
-                    cam_gui = CamGUI(debug_mode=args.debug_mode, init_cam_bool=args.init_cam_bool, output_dir=args.output_dir)
+                    cam_gui = CamGUI(debug_mode=args.debug_mode, init_cam_bool=args.init_cam_bool, output_dir=args.output_dir,
+                                     profile_startup=args.profile_startup, warm_up=args.warm_up,
+                                     metrics_port=args.metrics_port, transcode_workers=args.transcode_workers,
+                                     delete_after_transcode=args.delete_after_transcode,
+                                     marker_port=args.marker_port)
                 else:
-                    cam_gui = CamGUI(debug_mode=args.debug_mode, init_cam_bool=args.init_cam_bool)
+                    cam_gui = CamGUI(debug_mode=args.debug_mode, init_cam_bool=args.init_cam_bool,
+                                     profile_startup=args.profile_startup, warm_up=args.warm_up,
+                                     metrics_port=args.metrics_port, transcode_workers=args.transcode_workers,
+                                     delete_after_transcode=args.delete_after_transcode,
+                                     marker_port=args.marker_port)
                 cam_gui.runGUI()
             except Exception as e:
                 print("Error creating CamGUI instance: %s" % str(e))
@@ -0,0 +1,98 @@
+"""
+Tiled preview of all cameras at display resolution
+
+Instead of concatenating the full resolution frames of every camera and letting the window
+scale them down, each frame is resized straight into its tile of a preallocated mosaic.
+Overlays are then drawn at the tile scale, and the refresh rate is capped independently of
+the capture rate, so the cost of the preview does not grow with the number of cameras.
+"""
+import math
+import time
+
+import cv2
+import numpy as np
+
+
+class PreviewCompositor:
+    def __init__(self, frame_shapes, width=2160, height=660, max_fps=15, n_cols=None):
+        """
+        Params
+        ------
+        frame_shapes = list of tuples; shape of the frames of each camera
+        width, height = int; size of the mosaic, which should match the size of the window
+        max_fps = float; maximum refresh rate of the preview
+        n_cols = int; number of tiles per row, by default all cameras are in one row
+            up to 4 cameras and in a square grid for more
+        """
+        n_cams = len(frame_shapes)
+        if n_cols is None:
+            n_cols = n_cams if n_cams <= 4 else math.ceil(math.sqrt(n_cams))
+        n_rows = math.ceil(n_cams / n_cols)
+
+        self.width = width
+        self.height = height
+        self.min_interval = 1.0 / max_fps if max_fps else 0
+        self.last_shown = 0
+        self.mosaic = np.zeros((height, width, 3), dtype='uint8')
+
+        tile_width = width // n_cols
+        tile_height = height // n_rows
+        self.tiles = []
+        self.scales = []
+        self.gray_buffers = []
+        for i, shape in enumerate(frame_shapes):
+            frame_height, frame_width = shape[:2]
+            scale = min(tile_width / frame_width, tile_height / frame_height)
+            w = max(1, int(frame_width * scale))
+            h = max(1, int(frame_height * scale))
+
+            # each tile is a view of the mosaic, centered in its cell
+            x = (i % n_cols) * tile_width + (tile_width - w) // 2
+            y = (i // n_cols) * tile_height + (tile_height - h) // 2
+            self.tiles.append(self.mosaic[y:y + h, x:x + w])
+            self.scales.append(scale)
+
+            is_gray = len(shape) == 2 or shape[2] == 1
+            self.gray_buffers.append(np.zeros((h, w), dtype='uint8') if is_gray else None)
+
+    def wait_refresh(self):
+        """Sleeps until the next refresh of the preview is due."""
+        remaining = self.last_shown + self.min_interval - time.perf_counter()
+        if remaining > 0:
+            time.sleep(remaining)
+
+    def render(self, frames):
+        """Resizes the frame of every camera into its tile. Returns the mosaic."""
+        # the text of the previous refresh may be in the gaps around the tiles, which no frame overwrites
+        self.mosaic.fill(0)
+        for tile, gray_buffer, frame in zip(self.tiles, self.gray_buffers, frames):
+            size = (tile.shape[1], tile.shape[0])
+            if gray_buffer is None:
+                cv2.resize(frame, size, dst=tile, interpolation=cv2.INTER_AREA)
+            else:
+                cv2.resize(frame.reshape(frame.shape[:2]), size, dst=gray_buffer, interpolation=cv2.INTER_AREA)
+                cv2.cvtColor(gray_buffer, cv2.COLOR_GRAY2BGR, dst=tile)
+        return self.mosaic
+
+    def scale_points(self, num, points):
+        """Scales image points of a camera to the coordinates of its tile, as an (N, 1, 2) array."""
+        return (np.asarray(points, dtype='float32').reshape(-1, 1, 2) * self.scales[num]).astype('float32')
+
+    def draw_corners(self, num, corners, ids=None, color=(0, 255, 0)):
+        """Draws charuco corners given in full resolution image coordinates on the tile of a camera."""
+        corners = self.scale_points(num, corners)
+        if ids is not None:
+            ids = np.asarray(ids).reshape(-1, 1)
+        cv2.aruco.drawDetectedCornersCharuco(self.tiles[num], corners, ids, cornerColor=color)
+
+    def put_text(self, text, org, color, font_scale=1.5, thickness=1):
+        cv2.putText(self.mosaic, text, org, cv2.FONT_HERSHEY_SIMPLEX, font_scale, color, thickness)
+
+    def put_tile_text(self, num, text, org, color, font_scale=0.8, thickness=1):
+        """Writes text on the tile of a camera, org is relative to the tile."""
+        cv2.putText(self.tiles[num], text, org, cv2.FONT_HERSHEY_SIMPLEX, font_scale, color, thickness)
+
+    def show(self, window_name):
+        cv2.imshow(window_name, self.mosaic)
+        cv2.waitKey(1)
+        self.last_shown = time.perf_counter()
@@ -5,9 +5,7 @@ class CamGUI_Tests(CamGUI):
         super().__init__(debug_mode, init_cam_bool)
         
     def init_cams(self):
-        for i, button in enumerate(self.camera_init_button):
-            time.sleep(1)
-            button.invoke()
+        self.init_all_cams_button.invoke()
             
     def show_calibration_live(self):
         time.sleep(1)
@@ -0,0 +1,48 @@
+"""
+Shared fixtures of the tests
+
+camera_control imports the modules of src.camera_control on the simulated camera driver, and drops them
+again after the test, so each test gets modules bound to its own simulated driver.
+"""
+import numpy as np
+import pytest
+
+from simulated_driver import SimulatedGrabber, drop_camera_control_modules, import_module, install
+from src.aniposelib.cameras import Camera, CameraGroup
+
+
+@pytest.fixture
+def grabber(monkeypatch):
+    """The simulated driver, with only the calls of the test in calls."""
+    monkeypatch.setattr(SimulatedGrabber, 'calls', [])
+    return SimulatedGrabber
+
+
+@pytest.fixture
+def camera_control(grabber):
+    """Returns a function importing a module of src.camera_control with the simulated driver,
+    e.g. camera_control('frame_bus')."""
+    install(grabber)
+    yield import_module
+    drop_camera_control_modules()
+
+
+@pytest.fixture
+def ic_camera(camera_control):
+    return camera_control('ic_camera')
+
+
+@pytest.fixture
+def camera_group():
+    """Four cameras around the z axis, 400 away from the origin."""
+    n_cams = 4
+    cameras = []
+    for i in range(n_cams):
+        angle = 2 * np.pi * i / n_cams
+        cameras.append(Camera(matrix=[[1200, 0, 640], [0, 1200, 512], [0, 0, 1]],
+                              dist=[-0.1, 0.05, 0, 0, 0],
+                              size=(1280, 1024),
+                              rvec=[0.1 * np.cos(angle), 0.1 * np.sin(angle), 0.05 * i],
+                              tvec=[30 * np.cos(angle), 30 * np.sin(angle), 400],
+                              name=str(i)))
+    return CameraGroup(cameras)
@@ -0,0 +1,96 @@
+"""
+Simulated camera driver of the tests
+
+The package src.camera_control imports the camera driver (tisgrabber), which only loads on Windows.
+install() puts SimulatedGrabber in its place, in the test process or in a process started by a test.
+"""
+import importlib
+import sys
+import time
+import types
+
+
+class SimulatedGrabber:
+    """Stands in for tisgrabber.TIS_CAM, with driver call latencies in the range of a USB3 camera.
+    Every call is recorded in calls."""
+    LATENCY = {'GetDevices': 0.05, 'open': 0.4, 'close': 0.1, 'StartLive': 0.05, 'StopLive': 0.03,
+               'SuspendLive': 0.01, 'SetVideoFormat': 0.02, 'SetFrameRate': 0.005,
+               'LoadDeviceStateFromFile': 0.45, 'SetPropertyAbsoluteValue': 0.02}
+    calls = []
+    # state in which the simulated driver accepts a new video format
+    format_states = ('opened', 'suspended', 'stopped')
+
+    def __init__(self):
+        self.state = 'closed'
+
+    def _call(self, name, result=1):
+        self.calls.append(name)
+        time.sleep(self.LATENCY.get(name, 0.001))
+        return result
+
+    def GetDevices(self):
+        return self._call('GetDevices', [f'DMK 37BUX287 {i}'.encode() for i in range(6)])
+
+    def open(self, name):
+        self.state = 'opened'
+        return self._call('open')
+
+    def close(self):
+        self.state = 'closed'
+        return self._call('close')
+
+    def StartLive(self, showlive=1):
+        self.state = 'live'
+        return self._call('StartLive')
+
+    def StopLive(self):
+        self.state = 'stopped'
+        return self._call('StopLive')
+
+    def SuspendLive(self):
+        if self.state == 'live':
+            self.state = 'suspended'
+        return self._call('SuspendLive')
+
+    def SetVideoFormat(self, Format):
+        return self._call('SetVideoFormat', int(self.state in self.format_states))
+
+    def SaveDeviceStateToFile(self, FileName):
+        with open(FileName, 'w') as f:
+            f.write('<device_state/>')
+        return self._call('SaveDeviceStateToFile')
+
+    def LoadDeviceStateFromFile(self, FileName):
+        self.state = 'opened'
+        return self._call('LoadDeviceStateFromFile', None)
+
+    def GetVideoFormatWidth(self):
+        return self._call('GetVideoFormatWidth', 640)
+
+    def GetVideoFormatHeight(self):
+        return self._call('GetVideoFormatHeight', 480)
+
+    def GetAvailableFrameRates(self):
+        return self._call('GetAvailableFrameRates', [15.0, 30.0, 60.0, 120.0])
+
+    def __getattr__(self, name):
+        return lambda *args, **kwargs: self._call(name)
+
+
+def drop_camera_control_modules():
+    for name in list(sys.modules):
+        if name == 'src.camera_control' or name.startswith('src.camera_control.'):
+            del sys.modules[name]
+
+
+def install(grabber=SimulatedGrabber):
+    """Puts the simulated driver in place of tisgrabber, for the modules of src.camera_control imported next."""
+    drop_camera_control_modules()
+    tisgrabber = types.ModuleType('src.camera_control.tisgrabber')
+    tisgrabber.TIS_CAM = grabber
+    sys.modules['src.camera_control.tisgrabber'] = tisgrabber
+    return tisgrabber
+
+
+def import_module(name):
+    return importlib.import_module(f'src.camera_control.{name}')
@@ -0,0 +1,69 @@
+import io
+
+import pytest
+
+
+@pytest.fixture
+def async_log(camera_control):
+    return camera_control('async_log')
+
+
+def make_log(async_log, **kwargs):
+    # the writer thread waits longer than the test, the records are flushed by hand
+    stream = io.StringIO()
+    return async_log.AsyncLog(stream=stream, flush_interval=60, **kwargs), stream
+
+
+def test_level_filtering(async_log):
+    log, stream = make_log(async_log)
+    callback = async_log.SubsystemLogger(log, 'camera.callback')
+    other = async_log.SubsystemLogger(log, 'calibration')
+    callback.debug('hidden %d', 1)
+    callback.info('frame %d', 2)
+    assert callback.is_enabled(async_log.INFO) and not callback.is_enabled(async_log.DEBUG)
+
+    # a level applies to the children of the subsystem, and replaces the cached ones
+    log.set_level('camera', async_log.WARNING)
+    callback.info('hidden %d', 3)
+    callback.warning('late frame %d', 4)
+    other.info('board %d', 5)
+    log.set_level('camera.callback', async_log.DEBUG)
+    callback.debug('frame %d', 6)
+    assert log.get_level('camera') == async_log.WARNING
+    log.close()
+
+    assert stream.getvalue().splitlines() == [
+        '[camera.callback] INFO: frame 2',
+        '[camera.callback] WARNING: late frame 4',
+        '[calibration] INFO: board 5',
+        '[camera.callback] DEBUG: frame 6',
+    ]
+
+
+def test_ring_overflow(async_log):
+    log, stream = make_log(async_log, capacity=8, rate_limit=0)
+    logger = async_log.SubsystemLogger(log, 'camera.callback')
+    for i in range(20):
+        logger.info('frame %d', i)
+    log.flush()
+    lines = stream.getvalue().splitlines()
+    # the writer skips to the oldest record still in the ring and reports the ones lapped
+    written = [int(line.rsplit(' ', 1)[1]) for line in lines if line.startswith('[camera.callback]')]
+    assert written == list(range(16, 20))
+    assert lines[-1] == '[log] 16 messages were dropped, the log ring is full'
+
+    # the ring keeps working after the overflow
+    logger.info('frame %d', 20)
+    log.close()
+    assert stream.getvalue().splitlines()[len(lines):] == ['[camera.callback] INFO: frame 20']
+
+
+def test_rate_limit(async_log):
+    log, stream = make_log(async_log, rate_limit=3, rate_interval=0)
+    logger = async_log.SubsystemLogger(log, 'camera.callback')
+    for i in range(10):
+        logger.warning('overrun %d', i)
+    log.close()
+    lines = stream.getvalue().splitlines()
+    assert lines[:3] == [f'[camera.callback] WARNING: overrun {i}' for i in range(3)]
+    assert lines[3:] == ['[camera.callback] suppressed 7 more messages like: overrun %d']
@@ -0,0 +1,99 @@
+import numpy as np
+
+from src.aniposelib.cameras import get_error_dict, remap_ids, resample_points, resample_points_extra
+
+
+def make_points(n_cams=5, n_boards=60, n_corners=12, seed=0):
+    rng = np.random.default_rng(seed)
+    imgp = rng.uniform(0, 1000, (n_cams, n_boards * n_corners, 2))
+    # every board is seen by a random subset of the cameras, a few corners are missed
+    seen = np.repeat(rng.random((n_cams, n_boards)) < 0.6, n_corners, axis=1)
+    seen &= rng.random(seen.shape) < 0.9
+    imgp[~seen] = np.nan
+    ids = np.repeat(rng.permutation(n_boards) * 7 + 3, n_corners).astype('int32')
+    extra = {'objp': rng.random((len(ids), 3)), 'ids': ids,
+             'rvecs': rng.random((n_cams, len(ids), 3)), 'tvecs': rng.random((n_cams, len(ids), 3))}
+    return imgp, extra
+
+
+def test_remap_ids():
+    ids = np.array([30, 5, 30, 12, 5], dtype='int32')
+    remapped = remap_ids(ids)
+    assert remapped.tolist() == [2, 0, 2, 1, 0] and remapped.dtype == ids.dtype
+    remapped = remap_ids(np.array([4.0, np.nan, 1.0, 4.0]))
+    assert np.array_equal(remapped, [1, np.nan, 0, 1], equal_nan=True)
+
+
+def test_error_dict_matches_percentiles():
+    rng = np.random.default_rng(1)
+    errors_full = rng.normal(0, 2, (4, 500, 2))
+    errors_full[rng.random((4, 500)) < 0.4] = np.nan
+    errors_full[3, :495] = np.nan
+
+    error_dict = get_error_dict(errors_full)
+    errors_norm = np.linalg.norm(errors_full, axis=2)
+    good = ~np.isnan(errors_full[:, :, 0])
+    expected = dict()
+    for i in range(4):
+        for j in range(i + 1, 4):
+            subset = good[i] & good[j]
+            if np.sum(subset) > 10:
+                expected[(i, j)] = (np.sum(subset), np.percentile(np.mean(errors_norm[[i, j]][:, subset], axis=0), [15, 75]))
+    assert error_dict.keys() == expected.keys()
+    for pair, (count, percents) in expected.items():
+        assert error_dict[pair][0] == count
+        assert np.allclose(error_dict[pair][1], percents)
+
+
+def test_resample_points():
+    imgp, extra = make_points()
+    good = ~np.isnan(imgp[:, :, 0])
+    num_cams = np.sum(good, axis=0)
+
+    newp, new_extra = resample_points(imgp, extra, n_samp=25, rng=0)
+    same_p, _ = resample_points(imgp, extra, n_samp=25, rng=0)
+    assert np.array_equal(newp, same_p, equal_nan=True)
+
+    # each pair keeps its 25 points seen by the most cameras
+    picked = np.isin(np.arange(imgp.shape[1]), np.flatnonzero(np.isin(extra['objp'][:, 0], new_extra['objp'][:, 0])))
+    for i in range(len(imgp)):
+        for j in range(i + 1, len(imgp)):
+            subset = good[i] & good[j]
+            n_picked = min(25, np.sum(subset))
+            assert np.sum(subset & picked) >= n_picked
+            threshold = np.sort(num_cams[subset])[::-1][n_picked - 1]
+            assert np.all(picked[subset & (num_cams > threshold)])
+    assert np.array_equal(newp, imgp[:, picked], equal_nan=True)
+    assert np.array_equal(new_extra['rvecs'], extra['rvecs'][:, picked])
+
+    # enough samples keep every point seen by two cameras
+    newp, _ = resample_points(imgp, n_samp=imgp.shape[1], rng=0)
+    assert np.array_equal(newp, imgp[:, num_cams >= 2], equal_nan=True)
+
+
+def test_resample_points_extra():
+    imgp, extra = make_points()
+    good = ~np.isnan(imgp[:, :, 0])
+    newp, new_extra = resample_points_extra(imgp, extra, n_samp=40, rng=0)
+
+    # whole boards are kept, until every camera has its samples or runs out of boards
+    kept = np.isin(extra['ids'], new_extra['ids'])
+    assert np.array_equal(newp, imgp[:, kept], equal_nan=True)
+    assert np.all(np.sum(good[:, kept], axis=1) >= np.minimum(40, np.sum(good, axis=1)))
+    assert len(np.unique(new_extra['ids'])) < len(np.unique(extra['ids']))
+
+
+def test_resample_points_extra_float_ids():
+    imgp, extra = make_points()
+    newp, new_extra = resample_points_extra(imgp, extra, n_samp=40, rng=0)
+
+    # the same boards with float ids, e.g. loaded from a file, and a few points without a board
+    float_extra = dict(extra, ids=extra['ids'].astype('float64'))
+    float_p, float_new_extra = resample_points_extra(imgp, float_extra, n_samp=40, rng=0)
+    assert np.array_equal(float_p, newp, equal_nan=True)
+    assert np.array_equal(float_new_extra['ids'], new_extra['ids'])
+
+    float_extra['ids'][:5] = np.nan
+    float_p, float_new_extra = resample_points_extra(imgp, float_extra, n_samp=40, rng=0)
+    assert not np.any(np.isnan(float_new_extra['ids']))
+    assert np.array_equal(float_p, imgp[:, np.isin(float_extra['ids'], float_new_extra['ids'])], equal_nan=True)
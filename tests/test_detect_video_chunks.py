@@ -0,0 +1,127 @@
+import pickle
+
+import cv2
+import numpy as np
+import pytest
+
+from src.aniposelib.boards import CharucoBoard, VideoFrameReader, split_video_chunks, stitch_video_chunks
+
+
+def make_calibration_video(fname, n_frames=120):
+    board = CharucoBoard(5, 4, 25, 18.75, 4, 50)
+    img = board.board.generateImage((500, 400))
+    img = cv2.copyMakeBorder(img, 40, 40, 40, 40, cv2.BORDER_CONSTANT, value=255)
+
+    rng = np.random.default_rng(0)
+    show = np.zeros(n_frames, dtype='bool')
+    for start in rng.integers(0, n_frames, 8):
+        show[start:start + rng.integers(1, 30)] = True
+
+    out = cv2.VideoWriter(fname, cv2.VideoWriter_fourcc(*'MJPG'), 30, (img.shape[1], img.shape[0]))
+    for i in range(n_frames):
+        frame = img if show[i] else np.full_like(img, 128)
+        out.write(cv2.cvtColor(frame, cv2.COLOR_GRAY2BGR))
+    out.release()
+    return board
+
+
+def test_chunked_detection_matches_detect_video(tmp_path):
+    vidname = str(tmp_path / 'calibration.avi')
+    board = make_calibration_video(vidname)
+
+    for skip in [20, 6]:
+        rows = board.detect_video(vidname, prefix=0, skip=skip)
+        assert len(rows) > 0
+
+        for chunk_size in [7, 45]:
+            chunks = [board.detect_video_range(vidname, start, end, skip=skip)
+                      for start, end in split_video_chunks(120, chunk_size)]
+            rows_chunked = stitch_video_chunks(board, vidname, chunks, prefix=0, skip=skip)
+            assert [r['framenum'] for r in rows_chunked] == [r['framenum'] for r in rows]
+
+
+def detect_video_serial(board, vidname, skip=20):
+    # the detection loop of detect_video, reading every frame with cap.read()
+    cap = cv2.VideoCapture(vidname)
+    rows = []
+    go = int(skip / 2)
+    framenum = 0
+    while True:
+        ret, frame = cap.read()
+        if not ret:
+            break
+        if framenum % skip == 0 or go > 0:
+            corners, ids = board.detect_image(frame)
+            if corners is not None and len(corners) > 0:
+                go = int(skip / 2)
+                rows.append({'framenum': (0, framenum), 'corners': corners, 'ids': ids})
+            go = max(0, go - 1)
+        framenum += 1
+    cap.release()
+    return board.fill_points_rows(rows)
+
+
+def test_frame_reader_matches_serial_detection(tmp_path, monkeypatch):
+    vidname = str(tmp_path / 'calibration.avi')
+    board = make_calibration_video(vidname)
+
+    detect_image = board.detect_image
+
+    def detect_image_not_skipped(frame):
+        # a frame the loop needs is never handed out as skipped
+        assert frame is not None
+        return detect_image(frame)
+
+    for skip in [20, 6]:
+        expected = detect_video_serial(board, vidname, skip=skip)
+        monkeypatch.setattr(board, 'detect_image', detect_image_not_skipped)
+        for _ in range(2):
+            rows = board.detect_video(vidname, prefix=0, skip=skip)
+            assert [r['framenum'] for r in rows] == [r['framenum'] for r in expected]
+            for row, row_expected in zip(rows, expected):
+                np.testing.assert_array_equal(row['corners'], row_expected['corners'])
+        monkeypatch.undo()
+
+
+class FailingCapture:
+    # a capture whose backend fails after a few frames, like a corrupt file
+    def __init__(self, fail_at):
+        self.fail_at = fail_at
+        self.framenum = 0
+
+    def grab(self):
+        if self.framenum == self.fail_at:
+            raise cv2.error('corrupt frame')
+        self.framenum += 1
+        return True
+
+    def retrieve(self):
+        return True, np.zeros((4, 4, 3), dtype='uint8')
+
+
+def test_frame_reader_forwards_read_errors():
+    reader = VideoFrameReader(FailingCapture(fail_at=3), 0, 100, skip=1, maxsize=1).start_reading()
+    try:
+        for framenum in range(3):
+            assert reader.read()[0] == framenum
+            reader.done(framenum, False)
+        with pytest.raises(cv2.error):
+            reader.read()
+    finally:
+        reader.stop()
+    assert not reader.thread.is_alive()
+
+
+def test_pickled_board_keeps_a_custom_dictionary():
+    # the board is pickled to the detection workers with n_jobs > 1
+    dictionary = cv2.aruco.extendDictionary(12, 5)
+    board = CharucoBoard(5, 4, 25, 18.75, aruco_dict=dictionary)
+    img = cv2.copyMakeBorder(board.board.generateImage((500, 400)), 40, 40, 40, 40, cv2.BORDER_CONSTANT, value=255)
+    corners, ids = board.detect_image(img)
+    assert len(ids) == 12
+
+    unpickled = pickle.loads(pickle.dumps(board))
+    np.testing.assert_array_equal(unpickled.dictionary.bytesList, dictionary.bytesList)
+    unpickled_corners, unpickled_ids = unpickled.detect_image(img)
+    np.testing.assert_array_equal(unpickled_ids, ids)
+    np.testing.assert_allclose(unpickled_corners, corners)
@@ -0,0 +1,87 @@
+import os
+import time
+
+import numpy as np
+
+from src.aniposelib.boards import CharucoBoard
+from src.aniposelib.cache import DetectionCache
+
+
+def make_rows(n_rows, seed=0):
+    rng = np.random.default_rng(seed)
+    rows = []
+    for framenum in range(n_rows):
+        ids = np.sort(rng.choice(12, 6, replace=False)).reshape(-1, 1).astype('int32')
+        corners = rng.uniform(0, 500, (6, 1, 2)).astype('float32')
+        rows.append({'framenum': (0, framenum * 3), 'corners': corners, 'ids': ids})
+    return rows
+
+
+def write_video(fname, n_bytes):
+    # only the size and modification time of the file are used
+    with open(fname, 'wb') as f:
+        f.write(os.urandom(n_bytes))
+    return str(fname)
+
+
+def test_get_and_put(tmp_path):
+    board = CharucoBoard(5, 4, 25, 18.75, 4, 50)
+    cache = DetectionCache(str(tmp_path / 'cache'))
+    vidname = write_video(tmp_path / 'cam0.avi', 1000)
+
+    assert cache.get(vidname, board) is None
+    rows = make_rows(5)
+    cache.put(vidname, board, rows)
+    cached = cache.get(vidname, board, prefix=0)
+    assert [r['framenum'] for r in cached] == [r['framenum'] for r in rows]
+    for row, row_cached in zip(rows, cached):
+        np.testing.assert_array_equal(row['corners'], row_cached['corners'])
+        np.testing.assert_array_equal(row['ids'], row_cached['ids'])
+        assert 'filled' in row_cached
+    assert cache.get(vidname, board)[0]['framenum'] == 0
+
+    # another board or other detection parameters do not use the entry
+    assert cache.get(vidname, CharucoBoard(5, 4, 25, 18.75, 4, 100)) is None
+    assert cache.get(vidname, board, skip=10) is None
+
+    # a changed video is detected again, and its stale entry is replaced on put
+    write_video(vidname, 1200)
+    assert cache.get(vidname, board) is None
+    cache.put(vidname, board, make_rows(2))
+    assert len(cache.get(vidname, board)) == 2
+    assert len(cache.get_entries()) == 1
+
+    cache.invalidate(vidname)
+    assert cache.get(vidname, board) is None
+
+
+def test_eviction(tmp_path):
+    board = CharucoBoard(5, 4, 25, 18.75, 4, 50)
+    cache = DetectionCache(str(tmp_path / 'cache'), max_size=None)
+    vidnames = [write_video(tmp_path / f'cam{i}.avi', 1000) for i in range(3)]
+    for i, vidname in enumerate(vidnames):
+        cache.put(vidname, board, make_rows(50, seed=i))
+        time.sleep(0.05)
+    entry_size = cache.get_size() / 3
+
+    # an entry being written by another process is neither counted nor removed
+    tmp_entry = tmp_path / 'cache' / ('0' * 16 + '_' + '1' * 16 + '.tmp.npz')
+    tmp_entry.write_bytes(b'partial')
+    assert len(cache.get_entries()) == 3
+
+    # the least recently used entry goes first
+    time.sleep(0.05)
+    assert cache.get(vidnames[0], board) is not None
+    cache.max_size = entry_size * 2.5
+    cache.evict()
+    assert cache.get(vidnames[1], board) is None
+    assert cache.get(vidnames[0], board) is not None and cache.get(vidnames[2], board) is not None
+
+    # an entry bigger than the whole cache is not stored, and does not evict the others
+    cache.max_size = entry_size * 2.5
+    assert cache.put(vidnames[1], board, make_rows(1000)) is None
+    assert cache.get(vidnames[1], board) is None
+    assert len(cache.get_entries()) == 2
+
+    cache.clear()
+    assert cache.get_entries() == [] and tmp_entry.exists()
@@ -0,0 +1,108 @@
+import importlib
+import sys
+import threading
+import time
+
+import numpy as np
+import pytest
+
+
+@pytest.fixture
+def frame_bus(camera_control):
+    return camera_control('frame_bus')
+
+
+def make_frame(value, shape=(4, 6)):
+    return np.full(shape, value, dtype='uint8')
+
+
+def test_generations_and_stale_sets(frame_bus):
+    bus = frame_bus.FrameBus([(4, 6), (4, 6)])
+    try:
+        assert bus.acquire_latest() is None
+        assert bus.publish(0, make_frame(1), 0, frame_count=10, frame_time=1.0) is False
+        assert bus.acquire_latest() is None
+        assert bus.publish(1, make_frame(2), 0, frame_count=11, frame_time=1.5) is True
+
+        with bus.acquire_latest() as frame_set:
+            assert frame_set.generation == 0
+            assert [int(frame[0, 0]) for frame in frame_set.frames] == [1, 2]
+            assert frame_set.frame_counts.tolist() == [10, 11]
+            assert frame_set.frame_times.tolist() == [1.0, 1.5]
+        assert bus.acquire_latest(after=0) is None
+
+        # a generation older than the latest complete set is dropped
+        assert bus.publish(0, make_frame(3), 2) is False
+        assert bus.publish(1, make_frame(4), 2) is True
+        assert bus.publish(0, make_frame(5), 1) is None
+        # an incomplete generation is overwritten by newer ones
+        for generation in range(3, 8):
+            bus.publish(0, make_frame(generation), generation)
+        with bus.acquire_latest() as frame_set:
+            assert frame_set.generation == 2
+
+        # a frame of the wrong shape raises, and does not leave its buffer pinned
+        with pytest.raises(ValueError):
+            bus.publish(1, make_frame(0, shape=(5, 5)), 8)
+        assert bus.pins.tolist() == [0, 0, 0]
+    finally:
+        bus.close()
+
+
+def test_pinned_sets_are_not_overwritten(frame_bus):
+    bus = frame_bus.FrameBus([(4, 6), (4, 6)])
+    try:
+        bus.publish(0, make_frame(1), 0)
+        bus.publish(1, make_frame(1), 0)
+        frame_set = bus.acquire_latest()
+        for generation in range(1, 20):
+            bus.publish(0, make_frame(generation + 1), generation)
+            bus.publish(1, make_frame(generation + 1), generation)
+            assert bus.acquire_latest(after=generation - 1).release() is None
+        assert [int(frame[0, 0]) for frame in frame_set.frames] == [1, 1]
+        frame_set.release()
+        with bus.acquire_latest() as frame_set:
+            assert frame_set.generation == 19
+    finally:
+        bus.close()
+
+
+def test_close_waits_for_the_held_sets(frame_bus):
+    bus = frame_bus.FrameBus([(4, 6)])
+    bus.publish(0, make_frame(1), 0)
+    frame_set = bus.acquire_latest()
+
+    def hold():
+        time.sleep(0.1)
+        frame_set.release()
+
+    thread = threading.Thread(target=hold)
+    thread.start()
+    start = time.perf_counter()
+    bus.close()
+    assert time.perf_counter() - start >= 0.09
+    thread.join()
+    assert bus.publish(0, make_frame(2), 1) is None
+    assert bus.acquire_latest() is None
+    # closing again and releasing after the close are harmless
+    bus.close()
+    bus.release(0)
+
+
+def test_camera_threads_skip_frames_the_bus_cannot_take(frame_bus, monkeypatch):
+    calibration_func = importlib.import_module('src.gui._calibration_func')
+    warnings = []
+    monkeypatch.setattr(calibration_func.bus_log, 'warning', lambda msg, *args: warnings.append(msg % args))
+    bus = frame_bus.FrameBus([(4, 6), (4, 6)])
+    try:
+        # a frame of another format, e.g. after the format of the camera changed
+        calibration_func.publish_frame(bus, 0, make_frame(1, shape=(8, 6)), 1, frame_count=1)
+        assert len(warnings) == 1 and warnings[0].startswith('Frame 1 of cam 0 not published: ValueError')
+        calibration_func.publish_frame(bus, 0, make_frame(2), 2, frame_count=2)
+        calibration_func.publish_frame(bus, 1, make_frame(3), 2, frame_count=2)
+        with bus.acquire_latest() as frame_set:
+            assert frame_set.generation == 2
+        assert len(warnings) == 1
+    finally:
+        bus.close()
+        sys.modules.pop('src.gui._calibration_func', None)
@@ -0,0 +1,87 @@
+import threading
+import time
+
+import numpy as np
+import pytest
+
+
+@pytest.fixture
+def frame_scheduler(camera_control):
+    return camera_control('frame_scheduler')
+
+
+def test_sleep_until(frame_scheduler):
+    errors = []
+    for _ in range(20):
+        deadline = time.perf_counter() + 0.01
+        reached = frame_scheduler.sleep_until(deadline)
+        assert reached >= deadline
+        errors.append(reached - deadline)
+    # busy waiting for the last spin seconds, the deadline is not overshot by a sleep
+    assert np.median(errors) < 0.001
+
+    # a deadline in the past returns at once
+    start = time.perf_counter()
+    assert frame_scheduler.sleep_until(start - 1) >= start
+    assert time.perf_counter() - start < 0.001
+
+
+def test_ticks_release_the_threads_together(frame_scheduler):
+    scheduler = frame_scheduler.FrameScheduler(100, n_threads=3)
+    ticks = [[] for _ in range(3)]
+
+    def record(num):
+        for _ in range(30):
+            tick = scheduler.wait(timeout=5)
+            ticks[num].append((tick, scheduler.tick_time, time.perf_counter()))
+
+    threads = [threading.Thread(target=record, args=(num,)) for num in range(3)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    # every thread gets every tick once, at the tick time of the scheduler
+    assert [[tick for tick, _, _ in thread_ticks] for thread_ticks in ticks] == [list(range(1, 31))] * 3
+    tick_times = np.array([tick_time for _, tick_time, _ in ticks[0]])
+    np.testing.assert_allclose(np.median(np.diff(tick_times)), 0.01, atol=0.001)
+    released = np.array([[released for _, _, released in thread_ticks] for thread_ticks in ticks])
+    assert np.median(released - tick_times) < 0.005
+    assert scheduler.late == 0
+
+
+def test_late_ticks(frame_scheduler):
+    scheduler = frame_scheduler.FrameScheduler(100)
+    scheduler.wait()
+    scheduler.wait()
+    # the thread is 3 frames late for the next tick
+    time.sleep(0.03)
+    scheduler.wait()
+    late_time = scheduler.tick_time
+    assert scheduler.late == 1
+    # the frames that were missed are not caught up, the next tick is at least half a frame later
+    scheduler.wait()
+    assert scheduler.tick_time - late_time >= 0.005
+    assert scheduler.late == 1
+
+
+def test_abort_releases_the_waiting_threads(frame_scheduler):
+    scheduler = frame_scheduler.FrameScheduler(100, n_threads=2)
+    errors = []
+
+    def wait():
+        try:
+            scheduler.wait(timeout=5)
+        except threading.BrokenBarrierError as e:
+            errors.append(e)
+
+    # the second camera thread never arrives, e.g. its camera stopped
+    thread = threading.Thread(target=wait)
+    thread.start()
+    time.sleep(0.05)
+    start = time.perf_counter()
+    scheduler.abort()
+    thread.join()
+    assert len(errors) == 1 and time.perf_counter() - start < 0.5
+    with pytest.raises(threading.BrokenBarrierError):
+        scheduler.wait()
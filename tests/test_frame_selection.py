@@ -0,0 +1,74 @@
+import cv2
+import numpy as np
+
+from src.aniposelib.boards import CharucoBoard
+from src.aniposelib.selection import CoverageMap, FrameSelector
+
+
+def make_rows(cgroup, board, poses, start=0, seed=0):
+    rng = np.random.default_rng(seed)
+    objp = board.get_object_points().reshape(-1, 3)
+    objp = objp - objp.mean(axis=0)
+    all_rows = [[] for _ in cgroup.cameras]
+    for framenum, (rvec, tvec) in enumerate(poses, start=start):
+        p3ds = objp @ cv2.Rodrigues(np.array(rvec, dtype='float64'))[0].T + tvec
+        p2ds = cgroup.project(p3ds)
+        for num, (cam, points) in enumerate(zip(cgroup.cameras, p2ds)):
+            width, height = cam.get_size()
+            ids = np.flatnonzero((points[:, 0] > 0) & (points[:, 0] < width) &
+                                 (points[:, 1] > 0) & (points[:, 1] < height))
+            if len(ids) < 6:
+                continue
+            corners = points[ids] + rng.normal(0, 0.3, (len(ids), 2))
+            all_rows[num].append({'framenum': framenum, 'corners': corners.reshape(-1, 1, 2).astype('float32'),
+                                  'ids': ids.reshape(-1, 1)})
+    return all_rows
+
+
+def test_frame_selection_keeps_diverse_frames(camera_group):
+    board = CharucoBoard(5, 4, 25, 18.75, 4, 50)
+    cgroup = camera_group
+
+    # a long capture of the board held still in the middle, and a few frames moved around and tilted
+    still = [([0, 0, 0], [0, 0, 0])] * 400
+    moved = [([0.7 * np.cos(a), 0.7 * np.sin(a), 0], [120 * np.cos(a), 90 * np.sin(a), 0])
+             for a in np.linspace(0, 2 * np.pi, 12, endpoint=False)]
+    all_rows = make_rows(cgroup, board, still[:200] + moved + still[200:])
+
+    selector = FrameSelector(cgroup, board, max_frames=20)
+    selected_rows = selector.select_rows(all_rows)
+    selected = {row['framenum'] for rows in selected_rows for row in rows}
+    assert len(selected) <= 20
+    assert set(range(200, 212)) <= selected
+    for rows, camera_rows in zip(selected_rows, all_rows):
+        assert rows == [row for row in camera_rows if row['framenum'] in selected]
+
+    # new detections are described once, the frames that are no longer given are not selected
+    described = len(selector.seen)
+    more_rows = make_rows(cgroup, board, still[:50], start=1000, seed=1)
+    selected_rows = selector.select_rows(more_rows)
+    assert len(selector.seen) == described + sum(len(rows) for rows in more_rows)
+    selected = {row['framenum'] for rows in selected_rows for row in rows}
+    assert len(selected) == 20 and min(selected) >= 1000
+
+    # below max_frames every frame is kept
+    selector.max_frames = 1000
+    assert selector.select_rows(all_rows) == all_rows
+
+
+def test_coverage_map():
+    coverage = CoverageMap([(1280, 1024), (640, 480)], grid_size=(4, 2), min_hits=2, sufficient_fraction=0.75)
+    # the left half of camera 0 twice, one corner out of the image is counted in the edge cell, NaN is left out
+    corners = np.array([[10, 10], [330, 10], [10, 600], [330, 600], [-5, 2000], [np.nan, np.nan]], dtype='float32')
+    coverage.add(0, corners.reshape(-1, 1, 2))
+    coverage.add(0, corners[:4])
+    assert coverage.counts[0].tolist() == [[2, 2, 0, 0], [3, 2, 0, 0]]
+    assert coverage.get_coverage(0) == 0.5
+    assert not coverage.is_sufficient()
+
+    coverage.add(0, [[700, 10], [1000, 10], [700, 600]] * 2)
+    assert coverage.is_sufficient(0) and not coverage.is_sufficient(1)
+    assert coverage.render(tile_width=160).shape == (80, 320, 3)
+
+    coverage.reset()
+    assert coverage.get_coverage().tolist() == [0, 0]
@@ -0,0 +1,69 @@
+
+import numpy as np
+import pytest
+
+
+@pytest.fixture
+def frame_trace(camera_control):
+    return camera_control('frame_trace')
+
+
+def test_copy_frames_of_one_file(frame_trace):
+    trace = frame_trace.FrameTrace(cam_num=1, capacity=8)
+    for frame_num in range(12):
+        for stage in range(len(frame_trace.STAGES)):
+            trace.stamp(frame_num, stage, frame_num + stage * 0.001)
+
+    # frames 0 to 3 were overwritten by frames 8 to 11
+    copy = trace.copy_frames(np.arange(2, 7))
+    frame_nums, times = copy.get_frames()
+    assert frame_nums.tolist() == [4, 5, 6]
+    np.testing.assert_allclose(times[:, 0], [4, 5, 6])
+    np.testing.assert_allclose(copy.get_latencies(), 3)
+    assert trace.copy_frames([]).get_frames()[0].tolist() == []
+
+
+def test_trace_with_threaded_writer(ic_camera, tmp_path):
+    session = ic_camera.VideoRecordingSession(cam_num=0)
+    session.set_params(video_file=str(tmp_path / 'cam0.avi'), fourcc='MJPG', fps=200, dim=(64, 48))
+    trace = session.enable_trace()
+    session.set_recording_status(True)
+    frame = np.zeros((48, 64, 3), dtype='uint8')
+    for frame_num in range(300):
+        session.acquire_frame(frame=frame, time_data=ic_camera.time.perf_counter(), frame_num=frame_num)
+        if frame_num % 3 == 0:
+            ic_camera.time.sleep(0.001)
+    session.recording_status = False
+    ic_camera.time.sleep(0.05)
+    session.release()
+
+    # the writer thread never loses the stamps of a frame it took from the buffer
+    frame_nums, times = trace.get_frames()
+    assert frame_nums.tolist() == list(range(300))
+    assert not np.any(np.isnan(times))
+    assert np.all(np.diff(times, axis=1) >= 0)
+    assert len(trace.get_latencies()) == 300
+
+
+def test_trace_when_the_writer_takes_the_frame_at_once(ic_camera, tmp_path):
+    session = ic_camera.VideoRecordingSession(cam_num=0)
+    session.set_params(video_file=str(tmp_path / 'cam0.avi'), fourcc='MJPG', fps=200, dim=(64, 48))
+    trace = session.enable_trace()
+    session.reset_frame_buffer()
+    session.recording_status = True
+
+    # the writer thread writes each frame right after it is appended, before acquire_frame returns
+    class WrittenAtOnce(ic_camera.deque):
+        def append(self, item):
+            super().append(item)
+            session.write_frame()
+
+    session.frame_buffer = WrittenAtOnce(maxlen=250)
+    frame = np.zeros((48, 64, 3), dtype='uint8')
+    for frame_num in range(20):
+        session.acquire_frame(frame=frame, time_data=ic_camera.time.perf_counter(), frame_num=frame_num)
+    session.recording_status = False
+    session.release()
+
+    _, times = trace.get_frames()
+    assert not np.any(np.isnan(times))
@@ -0,0 +1,90 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+
+def measure(grabber, func):
+    grabber.calls.clear()
+    start = time.perf_counter()
+    func()
+    return time.perf_counter() - start, list(grabber.calls)
+
+
+def test_reconfigure_without_reopen(ic_camera, grabber):
+    init_time, calls = measure(grabber, lambda: [ic_camera.ICCam(cam_num=0), ic_camera.ICCam(cam_num=1)])
+    # each camera is opened once, the device list is only queried for the first one
+    assert calls.count('open') == 2
+    assert calls.count('GetDevices') == 1
+
+    cam = ic_camera.ICCam(cam_num=0)
+    format_time, calls = measure(grabber, lambda: cam.set_formats(width=640, height=480))
+    assert 'open' not in calls and 'close' not in calls and 'GetDevices' not in calls
+    crop_time, calls = measure(grabber, lambda: cam.set_crop(top=0, left=0))
+    assert 'open' not in calls and calls.count('CreateFrameFilter') == 1
+    crop_time, calls = measure(grabber, lambda: cam.set_crop(top=10, left=10))
+    assert 'CreateFrameFilter' not in calls
+
+    def reopen():
+        cam.reopen()
+        cam.reconfigure(formats=cam.formats, frame_rate='highest')
+
+    reopen_time, _ = measure(grabber, reopen)
+    print(f'init of 2 cameras: {init_time * 1000:.0f} ms, format change: {format_time * 1000:.0f} ms, '
+          f'crop change: {crop_time * 1000:.0f} ms, reopen: {reopen_time * 1000:.0f} ms')
+    assert format_time < reopen_time / 3
+
+
+def test_reconfigure_falls_back(ic_camera, grabber, monkeypatch):
+    cam = ic_camera.ICCam(cam_num=0)
+
+    # a driver that needs the stream stopped, but not the device closed
+    monkeypatch.setattr(grabber, 'format_states', ('opened', 'stopped'))
+    _, calls = measure(grabber, lambda: cam.set_formats(width=320, height=240))
+    assert 'StopLive' in calls and 'open' not in calls
+
+    # a driver that only accepts the format on a freshly opened device
+    monkeypatch.setattr(grabber, 'format_states', ('opened',))
+    _, calls = measure(grabber, lambda: cam.set_formats(width=640, height=480))
+    assert calls.count('open') == 1 and calls[-1] == 'StartLive'
+
+
+def test_open_from_snapshot(ic_camera, grabber, tmp_path):
+    cam = ic_camera.ICCam(cam_num=0)
+    cam.save_device_snapshot(str(tmp_path))
+
+    _, calls = measure(grabber, lambda: ic_camera.ICCam(cam_num=0, state_dir=str(tmp_path)))
+    assert calls.count('LoadDeviceStateFromFile') == 1
+    assert 'open' not in calls and 'SetVideoFormat' not in calls and 'SetFrameRate' not in calls
+
+    # a camera without a snapshot is set up from camera_details.json
+    _, calls = measure(grabber, lambda: ic_camera.ICCam(cam_num=1, state_dir=str(tmp_path)))
+    assert 'LoadDeviceStateFromFile' not in calls and calls.count('open') == 1
+
+
+def test_parallel_init(ic_camera, grabber):
+    def init(cam_num):
+        crop = {'top': 0, 'left': 0, 'height': 480, 'width': 640}
+        cam = ic_camera.ICCam(cam_num=cam_num, rotate=0, crop=crop, exposure=0.01, gain=10)
+        cam.set_exposure(0.01)
+        cam.set_gain(10)
+        cam.start()
+
+    sequential_time, _ = measure(grabber, lambda: [init(cam_num) for cam_num in range(6)])
+    with ThreadPoolExecutor(max_workers=6) as executor:
+        parallel_time, calls = measure(grabber, lambda: list(executor.map(init, range(6))))
+    print(f'init of 6 cameras: {sequential_time * 1000:.0f} ms sequential, {parallel_time * 1000:.0f} ms parallel')
+    assert calls.count('open') == 6
+    assert parallel_time < sequential_time / 3
+
+
+def test_frame_shape_without_a_frame(ic_camera, grabber, monkeypatch):
+    cam = ic_camera.ICCam(cam_num=0, rotate=0)
+    # no frame captured yet, the shape comes from the video format
+    monkeypatch.setattr(grabber, 'GetImageEx', lambda self: None, raising=False)
+    assert cam.get_frame_shape() == (480, 640, 3)
+    cam.rotate = 90
+    assert cam.get_frame_shape() == (640, 480, 3)
+
+    monkeypatch.setattr(grabber, 'GetImageEx', lambda self: np.zeros((240, 320, 3), dtype='uint8'))
+    assert cam.get_frame_shape() == (240, 320, 3)
@@ -0,0 +1,33 @@
+import numpy as np
+
+from src.aniposelib.boards import CharucoBoard
+from src.aniposelib.live import LiveReprojection
+
+
+def test_live_reprojection_matches_camera_group(camera_group):
+    board = CharucoBoard(5, 4, 25, 18.75, 4, 50)
+    cgroup = camera_group
+    engine = LiveReprojection(cgroup, board)
+
+    rng = np.random.default_rng(0)
+    objp = board.get_object_points().reshape(-1, 3)
+    p2ds_true = cgroup.project(objp - objp.mean(axis=0))
+    n_points = objp.shape[0]
+
+    imgp = np.full(p2ds_true.shape, np.nan)
+    for num in range(len(cgroup.cameras)):
+        ids = np.sort(rng.choice(n_points, n_points - 2 * num, replace=False))
+        corners = p2ds_true[num, ids] + rng.normal(0, 0.5, (len(ids), 2))
+        imgp[num, ids] = corners
+        engine.update(num, 1, corners.reshape(-1, 1, 2).astype('float32'), ids.reshape(-1, 1))
+        engine.update(num, 2, corners[:5].reshape(-1, 1, 2).astype('float32'), ids[:5].reshape(-1, 1))
+
+    result = engine.compute(1)
+    imgp = imgp.astype('float32').astype('float64')[:, result['ids']]
+    p3ds = cgroup.triangulate(imgp)
+    p2ds = cgroup.project(p3ds)
+
+    assert np.allclose(result['p3ds'], p3ds, atol=1e-6)
+    assert np.allclose(result['p2ds'], p2ds, atol=1e-6)
+    assert np.allclose(result['errors'], np.linalg.norm(imgp - p2ds, axis=2), equal_nan=True)
+    assert engine.compute(3) is None
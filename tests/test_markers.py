@@ -0,0 +1,81 @@
+import json
+import socket
+
+import cv2
+import numpy as np
+import pytest
+
+from src.aniposelib.markers import BlobFinder, MarkerTriangulator
+
+
+@pytest.fixture
+def marker_stream(camera_control):
+    return camera_control('marker_stream')
+
+
+def render_frames(cgroup, p3ds, radius=4):
+    p2ds = cgroup.project(p3ds)
+    frames = []
+    for points in p2ds:
+        frame = np.full((1024, 1280, 3), 30, dtype='uint8')
+        for x, y in points:
+            # drawn at 1/16 pixel precision so the centroids are not rounded to the pixel
+            cv2.circle(frame, (int(round(x * 16)), int(round(y * 16))), radius * 16, (255, 255, 255), -1,
+                       cv2.LINE_AA, shift=4)
+        frames.append(frame)
+    return frames
+
+
+def test_markers_are_triangulated_in_stable_slots(camera_group):
+    cgroup = camera_group
+    triangulator = MarkerTriangulator(cgroup, max_markers=4)
+    finder = BlobFinder()
+    p3ds = np.array([[0, 0, 0], [40, 10, 5], [-30, 25, -10]], dtype='float64')
+
+    frames = render_frames(cgroup, p3ds)
+    blobs = [finder.find(num, frame) for num, frame in enumerate(frames)]
+    assert [len(points) for points in blobs] == [3, 3, 3, 3]
+    markers, result = triangulator.track(blobs)
+    assert np.all(result['n_cameras'] == 4)
+    assert np.all(result['errors'] < 1)
+    slots = [np.nanargmin(np.linalg.norm(markers - p, axis=1)) for p in p3ds]
+    np.testing.assert_allclose(markers[slots], p3ds, atol=1)
+    assert np.all(np.isnan(markers[np.setdiff1d(np.arange(4), slots)]))
+
+    # moved a little, found in another order and one marker hidden from a camera
+    moved = p3ds + [2, -1, 1]
+    frames = render_frames(cgroup, moved[::-1])
+    frames[0][:] = render_frames(cgroup, moved[1:][::-1])[0]
+    blobs = [finder.find(num, frame) for num, frame in enumerate(frames)]
+    markers, result = triangulator.track(blobs)
+    np.testing.assert_allclose(markers[slots], moved, atol=1)
+    assert sorted(result['n_cameras'].tolist()) == [3, 4, 4]
+
+
+def test_marker_stream_publishes_to_file_and_socket(marker_stream, camera_group, tmp_path):
+    cgroup = camera_group
+    receiver = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    receiver.bind(('127.0.0.1', 0))
+    receiver.settimeout(5)
+
+    output_file = tmp_path / 'MARKERS_test.csv'
+    stream = marker_stream.MarkerStream(None, cgroup, output_file=str(output_file), port=receiver.getsockname()[1], max_markers=2)
+    # frame sets are given to process() directly instead of through a frame bus
+    stream.open()
+    try:
+        p3ds = np.array([[0, 0, 0], [40, 10, 5]], dtype='float64')
+        frames = render_frames(cgroup, p3ds)
+        stream.process(7, frames, np.full(4, 100.0))
+        stream.process(9, frames, np.full(4, 100.5))
+        message = json.loads(receiver.recv(65536))
+    finally:
+        stream.stop()
+        receiver.close()
+
+    assert message['generation'] == 7 and message['time'] == 100.0
+    np.testing.assert_allclose(sorted(message['markers']), sorted(p3ds.tolist()), atol=1)
+    rows = output_file.read_text().splitlines()
+    assert rows[0].startswith('generation,time,latency_ms,m0_x')
+    assert len(rows) == 3 and rows[2].startswith('9,100.500000,')
+    assert stream.dropped == 1
+    assert len(stream.get_latencies()['total']) == 2
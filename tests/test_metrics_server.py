@@ -0,0 +1,47 @@
+import json
+import urllib.error
+import urllib.request
+
+import pytest
+
+
+@pytest.fixture
+def metrics_server(camera_control):
+    return camera_control('metrics_server')
+
+
+def test_metrics_endpoint(metrics_server, tmp_path):
+    video_file = tmp_path / 'Cam1_Mouse_Test_1.avi'
+    video_file.write_bytes(b'\x00' * 1000)
+    counters = [{'cam': 0, 'frames_acquired': 12, 'frames_written': 10, 'overruns': 2, 'video_file': str(video_file)},
+                {'cam': 1, 'frames_acquired': 10, 'frames_written': 7, 'buffer_length': 3}]
+    server = metrics_server.MetricsServer(lambda: counters, port=0, min_interval=0)
+    host, port = server.start()
+    try:
+        with urllib.request.urlopen(f'http://{host}:{port}/metrics') as response:
+            assert response.headers['Content-Type'].startswith('text/plain')
+            lines = response.read().decode().splitlines()
+        assert '# TYPE camgui_frames_written_total counter' in lines
+        assert 'camgui_frames_written_total{cam="0"} 10' in lines
+        assert 'camgui_overruns_total{cam="1"} 0' in lines
+        assert 'camgui_buffer_length{cam="1"} 3' in lines
+        assert 'camgui_video_file_bytes{cam="0"} 1000' in lines
+        assert 'camgui_frame_count_divergence 3' in lines
+        # every sample line has a metric declared above it
+        declared = {line.split()[2] for line in lines if line.startswith('# TYPE')}
+        assert {line.split('{')[0].split()[0] for line in lines if not line.startswith('#')} <= declared
+
+        # the rates come from the difference with the previous sample
+        counters[0]['frames_written'] = 30
+        with urllib.request.urlopen(f'http://{host}:{port}/metrics.json') as response:
+            sample = json.loads(response.read())
+        cameras = {metrics['cam']: metrics for metrics in sample['cameras']}
+        assert cameras[0]['frames_written'] == 30 and cameras[0]['fps'] > 0
+        assert cameras[1]['fps'] == 0
+        assert sample['frame_count_divergence'] == 23
+
+        with pytest.raises(urllib.error.HTTPError) as error:
+            urllib.request.urlopen(f'http://{host}:{port}/other')
+        assert error.value.code == 404
+    finally:
+        server.stop()
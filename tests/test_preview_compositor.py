@@ -0,0 +1,36 @@
+import numpy as np
+
+from src.gui import preview_compositor
+
+
+def test_render_into_centered_tiles():
+    shapes = [(480, 640, 3), (1024, 1280), (1024, 1280, 1)]
+    compositor = preview_compositor.PreviewCompositor(shapes, width=900, height=200, max_fps=0)
+    frames = [np.full((480, 640, 3), (10, 20, 30), dtype='uint8'),
+              np.full((1024, 1280), 200, dtype='uint8'),
+              np.full((1024, 1280, 1), 50, dtype='uint8')]
+    mosaic = compositor.render(frames)
+    assert mosaic.shape == (200, 900, 3)
+
+    # 4:3 and 5:4 frames in 300x200 cells fill the height and are centered horizontally
+    assert [tile.shape for tile in compositor.tiles] == [(200, 266, 3), (200, 250, 3), (200, 250, 3)]
+    assert np.all(compositor.tiles[0] == (10, 20, 30))
+    assert np.all(compositor.tiles[1] == 200) and np.all(compositor.tiles[2] == 50)
+    assert np.all(mosaic[:, :17] == 0) and np.all(mosaic[:, 283:325] == 0)
+
+    points = compositor.scale_points(1, [[1280, 1024], [640, 0]])
+    assert points.shape == (2, 1, 2) and points.dtype == np.float32
+    np.testing.assert_allclose(points[:, 0], [[250, 200], [125, 0]], atol=1e-3)
+
+
+def test_text_is_erased_on_the_next_render():
+    compositor = preview_compositor.PreviewCompositor([(1024, 1280, 3)] * 2, width=2160, height=660, max_fps=0)
+    frames = [np.zeros((1024, 1280, 3), dtype='uint8')] * 2
+    compositor.render(frames)
+    # the text of the overlay starts in the gap left of the first tile
+    compositor.put_text('No board detected', (30, 50), (255, 0, 0))
+    compositor.put_tile_text(1, 'Error: 1.00 px', (10, 130), (0, 0, 255))
+    assert np.any(compositor.mosaic[:, :127] != 0) and np.any(compositor.tiles[1] != 0)
+
+    compositor.render(frames)
+    assert not np.any(compositor.mosaic)
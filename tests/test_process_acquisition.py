@@ -0,0 +1,84 @@
+import multiprocessing as mp
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import cv2
+import numpy as np
+
+import simulated_driver
+
+
+def run_in_new_process(scenario, *args):
+    # the workers need the simulated driver, so they are forked. Forking the test process once numba started its
+    # threads, e.g. to triangulate in an earlier test, hangs it at exit, so they are forked from a new process.
+    with ProcessPoolExecutor(max_workers=1, mp_context=mp.get_context('spawn')) as executor:
+        executor.submit(scenario, *args).result()
+
+
+def count_frames(video_file):
+    cap = cv2.VideoCapture(video_file)
+    n_frames = 0
+    while cap.grab():
+        n_frames += 1
+    cap.release()
+    return n_frames
+
+
+def make_acquisition(directory, n_cams=2):
+    simulated_driver.SimulatedGrabber.GetImageEx = lambda self: np.full((48, 64, 3), 100, dtype='uint8')
+    simulated_driver.install()
+    ic_camera = simulated_driver.import_module('ic_camera')
+    process_acquisition = simulated_driver.import_module('process_acquisition')
+    cams = [ic_camera.ICCam(cam_num=num) for num in range(n_cams)]
+    video_files = [f'{directory}/cam{num}.avi' for num in range(n_cams)]
+    # the workers are forked, so they inherit the simulated driver instead of loading the real one
+    return process_acquisition.ProcessAcquisition(cams, video_files, 'MJPG', 50, state_dir=directory,
+                                                  context='fork')
+
+
+def record_on_the_same_frame_slots(directory):
+    grabber = simulated_driver.SimulatedGrabber
+    acquisition = make_acquisition(directory)
+    assert acquisition.start(delay=0.1)
+    time.sleep(0.6)
+    with acquisition.get_preview() as preview:
+        assert [int(frame[0, 0, 0]) for frame in preview.frames] == [100, 100]
+    grabber.calls.clear()
+    frame_times, frame_nums = acquisition.stop()
+
+    assert len(frame_nums[0]) > 10
+    assert frame_nums[0][0] == frame_nums[1][0] == 0
+    assert frame_nums[0][-1] == frame_nums[1][-1]
+    for num in range(2):
+        assert len(frame_times[num]) == len(frame_nums[num]) == count_frames(acquisition.video_files[num])
+    # the cameras are handed back to the GUI
+    assert grabber.calls.count('LoadDeviceStateFromFile') == 2
+    assert acquisition.stop() == ([[], []], [[], []])
+
+
+def cancel_a_start_waiting_for_the_workers(directory):
+    acquisition = make_acquisition(directory)
+    # workers that take long to open their camera
+    simulated_driver.SimulatedGrabber.LATENCY['LoadDeviceStateFromFile'] = 1.0
+    result = []
+    thread = threading.Thread(target=lambda: result.append(acquisition.start()))
+    thread.start()
+    time.sleep(0.3)
+
+    start = time.perf_counter()
+    acquisition.cancel()
+    thread.join()
+    assert result == [False]
+    assert time.perf_counter() - start < 0.5
+    # the workers stop before recording anything once they are ready
+    assert acquisition.stop() == ([[], []], [[], []])
+    assert acquisition.stop() == ([[], []], [[], []])
+
+
+def test_workers_record_on_the_same_frame_slots(tmp_path):
+    run_in_new_process(record_on_the_same_frame_slots, str(tmp_path))
+
+
+def test_cancel_a_start_waiting_for_the_workers(tmp_path):
+    run_in_new_process(cancel_a_start_waiting_for_the_workers, str(tmp_path))
@@ -0,0 +1,97 @@
+import os
+
+import numpy as np
+import pytest
+
+
+@pytest.fixture
+def session_bundle(camera_control):
+    return camera_control('session_bundle')
+
+
+def test_bundle_round_trip(session_bundle, tmp_path):
+    bundle_file = session_bundle.get_bundle_file(str(tmp_path / 'Cam1_Mouse_Test_1.avi'), 'Cam1')
+    assert os.path.basename(bundle_file) == 'SESSION_Mouse_Test_1.zip'
+
+    bundle = session_bundle.SessionBundle(bundle_file, chunk_rows=100)
+    bundle.set_attrs(subject='Mouse', fps=200, cams=2)
+    bundle.set_attrs('cam0', name='Cam 1', exposure=0.004, gain=10.0)
+    bundle.set_attrs('cam0', gain=12.0)
+
+    times = np.arange(250) / 200
+    frame_nums = np.arange(250) + 3
+    frame_nums[100:] += 2
+    assert bundle.append('cam0/timestamps', times) == 0
+    assert bundle.append('cam0/frame_nums', frame_nums) == 0
+    bundle.append('cam0/dropped', session_bundle.get_dropped_frames(frame_nums))
+    bundle.add_record('cam0', video_file='Cam1_Mouse_Test_1.avi', start=0, stop=250)
+    assert bundle.append('cam1/timestamps', times[:10]) == 0
+
+    calibration_file = tmp_path / 'calibration.toml'
+    calibration_file.write_text('first')
+    assert bundle.add_file(str(calibration_file))
+    calibration_file.write_text('second')
+    assert bundle.add_file(str(calibration_file))
+    assert not bundle.add_file(str(tmp_path / 'detections.pickle'))
+
+    # reopened for the next file of the session, e.g. after a rollover
+    bundle = session_bundle.SessionBundle(bundle_file, chunk_rows=100)
+    assert bundle.append('cam0/timestamps', times + 10) == 250
+    bundle.add_record('cam0', video_file='Cam1_Mouse_Test_2c1.avi', start=250, stop=500)
+
+    with session_bundle.SessionReader(bundle_file) as reader:
+        assert reader.get_attrs() == {'subject': 'Mouse', 'fps': 200, 'cams': 2}
+        assert reader.get_attrs('cam0') == {'name': 'Cam 1', 'exposure': 0.004, 'gain': 12.0}
+        assert reader.get_cameras() == ['cam0', 'cam1']
+        assert [record['start'] for record in reader.get_records('cam0')] == [0, 250]
+
+        assert reader.get_length('cam0/timestamps') == 500
+        np.testing.assert_array_equal(reader.read('cam0/timestamps'), np.concatenate([times, times + 10]))
+        np.testing.assert_array_equal(reader.read('cam0/timestamps', 190, 310), np.concatenate([times, times + 10])[190:310])
+        dropped = reader.read('cam0/dropped')
+        assert np.flatnonzero(dropped).tolist() == [100]
+
+        camera = reader.load_camera('cam1')
+        np.testing.assert_array_equal(camera['timestamps'], times[:10])
+
+        assert reader.get_files() == ['calibration.toml']
+        assert reader.get_file('calibration.toml') == b'second'
+
+
+def test_bundle_survives_interrupted_writes(session_bundle, tmp_path):
+    bundle_file = str(tmp_path / 'SESSION_Mouse_Test_1.zip')
+    bundle = session_bundle.SessionBundle(bundle_file, chunk_rows=100)
+    bundle.set_attrs(subject='Mouse')
+    bundle.append('cam0/timestamps', np.arange(150) / 200)
+    assert len(session_bundle.get_part_files(bundle_file)) == 2
+
+    # a crash while writing leaves a truncated temporary file and the next part half written
+    part_file = f'{bundle_file}.part{bundle.next_part:06d}'
+    with open(part_file + '.tmp', 'wb') as f:
+        f.write(b'PK\x03\x04' + b'\x00' * 20)
+    with session_bundle.SessionReader(bundle_file) as reader:
+        assert reader.get_attrs() == {'subject': 'Mouse'}
+        assert reader.get_length('cam0/timestamps') == 150
+
+    # merged into the bundle file, a crash before the parts are removed reads the entries once
+    bundle = session_bundle.SessionBundle(bundle_file, chunk_rows=100)
+    assert bundle.append('cam0/timestamps', np.arange(50) / 200) == 150
+    part_files = session_bundle.get_part_files(bundle_file)
+    kept = {fname: open(fname, 'rb').read() for fname in part_files}
+    assert bundle.merge() == bundle_file
+    assert session_bundle.get_part_files(bundle_file) == []
+    for fname, data in kept.items():
+        with open(fname, 'wb') as f:
+            f.write(data)
+    with session_bundle.SessionReader(bundle_file) as reader:
+        assert reader.get_length('cam0/timestamps') == 200
+        assert len(reader.chunks['cam0/timestamps']) == 3
+
+    session_bundle.remove_bundle(bundle_file)
+    assert os.listdir(tmp_path) == []
+
+
+def test_dropped_frames_from_times(session_bundle):
+    times = np.array([0, 0.005, 0.010, 0.025, 0.030])
+    dropped = session_bundle.get_dropped_frames(np.full(5, -1), times, fps=200)
+    assert dropped.tolist() == [False, False, False, True, False]
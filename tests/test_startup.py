@@ -0,0 +1,37 @@
+import os
+import subprocess
+import sys
+
+import pytest
+
+from src.aniposelib.cameras import triangulate_simple, warm_up
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# imported on first use by the GUI, they take a large part of its startup time
+LAZY_MODULES = ('matplotlib', 'ffmpy', 'src.aniposelib', 'numba')
+
+IMPORT_SCRIPT = """
+import sys
+sys.path[:0] = ['.', 'tests', 'src/gui']
+import simulated_driver
+simulated_driver.install()
+import {module}
+print(' '.join(name for name in {lazy_modules!r} if name in sys.modules))
+"""
+
+
+def test_warm_up_compiles_the_numba_functions():
+    duration = warm_up()
+    assert isinstance(duration, float) and duration > 0
+    assert len(triangulate_simple.signatures) > 0
+
+
+@pytest.mark.parametrize('module', ['_video_files_func', '_calibration_func', 'camera_control_GUI_improved'])
+def test_gui_imports_do_not_load_the_lazy_modules(module):
+    if module == 'camera_control_GUI_improved':
+        pytest.importorskip('PIL')
+    # in a new process, the modules imported by the other tests are not loaded yet
+    script = IMPORT_SCRIPT.format(module=module, lazy_modules=LAZY_MODULES)
+    result = subprocess.run([sys.executable, '-c', script], cwd=ROOT, capture_output=True, text=True, timeout=120)
+    assert result.returncode == 0, result.stderr
+    assert result.stdout.split() == []
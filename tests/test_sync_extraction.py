@@ -0,0 +1,56 @@
+import os
+
+import cv2
+import numpy as np
+import pytest
+
+
+@pytest.fixture
+def sync_extraction(camera_control):
+    return camera_control('sync_extraction')
+
+
+def make_sync_video(directory, cam_name, led_on, fps=30):
+    """Writes a noisy video with a sync LED at (40, 30) and another at (200, 100), on in the frames of led_on,
+    and its TIMESTAMPS file."""
+    video_file = os.path.join(directory, f'{cam_name}_session.avi')
+    rng = np.random.default_rng(0)
+    out = cv2.VideoWriter(video_file, cv2.VideoWriter_fourcc(*'MJPG'), fps, (320, 240))
+    for i in range(len(led_on)):
+        frame = rng.integers(40, 60, (240, 320, 3), dtype='uint8')
+        if led_on[i]:
+            frame[30:40, 40:50] = 230
+        if i % 50 < 10:
+            frame[100:108, 200:208] = 200
+        out.write(frame)
+    out.release()
+    timestamps = 1000 + np.arange(len(led_on)) / fps
+    np.save(os.path.join(directory, f'TIMESTAMPS_{cam_name}_session.npy'), timestamps)
+    return video_file, timestamps
+
+
+def test_extract_sync(sync_extraction, tmp_path):
+    led_on = np.zeros(300, dtype='bool')
+    for start, length in [(13, 7), (61, 25), (150, 5), (222, 60)]:
+        led_on[start:start + length] = True
+    rising = np.flatnonzero(np.diff(led_on.astype(int)) == 1) + 1
+    falling = np.flatnonzero(np.diff(led_on.astype(int)) == -1) + 1
+
+    videos = [make_sync_video(str(tmp_path), f'cam{i}', led_on) for i in range(2)]
+    rois = {'sync_led': [38, 28, 14, 14], 'pulse': [200, 100, 8, 8], 'dark': [300, 200, 10, 10]}
+
+    for step in [1, 4]:
+        results = sync_extraction.extract_sync_videos([v for v, _ in videos], rois, step=step, workers=0)
+        for result, (video_file, timestamps) in zip(results, videos):
+            edges = result['edges']
+            np.testing.assert_array_equal(edges['sync_led']['rising'], rising)
+            np.testing.assert_array_equal(edges['sync_led']['falling'], falling)
+            np.testing.assert_allclose(edges['sync_led']['rising_times'], timestamps[rising])
+            np.testing.assert_array_equal(edges['pulse']['rising'], np.arange(50, 300, 50))
+            assert len(edges['dark']['rising']) == 0 and len(edges['dark']['falling']) == 0
+            if step > 1:
+                # only the frames around the edges are read besides every 4th frame
+                assert np.count_nonzero(~np.isnan(result['values'][:, 0])) < 200
+
+            saved = np.load(result['sync_file'])
+            np.testing.assert_array_equal(saved['sync_led_falling'], falling)
@@ -0,0 +1,63 @@
+import os
+
+import numpy as np
+import pytest
+
+
+@pytest.fixture
+def timestamp_stream(camera_control):
+    return camera_control('timestamp_stream')
+
+
+def test_journal_is_readable_while_recording(timestamp_stream, tmp_path):
+    video_file = str(tmp_path / 'cam0.avi')
+    journal_file = timestamp_stream.get_journal_file(video_file)
+    stream = timestamp_stream.TimestampStream(journal_file, capacity=16, chunk_size=100, flush_interval=1.0)
+
+    times = 1000 + np.arange(1000) / 200
+    read = 0
+    tailed = []
+    for i, t in enumerate(times):
+        stream.append(t, i + 5)
+        if i % 37 == 0:
+            records = timestamp_stream.read_journal(journal_file, start=read)
+            read += len(records)
+            tailed.append(records)
+    # at most a chunk, or flush_interval seconds of frames, is not in the journal yet
+    assert len(stream) - read <= 100
+    assert read > 0
+
+    stream.close()
+    tailed.append(timestamp_stream.read_journal(journal_file, start=read))
+    tailed = np.concatenate(tailed)
+    np.testing.assert_array_equal(tailed['time'], times)
+    np.testing.assert_array_equal(tailed['frame_num'], np.arange(1000) + 5)
+    np.testing.assert_array_equal(stream.get_times(), times)
+    assert stream[-1] == times[-1]
+
+    # a record cut by a crash is left out
+    with open(journal_file, 'ab') as f:
+        f.write(b'\0' * 5)
+    ts_file, csv_file = str(tmp_path / 'TIMESTAMPS_cam0.npy'), str(tmp_path / 'TIMESTAMPS_cam0.csv')
+    assert timestamp_stream.recover_journal(journal_file, ts_file, csv_file) == 1000
+    np.testing.assert_array_equal(np.load(ts_file), times)
+
+    np.savetxt(str(tmp_path / 'savetxt.csv'), times, delimiter=',')
+    with open(csv_file) as f, open(tmp_path / 'savetxt.csv') as g:
+        assert f.read() == g.read()
+
+    stream.remove_journal()
+    assert not os.path.exists(journal_file)
+
+
+def test_flush_interval(timestamp_stream, tmp_path):
+    journal_file = str(tmp_path / 'cam0_timestamps.bin')
+    stream = timestamp_stream.TimestampStream(journal_file, chunk_size=1000, flush_interval=0.5)
+    for i in range(20):
+        stream.append(i * 0.1, i)
+    # flushed at 0.5 s and 1.0 s of frame time, well before a full chunk
+    assert len(timestamp_stream.read_journal(journal_file)) == 16
+
+    stream.reset()
+    assert len(stream) == 0 and len(timestamp_stream.read_journal(journal_file)) == 0
+    stream.close()
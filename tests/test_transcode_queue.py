@@ -0,0 +1,68 @@
+import json
+import shutil
+import time
+
+import cv2
+import numpy as np
+import pytest
+
+
+@pytest.fixture
+def transcode_queue(camera_control):
+    return camera_control('transcode_queue')
+
+
+def make_video(video_file, n_frames=60):
+    out = cv2.VideoWriter(video_file, cv2.VideoWriter_fourcc(*'MJPG'), 30, (160, 120))
+    for i in range(n_frames):
+        out.write(np.full((120, 160, 3), i * 4 % 256, dtype='uint8'))
+    out.release()
+
+
+def wait_for(queue, timeout=60):
+    start = time.perf_counter()
+    while any(job['status'] in ('pending', 'running') for job in queue.get_jobs()):
+        assert time.perf_counter() - start < timeout
+        time.sleep(0.05)
+
+
+def test_interrupted_jobs_are_resumed(transcode_queue, tmp_path):
+    queue_file = str(tmp_path / 'queue.json')
+    video_file = str(tmp_path / 'cam0.avi')
+    make_video(video_file)
+    with open(queue_file, 'w') as f:
+        json.dump([{'source': video_file, 'target': str(tmp_path / 'cam0.mp4'), 'status': 'running',
+                    'progress': 0.4, 'error': None, 'verified': False, 'added': 0, 'finished': None}], f)
+
+    queue = transcode_queue.TranscodeQueue(queue_file, ffmpeg=str(tmp_path / 'no-ffmpeg'))
+    queue.load()
+    assert [job['status'] for job in queue.get_jobs()] == ['pending']
+
+    # without ffmpeg the job fails and the source is kept
+    queue.start()
+    wait_for(queue)
+    queue.stop()
+    with open(queue_file) as f:
+        job, = json.load(f)
+    assert job['status'] == 'failed' and 'could not run' in job['error']
+    assert (tmp_path / 'cam0.avi').exists()
+
+
+@pytest.mark.skipif(shutil.which('ffmpeg') is None, reason='ffmpeg is not installed')
+def test_transcode_and_delete_source(transcode_queue, tmp_path):
+    videos = [str(tmp_path / f'cam{i}.avi') for i in range(3)]
+    for video_file in videos:
+        make_video(video_file)
+
+    queue = transcode_queue.TranscodeQueue(str(tmp_path / 'queue.json'), workers=2, delete_source=True)
+    queue.start()
+    for video_file in videos:
+        queue.add(video_file)
+    wait_for(queue)
+    queue.stop()
+
+    for job in queue.get_jobs():
+        assert job['status'] == 'done' and job['verified']
+    for i in range(3):
+        assert not (tmp_path / f'cam{i}.avi').exists()
+        assert (tmp_path / f'cam{i}.mp4').exists()
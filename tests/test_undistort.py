@@ -0,0 +1,40 @@
+import cv2
+import numpy as np
+
+from src.aniposelib.cameras import Camera, CameraGroup
+from src.aniposelib.undistort import UndistortMaps, undistort_video
+
+
+def make_camera():
+    return Camera(matrix=[[600, 0, 320], [0, 600, 240], [0, 0, 1]], dist=[-0.3, 0.1, 0, 0, 0], size=(640, 480))
+
+
+def test_undistort_maps_match_undistort(tmp_path):
+    camera = make_camera()
+    maps = UndistortMaps(CameraGroup([camera]))
+    rng = np.random.default_rng(0)
+    frame = cv2.GaussianBlur(rng.integers(0, 255, (480, 640, 3), dtype='uint8'), (9, 9), 3)
+
+    undistorted = maps.undistort(0, frame)
+    expected = cv2.undistort(frame, camera.get_camera_matrix(), camera.get_distortions())
+    # fixed-point maps are interpolated on a 1/32 pixel grid
+    assert np.mean(np.abs(undistorted.astype('float64') - expected)) < 1
+
+    # the maps and the buffer are reused for the next frame, and rebuilt for a new calibration
+    cached = maps.get_maps(0, (640, 480))
+    assert maps.undistort(0, frame) is undistorted
+    assert maps.get_maps(0, (640, 480)) is cached
+    camera.set_distortions([-0.2, 0, 0, 0, 0])
+    assert maps.get_maps(0, (640, 480)) is not cached
+
+    # offline export
+    video_file = str(tmp_path / 'cam0.avi')
+    writer = cv2.VideoWriter(video_file, cv2.VideoWriter_fourcc(*'MJPG'), 30, (640, 480))
+    for _ in range(5):
+        writer.write(frame)
+    writer.release()
+    output_file, n_frames = undistort_video(video_file, camera, fourcc='MJPG')
+    assert n_frames == 5
+    cap = cv2.VideoCapture(output_file)
+    assert int(cap.get(cv2.CAP_PROP_FRAME_COUNT)) == 5
+    cap.release()
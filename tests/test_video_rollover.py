@@ -0,0 +1,116 @@
+import os
+import time
+
+import cv2
+import numpy as np
+
+
+def count_frames(video_file):
+    cap = cv2.VideoCapture(video_file)
+    n_frames = 0
+    while cap.grab():
+        n_frames += 1
+    cap.release()
+    return n_frames
+
+
+def test_rollover_without_dropping_frames(ic_camera, tmp_path):
+    session = ic_camera.VideoRecordingSession(cam_num=0)
+    session.set_params(video_file=str(tmp_path / 'cam0.avi'), fourcc='MJPG', fps=100, dim=(160, 120),
+                       rois={'led': [0, 0, 4, 4]})
+
+    cycle = [0]
+    finished = []
+
+    def next_file():
+        cycle[0] += 1
+        return str(tmp_path / f'cam0_{cycle[0]}c.avi')
+
+    session.set_rollover(next_file=next_file, max_gap=0.05,
+                         on_rollover=lambda *args: finished.append(args))
+    session.set_recording_status(True)
+
+    # 4 trigger trains of 30 frames at 100 Hz, 0.1 s apart
+    frame_num = 0
+    for train in range(4):
+        for i in range(30):
+            frame = np.full((120, 160, 3), frame_num % 256, dtype='uint8')
+            session.acquire_frame(frame=frame, time_data=time.perf_counter(), frame_num=frame_num)
+            frame_num += 1
+            time.sleep(0.002)
+        time.sleep(0.1)
+
+    session.recording_status = False
+    time.sleep(0.1)
+    last_file = session.video_file
+    last_times = list(session.frame_times)
+    session.release()
+
+    assert session.overruns == 0
+    assert [args[0] for args in finished] == [str(tmp_path / 'cam0.avi')] + [str(tmp_path / f'cam0_{c}c.avi') for c in [1, 2]]
+    assert last_file == str(tmp_path / 'cam0_3c.avi')
+    # the unused next file is removed
+    assert not os.path.exists(tmp_path / 'cam0_4c.avi')
+
+    for video_file, frame_times, frame_nums, tracking_value in finished:
+        assert len(frame_times) == len(frame_nums) == 30 == len(tracking_value['values'])
+        assert count_frames(video_file) == 30
+    assert len(last_times) == count_frames(last_file) == 30
+    frame_nums = np.concatenate([args[2] for args in finished])
+    np.testing.assert_array_equal(frame_nums, np.arange(90))
+
+    # the timestamp journals of the finished files are removed once on_rollover has saved them
+    assert sorted(f for f in os.listdir(tmp_path) if f.endswith('.bin')) == ['cam0_3c_timestamps.bin']
+    assert os.path.getsize(tmp_path / 'cam0_3c_timestamps.bin') == 30 * 16
+
+
+def record_trains(session, n_trains, frame_num=0):
+    for train in range(n_trains):
+        for i in range(10):
+            frame = np.full((120, 160, 3), frame_num % 256, dtype='uint8')
+            session.acquire_frame(frame=frame, time_data=time.perf_counter(), frame_num=frame_num)
+            frame_num += 1
+            time.sleep(0.002)
+        time.sleep(0.1)
+    session.recording_status = False
+    time.sleep(0.1)
+    return frame_num
+
+
+def test_consecutive_sessions_keep_previous_files(ic_camera, tmp_path):
+    session = ic_camera.VideoRecordingSession(cam_num=0)
+
+    def cycle_files(base):
+        cycle = [0]
+
+        def next_file():
+            cycle[0] += 1
+            return str(tmp_path / f'{base}{cycle[0]}c1.avi')
+        return next_file
+
+    # first session, rolled over once
+    session.set_params(video_file=str(tmp_path / 'A1.avi'), fourcc='MJPG', fps=100, dim=(160, 120))
+    session.set_rollover(next_file=cycle_files('A'), max_gap=0.05)
+    session.set_recording_status(True)
+    record_trains(session, 2)
+    session.release()
+    session.reset()
+    assert count_frames(str(tmp_path / 'A1.avi')) == count_frames(str(tmp_path / 'A1c1.avi')) == 10
+    assert not os.path.exists(tmp_path / 'A2c1.avi')
+
+    # the second session does not reuse the rollover of the first one, and skips the names that exist
+    session.set_params(video_file=str(tmp_path / 'B1.avi'), fourcc='MJPG', fps=100, dim=(160, 120))
+    assert session.next_file is None and session.standby_thread is None
+    finished = []
+    session.set_rollover(next_file=cycle_files('A'), max_gap=0.05, on_rollover=lambda *args: finished.append(args))
+    session.set_recording_status(True)
+    record_trains(session, 2)
+    last_file = session.video_file
+    session.release()
+    assert session.next_file is None and session.on_rollover is None
+
+    assert count_frames(str(tmp_path / 'A1c1.avi')) == 10
+    assert [args[0] for args in finished] == [str(tmp_path / 'B1.avi')]
+    assert last_file == str(tmp_path / 'A2c1.avi')
+    assert count_frames(last_file) == 10
+    assert not os.path.exists(tmp_path / 'A3c1.avi')